@@ -1,30 +1,48 @@
 """aws accts"""
 
+# pylint: disable=import-outside-toplevel
+
+import argparse
 import logging
-import boto3
 
 logger = logging.getLogger()
-logging.basicConfig(level=logging.ERROR)
 
-acct_client = boto3.client("account")
+TYPES = ["BILLING", "OPERATIONS", "SECURITY"]
+
+
+def get_acct_info():
+    """get contact and alternate contact info for the account."""
+    import boto3
+
+    acct_client = boto3.client("account")
+
+    acct_data = {}
+
+    response = acct_client.get_contact_information()
+
+    acct_data["contact_info"] = {}
+    for k, v in response["ContactInformation"].items():
+        acct_data["contact_info"][k] = v
+        logging.debug("%s => %s", k, v)
+
+    acct_data["alternate_contacts"] = {}
+    for t in TYPES:
+        try:
+            response = acct_client.get_alternate_contact(AlternateContactType=t)
+            logging.debug(response)
+            acct_data["alternate_contacts"][t] = response
+        except RuntimeWarning:
+            logging.error("Error with pulling %s AlternateContact", t)
 
-acct_data = {}
+    return acct_data
 
-response = acct_client.get_contact_information()
 
-acct_data["contact_info"] = {}
-for k, v in response["ContactInformation"].items():
-    acct_data["contact_info"][k] = v
-    logging.debug("%s => %s", k, v)
+def main():
+    """main entrypoint."""
+    argparse.ArgumentParser(description="Get general account information.").parse_args()
+    logging.basicConfig(level=logging.ERROR)
+    print(get_acct_info())
 
-types = ["BILLING", "OPERATIONS", "SECURITY"]
-acct_data["alternate_contacts"] = {}
-for t in types:
-    try:
-        response = acct_client.get_alternate_contact(AlternateContactType=t)
-        logging.debug(response)
-        acct_data["alternate_contacts"][t] = response
-    except RuntimeWarning as e:
-        logging.error("Error with pulling %s AlternateContact", t)
 
-print(acct_data)
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,274 @@
+"""per-api-call metrics for every boto3 client in the process.
+
+    metrics = awsmetrics.enable()
+    ...  # create sessions and clients as usual
+    metrics.save("metrics", "inventory")
+
+enable() adds before-call / after-call / needs-retry handlers to the
+handlers botocore installs on every new session, so tools need no changes
+and nothing is registered unless metrics are turned on. calls, pages,
+response bytes, retries, errors and a latency histogram are kept per
+(service, operation, region).
+"""
+
+# pylint: disable=import-outside-toplevel
+
+import json
+import os
+import threading
+import time
+from datetime import datetime, timezone
+
+# upper bounds in seconds, prometheus style
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+START_KEY = "awsmetrics_start"
+# after-call-error gets no model, so before-call leaves the service name here
+SERVICE_KEY = "awsmetrics_service"
+
+
+class OperationStats:
+    """counters for one (service, operation, region)."""
+
+    __slots__ = ("calls", "pages", "bytes", "retries", "errors", "seconds", "buckets")
+
+    def __init__(self):
+        self.calls = 0
+        self.pages = 0
+        self.bytes = 0
+        self.retries = 0
+        self.errors = {}
+        self.seconds = 0.0
+        # one slot per bucket plus +Inf, not cumulative
+        self.buckets = [0] * (len(LATENCY_BUCKETS) + 1)
+
+    def observe(self, seconds):
+        """count one call that took seconds."""
+        self.calls += 1
+        self.seconds += seconds
+        for i, bound in enumerate(LATENCY_BUCKETS):
+            if seconds <= bound:
+                self.buckets[i] += 1
+                return
+        self.buckets[-1] += 1
+
+    def quantile(self, q):
+        """latency upper bound for quantile q, from the histogram."""
+        rank = q * self.calls
+        seen = 0
+        for bound, count in zip(LATENCY_BUCKETS + (float("inf"),), self.buckets):
+            seen += count
+            if seen >= rank and count:
+                return bound
+        return 0.0
+
+    def to_dict(self):
+        """the counters as json-serializable values."""
+        return {
+            "calls": self.calls,
+            "pages": self.pages,
+            "bytes": self.bytes,
+            "retries": self.retries,
+            "errors": dict(self.errors),
+            "seconds": round(self.seconds, 6),
+            "p50": self.quantile(0.5),
+            "p99": self.quantile(0.99),
+            "buckets": dict(
+                zip([str(b) for b in LATENCY_BUCKETS] + ["+Inf"], self.buckets)
+            ),
+        }
+
+
+class ApiMetrics:
+    """thread-safe per-operation call metrics, fed by botocore events."""
+
+    def __init__(self):
+        self.operations = {}
+        self.attempt_errors = {}
+        self.started = time.time()
+        self._lock = threading.Lock()
+
+    def handlers(self):
+        """(event, handler) pairs to register on a session or client."""
+        return [
+            ("before-call", self._before_call),
+            ("after-call", self._after_call),
+            ("after-call-error", self._after_call_error),
+            ("needs-retry", self._needs_retry),
+        ]
+
+    def attach(self, events):
+        """register on an event emitter, e.g. client.meta.events."""
+        for event, handler in self.handlers():
+            events.register(event, handler)
+
+    def _stats(self, model, context):
+        key = (
+            model.service_model.service_name,
+            model.name,
+            context.get("client_region") or "global",
+        )
+        stats = self.operations.get(key)
+        if stats is None:
+            stats = self.operations.setdefault(key, OperationStats())
+        return stats
+
+    def _before_call(self, model, context, **_):
+        context[START_KEY] = time.perf_counter()
+        context[SERVICE_KEY] = model.service_model.service_name
+
+    def _after_call(self, http_response, parsed, model, context, **_):
+        elapsed = time.perf_counter() - context.pop(START_KEY, time.perf_counter())
+        context.pop(SERVICE_KEY, None)
+        metadata = parsed.get("ResponseMetadata", {})
+        if model.has_streaming_output:
+            # reading the body here would consume the caller's stream
+            size = int(http_response.headers.get("content-length") or 0)
+        else:
+            size = len(http_response.content or b"")
+        with self._lock:
+            stats = self._stats(model, context)
+            stats.observe(elapsed)
+            stats.bytes += size
+            stats.retries += metadata.get("RetryAttempts", 0)
+            if http_response.status_code >= 300:
+                code = parsed.get("Error", {}).get("Code") or "Unknown"
+                stats.errors[code] = stats.errors.get(code, 0) + 1
+            else:
+                stats.pages += 1
+
+    def _after_call_error(self, exception, context, event_name, **_):
+        elapsed = time.perf_counter() - context.pop(START_KEY, time.perf_counter())
+        # after-call-error.<service-id>.<Operation>; the service id differs
+        # from the service name _after_call keys by (elastic-load-balancing-v2
+        # vs elbv2), so prefer the name before-call saved
+        _, service_id, operation = event_name.split(".", 2)
+        service = context.pop(SERVICE_KEY, None) or service_id
+        key = (service, operation, context.get("client_region") or "global")
+        code = type(exception).__name__
+        with self._lock:
+            stats = self.operations.setdefault(key, OperationStats())
+            stats.observe(elapsed)
+            stats.errors[code] = stats.errors.get(code, 0) + 1
+
+    def _needs_retry(self, response=None, caught_exception=None, **_):
+        if response is not None:
+            code = response[1].get("Error", {}).get("Code")
+        elif caught_exception is not None:
+            code = type(caught_exception).__name__
+        else:
+            return
+        if code:
+            with self._lock:
+                self.attempt_errors[code] = self.attempt_errors.get(code, 0) + 1
+
+    def summary(self):
+        """json-serializable snapshot of every counter."""
+        with self._lock:
+            operations = [
+                {"service": s, "operation": o, "region": r, **stats.to_dict()}
+                for (s, o, r), stats in sorted(self.operations.items())
+            ]
+            attempt_errors = dict(self.attempt_errors)
+        return {
+            "started": datetime.fromtimestamp(self.started, timezone.utc).isoformat(),
+            "wall_seconds": round(time.time() - self.started, 3),
+            "calls": sum(op["calls"] for op in operations),
+            "attempt_errors": attempt_errors,
+            "operations": operations,
+        }
+
+    def prometheus(self):
+        """the counters in prometheus text exposition format."""
+        lines = []
+        metrics = [
+            ("aws_api_calls_total", "counter", "API calls made.", "calls"),
+            ("aws_api_pages_total", "counter", "Successful responses.", "pages"),
+            ("aws_api_response_bytes_total", "counter", "Response bytes.", "bytes"),
+            ("aws_api_retries_total", "counter", "Retried attempts.", "retries"),
+        ]
+        with self._lock:
+            operations = sorted(self.operations.items())
+            for name, kind, help_text, attr in metrics:
+                lines += [f"# HELP {name} {help_text}", f"# TYPE {name} {kind}"]
+                for key, stats in operations:
+                    lines.append(f"{name}{{{_labels(key)}}} {getattr(stats, attr)}")
+
+            name = "aws_api_errors_total"
+            lines += [f"# HELP {name} Failed API calls.", f"# TYPE {name} counter"]
+            for key, stats in operations:
+                for code, count in sorted(stats.errors.items()):
+                    lines.append(f'{name}{{{_labels(key)},code="{code}"}} {count}')
+
+            name = "aws_api_call_duration_seconds"
+            lines += [
+                f"# HELP {name} API call latency, including retries.",
+                f"# TYPE {name} histogram",
+            ]
+            for key, stats in operations:
+                labels = _labels(key)
+                seen = 0
+                for bound, count in zip(LATENCY_BUCKETS, stats.buckets):
+                    seen += count
+                    lines.append(f'{name}_bucket{{{labels},le="{bound}"}} {seen}')
+                lines.append(f'{name}_bucket{{{labels},le="+Inf"}} {stats.calls}')
+                lines.append(f"{name}_sum{{{labels}}} {stats.seconds:.6f}")
+                lines.append(f"{name}_count{{{labels}}} {stats.calls}")
+        return "\n".join(lines) + "\n"
+
+    def save(self, output_dir, name="awstools"):
+        """write <name>-<ts>.json and <name>-<ts>.prom; returns both paths."""
+        os.makedirs(output_dir, exist_ok=True)
+        run = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%S.%fZ")
+        base = os.path.join(output_dir, f"{name}-{run}")
+        with open(f"{base}.json", "w", encoding="utf-8") as f:
+            json.dump(self.summary(), f, indent=4)
+        with open(f"{base}.prom", "w", encoding="utf-8") as f:
+            f.write(self.prometheus())
+        return f"{base}.json", f"{base}.prom"
+
+    def print_top(self, limit=10):
+        """print the operations that took the most total time."""
+        with self._lock:
+            rows = sorted(
+                self.operations.items(), key=lambda item: item[1].seconds, reverse=True
+            )[:limit]
+        for (service, operation, region), stats in rows:
+            errors = sum(stats.errors.values())
+            print(
+                f"  {service:24} {operation:32} {region:15} "
+                f"{stats.calls:6} calls {stats.seconds:9.2f}s "
+                f"p99<={stats.quantile(0.99)}s {stats.retries} retries {errors} errors"
+            )
+
+
+def _labels(key):
+    service, operation, region = key
+    return f'service="{service}",operation="{operation}",region="{region}"'
+
+
+_ENABLED = []
+
+
+def enable(metrics=None):
+    """record every client created from now on; returns the ApiMetrics."""
+    import boto3
+    from botocore import handlers
+
+    metrics = metrics or ApiMetrics()
+    pairs = metrics.handlers()
+    handlers.BUILTIN_HANDLERS.extend(pairs)
+    _ENABLED.append((metrics, pairs))
+    # the default session may already exist, e.g. if boto3.client was called
+    if boto3.DEFAULT_SESSION is not None:
+        metrics.attach(boto3.DEFAULT_SESSION.events)
+    return metrics
+
+
+def disable():
+    """stop recording on sessions created from now on."""
+    from botocore import handlers
+
+    while _ENABLED:
+        _, pairs = _ENABLED.pop()
+        for pair in pairs:
+            handlers.BUILTIN_HANDLERS.remove(pair)
@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+"""single entry point for the tools in this repo.
+
+    ./awstools.py <command> [args...]
+
+each command lives in its own directory and is only imported when it is
+run, so --help and listing commands do no network or filesystem work.
+--metrics DIR records every API call the command makes (see awsmetrics.py).
+"""
+
+import argparse
+import importlib
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+# command -> (directory, module, description)
+COMMANDS = {
+    "account": ("account", "aws_get_acct_info", "Get general account information."),
+    "iam-audit": ("iam", "iam_auditor", "Save role and policy documents."),
+    "inventory": (
+        "inventory",
+        "inventory",
+        "Inventory resources across regions and accounts.",
+    ),
+    "inventory-bench": (
+        "inventory",
+        "benchmark",
+        "Benchmark the inventory engine offline.",
+    ),
+    "inventory-index": (
+        "inventory",
+        "index",
+        "Index inventory output and query it.",
+    ),
+    "ip-ranges": ("networking", "aws_ip_ranges", "Grab the AWS IP ranges."),
+    "pricing": ("costops", "aws_pricing", "Get current AWS pricing info."),
+    "s3-nuke": ("sysadmin", "s3_bucket_nuke", "Download and destroy S3 buckets."),
+    "support": ("support", "aws_check_support", "Check your AWS support level."),
+    "support-plan": (
+        "support",
+        "aws_check_support2",
+        "Check your AWS support plan via the supportplans API.",
+    ),
+    "workspaces": (
+        "inventory",
+        "workspaces_inventory",
+        "Report on WorkSpaces with tags and metrics.",
+    ),
+}
+
+
+def load_command(name):
+    """import a command's module."""
+    directory, module_name, _ = COMMANDS[name]
+    path = os.path.join(ROOT, directory)
+    if path not in sys.path:
+        sys.path.insert(0, path)
+    return importlib.import_module(module_name)
+
+
+def main(argv=None):
+    """main entrypoint."""
+    parser = argparse.ArgumentParser(
+        prog="awstools",
+        description="AWS cloud tools.",
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog="commands:\n"
+        + "\n".join(
+            f"  {name:14} {description}"
+            for name, (_, _, description) in sorted(COMMANDS.items())
+        ),
+    )
+    parser.add_argument(
+        "--metrics",
+        metavar="DIR",
+        default=os.environ.get("AWSTOOLS_METRICS"),
+        help="write per-API-call metrics (json and prometheus) to DIR",
+    )
+    parser.add_argument("command", choices=sorted(COMMANDS), metavar="command")
+    parser.add_argument("args", nargs=argparse.REMAINDER, help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    module = load_command(args.command)
+    sys.argv = [f"awstools {args.command}"] + args.args
+    if not args.metrics:
+        return module.main()
+
+    import awsmetrics  # pylint: disable=import-outside-toplevel
+
+    metrics = awsmetrics.enable()
+    try:
+        return module.main()
+    finally:
+        awsmetrics.disable()
+        print("slowest API operations:")
+        metrics.print_top()
+        json_path, prom_path = metrics.save(args.metrics, args.command)
+        print(f"API metrics written to {json_path} and {prom_path}")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
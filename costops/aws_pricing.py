@@ -1,12 +1,12 @@
 """aws pricing"""
+# pylint: disable=import-outside-toplevel
+import argparse
 import json
 import logging
 from datetime import datetime
 import os
 import concurrent.futures
-import requests
 
-logging.basicConfig(level = logging.INFO)
 logger = logging.getLogger(__name__)
 
 TODAY = datetime.now().strftime("%Y-%m-%d")
@@ -14,13 +14,14 @@ API = 'https://pricing.us-east-1.amazonaws.com'
 DATA_DIR = f"{os.environ.get("HOME")}/data/AWS_DATA/{TODAY}"
 HTTP_TIMEOUT = 20
 
-if not os.path.exists(DATA_DIR):
-    os.makedirs(DATA_DIR, exist_ok=True)
-
-WORKERS = (os.cpu_count() -2 ) * 2
+def get_workers():
+    """worker count for offer downloads."""
+    return max(1, (os.cpu_count() or 1) - 2) * 2
 
 def get_offer_data(key, val, url):
     """get offer data."""
+    import requests
+
     logger.info("Getting offer %s data", key)
     url = f'{API}{val['versionIndexUrl']}'
     r = requests.get(url, timeout=HTTP_TIMEOUT).json()
@@ -46,6 +47,8 @@ def get_offer_data(key, val, url):
 
 def get_service_index():
     """Get data."""
+    import requests
+
     resp_svc_index = requests.get(f'{API}/offers/v1.0/aws/index.json', timeout=HTTP_TIMEOUT)
     filename = f'{DATA_DIR}/service_index.json'
     with open(filename, 'w', encoding='utf-8') as f:
@@ -56,6 +59,7 @@ def get_service_index():
 
 def grab_pricing_data():
     """Get pricing data."""
+    os.makedirs(DATA_DIR, exist_ok=True)
     service_index = get_service_index()
 
     logger.info('Preparing to grab %s offers', len(service_index['offers'].items()))
@@ -73,7 +77,7 @@ def grab_pricing_data():
         batch.append(req)
 
     # We can use a with statement to ensure threads are cleaned up promptly
-    with concurrent.futures.ThreadPoolExecutor(max_workers=WORKERS) as executor:
+    with concurrent.futures.ThreadPoolExecutor(max_workers=get_workers()) as executor:
         future_to_url = {
             executor.submit(
                 get_offer_data,
@@ -93,6 +97,8 @@ def grab_pricing_data():
 
 def main():
     """main entrypoint."""
+    argparse.ArgumentParser(description="Get current AWS pricing info.").parse_args()
+    logging.basicConfig(level = logging.INFO)
     grab_pricing_data()
 
 if __name__ == '__main__':
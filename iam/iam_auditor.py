@@ -1,13 +1,25 @@
-import boto3
+# pylint: disable=import-outside-toplevel
+
+import argparse
 import os
 import json
 import logging
 
-logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 
 def main(region_name="us-east-1"):
+    """main entrypoint."""
+    import boto3
+
+    parser = argparse.ArgumentParser(description="Save role and policy documents.")
+    parser.add_argument(
+        "--region", default=region_name, help=f"IAM region (default: {region_name})"
+    )
+    region_name = parser.parse_args().region
+
+    logging.basicConfig(level=logging.INFO)
+
     # Default: us-east-1
     # For GovCloud: 'us-gov-west-1' or 'us-gov-east-1'
     # For AWS China: 'cn-north-1' or 'cn-northwest-1'
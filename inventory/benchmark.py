@@ -0,0 +1,403 @@
+"""offline benchmark for the inventory engine.
+
+runs the real collect_and_save_resources against a synthetic stand-in for
+the AWS endpoints: every client call is answered locally with generated
+pages, serialized to the service's wire protocol with moto's response
+serializers, so parsing, pagination, retries and rate limiting all run as
+they would against AWS. per-call latency and throttling can be injected.
+
+    python benchmark.py --profile large --latency-ms 20 --throttle-rate 0.01
+"""
+
+# pylint: disable=import-outside-toplevel
+
+import argparse
+import json
+import os
+import random
+import resource
+import tempfile
+import threading
+import time
+import warnings
+from datetime import datetime, timezone
+
+import inventory
+
+RESULTS_DIR = "./bench-results"
+DEFAULT_ITEMS = 20
+DEFAULT_PAGE_SIZE = 100
+# synthetic resources per list operation
+PROFILES = {
+    "small": {
+        "describe_instances": 1000,
+        "describe_snapshots": 10000,
+        "list_policies": 5000,
+    },
+    "large": {
+        "describe_instances": 10000,
+        "describe_snapshots": 100000,
+        "list_policies": 50000,
+    },
+}
+# per protocol, the error code botocore treats as throttling
+THROTTLE_ERRORS = {
+    "ec2": "RequestLimitExceeded",
+    "json": "ThrottlingException",
+    "query": "Throttling",
+    "rest-json": "ThrottlingException",
+    "rest-xml": "Throttling",
+}
+SYNTHETIC_TIME = datetime(2024, 1, 1, tzinfo=timezone.utc)
+
+
+class SyntheticError(Exception):
+    """error response served by the stand-in."""
+
+    def __init__(self, code, message):
+        super().__init__(message)
+        self.code = code
+        self.message = message
+
+
+class _Body:
+    """minimal raw body for botocore's AWSResponse."""
+
+    def __init__(self, content):
+        self.content = content
+
+    def stream(self, **_):
+        """the whole body as one chunk."""
+        yield self.content
+
+
+def synthesize(shape, index, name="", depth=0):
+    """a deterministic value for shape; index makes ids unique per item."""
+    type_name = shape.type_name
+    if type_name == "structure":
+        if depth > 3:
+            return {}
+        members = {
+            member: member_shape
+            for member, member_shape in shape.members.items()
+            if not member_shape.type_name == "blob"
+        }
+        if shape.metadata.get("union"):
+            # exactly one member may be set
+            members = dict(list(members.items())[:1])
+        return {
+            member: synthesize(member_shape, index, member, depth + 1)
+            for member, member_shape in members.items()
+        }
+    if type_name == "list":
+        if depth > 3:
+            return []
+        return [synthesize(shape.member, index, name, depth + 1)]
+    if type_name == "map":
+        if depth > 3:
+            return {}
+        return {"key": synthesize(shape.value, index, name, depth + 1)}
+    if type_name == "string":
+        if shape.enum:
+            return shape.enum[0]
+        if name.lower().endswith("arn"):
+            return f"arn:aws:bench:us-east-1:000000000000:{name}/{index}"
+        return f"{name or 'value'}-{index}"
+    if type_name in ("integer", "long"):
+        return index
+    if type_name in ("float", "double"):
+        return float(index)
+    if type_name == "boolean":
+        return False
+    if type_name == "timestamp":
+        return SYNTHETIC_TIME
+    return None
+
+
+class SyntheticAWS:
+    """answers every api call with generated, paginated results.
+
+    items sets how many resources each operation (by snake_case name) lists;
+    everything else lists DEFAULT_ITEMS. latency is slept per attempt, and
+    throttle_rate is the share of attempts answered with a throttling error.
+    """
+
+    def __init__(self, items=None, latency=0.0, throttle_rate=0.0, seed=0):
+        import botocore.session
+
+        self.items = items or {}
+        self.latency = latency
+        self.throttle_rate = throttle_rate
+        self.calls = 0
+        self.throttles = 0
+        self.bytes = 0
+        self.seconds = 0.0
+        self._responses = {}
+        self._random = random.Random(seed)
+        self._pending = threading.local()
+        self._lock = threading.Lock()
+        self._loader = botocore.session.get_session()
+        self._paginators = {}
+
+    def install(self, client):
+        """answer client's calls locally; use as an inventory.CLIENT_HOOKS entry."""
+        client.meta.events.register("before-parameter-build", self._remember)
+        # after the rate limiter, which is also registered first
+        client.meta.events.register_first("before-send", self._respond)
+
+    def _remember(self, params, model, **_):
+        self._pending.call = (model, dict(params))
+
+    def _paginator_config(self, model):
+        service = model.service_model.service_name
+        if service not in self._paginators:
+            try:
+                config = self._loader.get_paginator_model(service)
+                # botocore only exposes per-operation lookups that raise for
+                # unpaginated operations; the raw dict answers both at once
+                # pylint: disable-next=protected-access
+                self._paginators[service] = config._paginator_config
+            except Exception:  # pylint: disable=broad-except
+                self._paginators[service] = {}
+        return self._paginators[service].get(model.name)
+
+    def _respond(self, request, **_):
+        from botocore.awsrequest import AWSResponse
+
+        model, params = self._pending.call
+        if self.latency:
+            time.sleep(self.latency)
+        with self._lock:
+            self.calls += 1
+            throttled = self._random.random() < self.throttle_rate
+            self.throttles += throttled
+
+        started = time.perf_counter()
+        # pages repeat across accounts and regions; serialize each only once
+        key = (model.service_model.service_name, model.name, throttled, repr(params))
+        response = self._responses.get(key)
+        if response is None:
+            response = self._serialize(model, params, throttled)
+            self._responses[key] = response
+        status, headers, body = response
+        with self._lock:
+            self.bytes += len(body)
+            self.seconds += time.perf_counter() - started
+        http = AWSResponse(request.url, status, headers, _Body(body))
+        http._content = body  # pylint: disable=protected-access
+        return http
+
+    def _serialize(self, model, params, throttled):
+        """the wire response for one call, as (status, headers, body)."""
+        from moto.core.serialize import get_serializer_class
+        from moto.core.utils import get_service_model
+
+        service = model.service_model.service_name
+        # the protocol botocore will parse the response with
+        protocol = model.service_model.resolved_protocol
+        if throttled:
+            code = THROTTLE_ERRORS.get(protocol, "Throttling")
+            result = SyntheticError(code, "Rate exceeded")
+        else:
+            result = self._page(model, params)
+        # moto's serializers want its own shape classes
+        moto_model = get_service_model(service).operation_model(model.name)
+        serializer = get_serializer_class(service, protocol)(moto_model)
+        with warnings.catch_warnings():
+            # synthetic errors are not in the service's error shapes
+            warnings.simplefilter("ignore")
+            response = serializer.serialize(result)
+        body = response["body"]
+        body = body.encode("utf-8") if isinstance(body, str) else body
+        return response["status_code"], response["headers"], body
+
+    def _page(self, model, params):
+        """one page of results for the call."""
+        output = model.output_shape
+        if output is None:
+            return {}
+        config = self._paginator_config(model) or {}
+        result_keys = _as_list(config.get("result_key"))
+        result_key = next(
+            (key for key in result_keys if key in output.members),
+            None,
+        ) or next(
+            (
+                name
+                for name, shape in output.members.items()
+                if shape.type_name == "list"
+            ),
+            None,
+        )
+        if result_key is None:
+            return synthesize(output, 0)
+
+        total = self.items.get(_snake(model.name), DEFAULT_ITEMS)
+        start = 0
+        for token in _as_list(config.get("input_token")) or ["NextToken"]:
+            if params.get(token):
+                start = int(params[token])
+                break
+        limit_key = config.get("limit_key")
+        page_size = int(params.get(limit_key) or DEFAULT_PAGE_SIZE)
+        end = min(total, start + page_size)
+
+        member = output.members[result_key].member
+        page = {
+            result_key: [synthesize(member, i, result_key) for i in range(start, end)]
+        }
+        if end < total:
+            output_tokens = _as_list(config.get("output_token")) or ["NextToken"]
+            for token in output_tokens:
+                if token in output.members:
+                    page[token] = str(end)
+            if config.get("more_results") in output.members:
+                page[config["more_results"]] = True
+        return page
+
+
+def _as_list(value):
+    if value is None:
+        return []
+    return value if isinstance(value, list) else [value]
+
+
+def _snake(name):
+    return "".join(f"_{c.lower()}" if c.isupper() else c for c in name).lstrip("_")
+
+
+def run_benchmark(
+    items=None,
+    accounts=1,
+    regions=("us-east-1",),
+    latency=0.0,
+    throttle_rate=0.0,
+    collectors=None,
+):
+    """run the engine against the stand-in and return its metrics."""
+    import boto3
+
+    synthetic = SyntheticAWS(items, latency, throttle_rate)
+    inventory.CLIENT_HOOKS.append(synthetic.install)
+    data_root = inventory.DATA_ROOT
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            inventory.DATA_ROOT = tmp
+            pools = [
+                inventory.ClientPool(
+                    boto3.Session(
+                        aws_access_key_id="bench",
+                        aws_secret_access_key="bench",
+                        region_name="us-east-1",
+                    ),
+                    f"{100000000000 + n:012d}",
+                )
+                for n in range(accounts)
+            ]
+            tasks = sum(
+                len(inventory.plan_tasks(pool, list(regions), collectors))
+                for pool in pools
+            )
+            started = time.perf_counter()
+            counts = inventory.collect_and_save_resources(
+                regions=list(regions), collectors=collectors, pools=pools
+            )
+            wall = time.perf_counter() - started
+    finally:
+        inventory.CLIENT_HOOKS.remove(synthetic.install)
+        inventory.DATA_ROOT = data_root
+
+    return {
+        "wall_seconds": round(wall, 3),
+        "tasks": tasks,
+        "tasks_per_second": round(tasks / wall, 2),
+        "api_calls": synthetic.calls,
+        "api_calls_per_second": round(synthetic.calls / wall, 2),
+        "throttles_injected": synthetic.throttles,
+        "response_bytes": synthetic.bytes,
+        # summed across worker threads, so it can exceed wall_seconds
+        "stand_in_thread_seconds": round(synthetic.seconds, 3),
+        "resources": sum(counts.values()),
+        # ru_maxrss is in KiB on linux
+        "peak_rss_mb": round(
+            resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1
+        ),
+    }
+
+
+def save_results(result, results_dir=RESULTS_DIR):
+    """write a benchmark result as json and return its path."""
+    os.makedirs(results_dir, exist_ok=True)
+    run = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%S.%fZ")
+    path = f"{results_dir}/inventory-{run}.json"
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(result, f, indent=4, sort_keys=True)
+    return path
+
+
+def compare(result, baseline_path):
+    """print each metric against a previous result."""
+    with open(baseline_path, encoding="utf-8") as f:
+        baseline = json.load(f)["metrics"]
+    for key, value in sorted(result["metrics"].items()):
+        before = baseline.get(key)
+        if isinstance(before, (int, float)) and before:
+            print(f"{key:22} {before:>12} -> {value:>12} ({value / before:.2f}x)")
+
+
+def main(argv=None):
+    """main entrypoint."""
+    parser = argparse.ArgumentParser(description="Benchmark the inventory engine.")
+    parser.add_argument("--profile", choices=sorted(PROFILES), default="small")
+    parser.add_argument(
+        "--items",
+        action="append",
+        default=[],
+        metavar="OPERATION=N",
+        help="resources listed by an operation, e.g. describe_snapshots=100000",
+    )
+    parser.add_argument("--accounts", type=int, default=1)
+    parser.add_argument("--regions", default="us-east-1")
+    parser.add_argument("--latency-ms", type=float, default=0.0)
+    parser.add_argument("--throttle-rate", type=float, default=0.0)
+    parser.add_argument(
+        "--collector",
+        action="append",
+        dest="collectors",
+        help="only run this collector (repeatable)",
+    )
+    parser.add_argument("--results-dir", default=RESULTS_DIR)
+    parser.add_argument("--baseline", help="previous result to compare against")
+    args = parser.parse_args(argv)
+
+    items = dict(PROFILES[args.profile])
+    for item in args.items:
+        operation, count = item.split("=")
+        items[operation] = int(count)
+    config = {
+        "profile": args.profile,
+        "items": items,
+        "accounts": args.accounts,
+        "regions": args.regions.split(","),
+        "latency_ms": args.latency_ms,
+        "throttle_rate": args.throttle_rate,
+        "collectors": args.collectors,
+        "workers": inventory.WORKERS,
+    }
+    metrics = run_benchmark(
+        items,
+        args.accounts,
+        config["regions"],
+        args.latency_ms / 1000,
+        args.throttle_rate,
+        args.collectors,
+    )
+    result = {"config": config, "metrics": metrics}
+    print(json.dumps(metrics, indent=4, sort_keys=True))
+    print(f"Results written to {save_results(result, args.results_dir)}")
+    if args.baseline:
+        compare(result, args.baseline)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,375 @@
+"""local query index over inventory output.
+
+loads every output file under the data directory into a sqlite database
+(with the JSON1 functions) indexed by account, region, service, resource
+type, ARN, id and tag, so lookups need no json files loaded:
+
+    python index.py build
+    python index.py query --tag owner=alice
+    python index.py query --arn arn:aws:iam::111111111111:role/admin
+    python index.py query --type Vpcs --field CidrBlock=10.0.0.0/16
+
+build is incremental: only files whose size or mtime changed since the
+last build are re-read, and files that are gone are dropped.
+"""
+
+import argparse
+import glob
+import json
+import os
+import re
+import sqlite3
+import sys
+import time
+
+import inventory
+
+INDEX_FILE = ".index.sqlite"
+# {account}-{service}-{region}-{output}.json / .ndjson[.gz|.zst]
+OUTPUT_NAME = re.compile(
+    r"^(?P<account>\d{12})-(?P<service>[a-z0-9-]+?)-"
+    r"(?P<region>[a-z]{2}(?:-[a-z]+)+-\d+)-(?P<output>.+?)"
+    r"\.(?:json|ndjson(?:\.gz|\.zst)?)$"
+)
+# response keys whose items wrap the resources worth indexing
+NESTED_RESOURCES = {"Reservations": "Instances"}
+# resource types in the outputs custom collectors write, by (service, output)
+FUNCTION_OUTPUTS = {
+    ("ec2", "details-snapshots"): "Snapshots",
+    ("ec2", "details-images"): "Images",
+    ("elbv2", "details"): "TargetGroups",
+    ("guardduty", "details"): "Detectors",
+    ("guardduty", "findings"): "Findings",
+    ("guardduty", "findings-updates"): "Findings",
+}
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT PRIMARY KEY,
+    size INTEGER,
+    mtime_ns INTEGER
+);
+CREATE TABLE IF NOT EXISTS resources (
+    id INTEGER PRIMARY KEY,
+    path TEXT NOT NULL,
+    account TEXT,
+    region TEXT,
+    service TEXT,
+    type TEXT,
+    resource_id TEXT,
+    arn TEXT,
+    body TEXT
+);
+CREATE TABLE IF NOT EXISTS tags (
+    resource INTEGER NOT NULL,
+    key TEXT,
+    value TEXT
+);
+CREATE INDEX IF NOT EXISTS resources_path ON resources (path);
+CREATE INDEX IF NOT EXISTS resources_account ON resources (account);
+CREATE INDEX IF NOT EXISTS resources_region ON resources (region);
+CREATE INDEX IF NOT EXISTS resources_service ON resources (service);
+CREATE INDEX IF NOT EXISTS resources_type ON resources (type);
+CREATE INDEX IF NOT EXISTS resources_resource_id ON resources (resource_id);
+CREATE INDEX IF NOT EXISTS resources_arn ON resources (arn);
+CREATE INDEX IF NOT EXISTS tags_key_value ON tags (key, value);
+CREATE INDEX IF NOT EXISTS tags_resource ON tags (resource);
+"""
+
+
+def index_path(data_root=None):
+    """where the index for a data directory lives."""
+    return f"{data_root or inventory.DATA_ROOT}/{INDEX_FILE}"
+
+
+def connect(path):
+    """open (and create) the index database."""
+    db = sqlite3.connect(path)
+    db.executescript(SCHEMA)
+    return db
+
+
+def output_files(data_root=None):
+    """every output file, preferring streamed ndjson over its rendered json."""
+    data_root = data_root or inventory.DATA_ROOT
+    streamed = glob.glob(f"{data_root}/*/*.ndjson*")
+    streamed_bases = {path.rpartition(".ndjson")[0] for path in streamed}
+    paths = [
+        path
+        for path in glob.glob(f"{data_root}/*/*.json")
+        if path[: -len(".json")] not in streamed_bases
+    ] + streamed
+    return sorted(p for p in paths if OUTPUT_NAME.match(os.path.basename(p)))
+
+
+def read_resources(path):
+    """the resources in one output file."""
+    if path.endswith(".json"):
+        with open(path, encoding="utf-8") as f:
+            try:
+                data = json.load(f)
+            except ValueError:
+                return []
+        return data if isinstance(data, list) else [data]
+    compression = None
+    for name, suffix in inventory.COMPRESSION_SUFFIXES.items():
+        if suffix and path.endswith(suffix):
+            compression = name
+    with inventory.open_output(path, "r", compression) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def resource_tags(resource):
+    """(key, value) pairs from the usual tag shapes."""
+    if not isinstance(resource, dict):
+        return []
+    tags = resource.get("Tags", resource.get("TagList", resource.get("tags")))
+    if isinstance(tags, dict):
+        return [(str(key), str(value)) for key, value in tags.items()]
+    pairs = []
+    for tag in tags or []:
+        if isinstance(tag, dict):
+            key = tag.get("Key", tag.get("key"))
+            value = tag.get("Value", tag.get("value"))
+            if key is not None:
+                pairs.append((key, value))
+    return pairs
+
+
+def drop_file(db, path):
+    """remove a file's resources and tags from the index."""
+    db.execute(
+        "DELETE FROM tags WHERE resource IN "
+        "(SELECT id FROM resources WHERE path = ?)",
+        (path,),
+    )
+    db.execute("DELETE FROM resources WHERE path = ?", (path,))
+
+
+def output_types():
+    """resource type by (service, output) for every registered collector.
+
+    api collectors list their response key under the plain output, each
+    shard's {output}-{label} and the config-sourced {output}-config.
+    """
+    types = dict(FUNCTION_OUTPUTS)
+    for collector in inventory.COLLECTORS.values():
+        if collector.key is None:
+            continue
+        labels = [label for label, _ in collector.shards]
+        for label in [None, inventory.CONFIG_OUTPUT_LABEL] + labels:
+            output = (
+                collector.output if label is None else f"{collector.output}-{label}"
+            )
+            types[(collector.service, output)] = collector.key
+    return types
+
+
+def index_file(db, path, types=None):
+    """replace a file's rows with its current content; returns the row count."""
+    fields = OUTPUT_NAME.match(os.path.basename(path)).groupdict()
+    types = output_types() if types is None else types
+    # outputs no collector claims keep their name as the type
+    resource_type = types.get((fields["service"], fields["output"]), fields["output"])
+    rows = []
+    for resource in read_resources(path):
+        nested = NESTED_RESOURCES.get(resource_type)
+        if nested and isinstance(resource, dict):
+            rows += [(nested, item) for item in resource.get(nested, [])]
+        else:
+            rows.append((resource_type, resource))
+
+    drop_file(db, path)
+    for kind, resource in rows:
+        arn = inventory.resource_arn(resource) if isinstance(resource, dict) else None
+        cursor = db.execute(
+            "INSERT INTO resources "
+            "(path, account, region, service, type, resource_id, arn, body) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (
+                path,
+                fields["account"],
+                fields["region"],
+                fields["service"],
+                kind,
+                inventory.natural_id(resource, kind),
+                arn,
+                json.dumps(resource, sort_keys=True, default=str),
+            ),
+        )
+        db.executemany(
+            "INSERT INTO tags (resource, key, value) VALUES (?, ?, ?)",
+            [(cursor.lastrowid, key, value) for key, value in resource_tags(resource)],
+        )
+    return len(rows)
+
+
+def build(data_root=None, db_path=None):
+    """bring the index up to date; returns (files indexed, unchanged, removed)."""
+    db = connect(db_path or index_path(data_root))
+    known = {
+        path: (size, mtime_ns)
+        for path, size, mtime_ns in db.execute("SELECT path, size, mtime_ns FROM files")
+    }
+    indexed = unchanged = 0
+    types = output_types()
+    paths = output_files(data_root)
+    for path in paths:
+        stat = os.stat(path)
+        if known.get(path) == (stat.st_size, stat.st_mtime_ns):
+            unchanged += 1
+            continue
+        with db:
+            index_file(db, path, types)
+            db.execute(
+                "INSERT OR REPLACE INTO files (path, size, mtime_ns) VALUES (?, ?, ?)",
+                (path, stat.st_size, stat.st_mtime_ns),
+            )
+        indexed += 1
+    removed = set(known) - set(paths)
+    with db:
+        for path in removed:
+            drop_file(db, path)
+            db.execute("DELETE FROM files WHERE path = ?", (path,))
+    db.close()
+    return indexed, unchanged, len(removed)
+
+
+def as_number(value):
+    """value as an int or float when it parses as one, else unchanged."""
+    for cast in (int, float):
+        try:
+            return cast(value)
+        except ValueError:
+            pass
+    return value
+
+
+def query(
+    db_path=None,
+    account=None,
+    region=None,
+    service=None,
+    resource_type=None,
+    resource_id=None,
+    arn=None,
+    tags=(),
+    fields=(),
+    limit=None,
+):
+    """matching resources as dicts.
+
+    tags are KEY or KEY=VALUE; fields are JSON.PATH=VALUE, matched against
+    the stored resource with json_extract. matches are exact: a VALUE that
+    parses as a number also matches that JSON number, e.g. Size=8.
+    """
+    where, params = [], []
+    for column, value in (
+        ("account", account),
+        ("region", region),
+        ("service", service),
+        ("type", resource_type),
+        ("resource_id", resource_id),
+        ("arn", arn),
+    ):
+        if value is not None:
+            where.append(f"r.{column} = ?")
+            params.append(value)
+    for tag in tags:
+        key, has_value, value = tag.partition("=")
+        if has_value:
+            where.append(
+                "r.id IN (SELECT resource FROM tags WHERE key = ? AND value = ?)"
+            )
+            params += [key, value]
+        else:
+            where.append("r.id IN (SELECT resource FROM tags WHERE key = ?)")
+            params.append(key)
+    for field in fields:
+        path, _, value = field.partition("=")
+        where.append("json_extract(r.body, ?) IN (?, ?)")
+        params += [f"$.{path}", value, as_number(value)]
+    sql = (
+        "SELECT account, region, service, type, resource_id, arn, body FROM resources r"
+    )
+    if where:
+        sql += " WHERE " + " AND ".join(where)
+    if limit:
+        sql += f" LIMIT {int(limit)}"
+    db = sqlite3.connect(db_path or index_path())
+    try:
+        columns = ("account", "region", "service", "type", "id", "arn", "resource")
+        return [
+            dict(zip(columns, row[:-1] + (json.loads(row[-1]),)))
+            for row in db.execute(sql, params)
+        ]
+    finally:
+        db.close()
+
+
+def main(argv=None):
+    """main entrypoint."""
+    parser = argparse.ArgumentParser(description="Index and query inventory output.")
+    parser.add_argument("--data", default=inventory.DATA_ROOT, help="data directory")
+    parser.add_argument("--db", help=f"index file (default: <data>/{INDEX_FILE})")
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("build", help="index new and changed output files")
+    lookup = commands.add_parser("query", help="look up indexed resources")
+    lookup.add_argument("--account")
+    lookup.add_argument("--region")
+    lookup.add_argument("--service")
+    lookup.add_argument("--type", dest="resource_type", help="e.g. Vpcs, Instances")
+    lookup.add_argument("--id", dest="resource_id")
+    lookup.add_argument("--arn")
+    lookup.add_argument(
+        "--tag", action="append", default=[], help="KEY or KEY=VALUE (repeatable)"
+    )
+    lookup.add_argument(
+        "--field",
+        action="append",
+        default=[],
+        help="JSON.PATH=VALUE matched exactly in the resource; numbers match "
+        "JSON numbers too (repeatable)",
+    )
+    lookup.add_argument("--limit", type=int)
+    lookup.add_argument("--full", action="store_true", help="print whole resources")
+    args = parser.parse_args(argv)
+    db_path = args.db or index_path(args.data)
+    # plugin collectors' outputs resolve to their response keys too
+    inventory.load_plugins()
+
+    if args.command == "build":
+        started = time.perf_counter()
+        indexed, unchanged, removed = build(args.data, db_path)
+        print(
+            f"{indexed} files indexed, {unchanged} unchanged, {removed} removed "
+            f"in {time.perf_counter() - started:.2f}s"
+        )
+        return
+
+    started = time.perf_counter()
+    results = query(
+        db_path,
+        args.account,
+        args.region,
+        args.service,
+        args.resource_type,
+        args.resource_id,
+        args.arn,
+        args.tag,
+        args.field,
+        args.limit,
+    )
+    for result in results:
+        if args.full:
+            print(json.dumps(result, indent=4, sort_keys=True, default=str))
+        else:
+            print(
+                f"{result['account']} {result['region']:15} {result['service']:15} "
+                f"{result['type']:24} {result['arn'] or result['id']}"
+            )
+    elapsed = (time.perf_counter() - started) * 1000
+    print(f"{len(results)} resources in {elapsed:.1f}ms", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
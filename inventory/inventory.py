@@ -1,415 +1,2212 @@
-"""inventory4."""
+"""inventory4.
 
+importing this module does no network or filesystem work; boto3 is only
+imported once a collector actually runs.
+"""
+
+# pylint: disable=import-outside-toplevel
+
+import argparse
+import functools
+import glob
+import gzip
+import hashlib
+import importlib
+import io
 import os
 import json
-from concurrent.futures import ThreadPoolExecutor, as_completed
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from collections import Counter, deque, namedtuple
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
 
-from botocore.client import Config
+def client_config(max_connections):
+    """botocore config for inventory clients.
+
+    throttled calls are retried; the pacing itself comes from RateLimiter.
+    """
+    from botocore.client import Config
+
+    return Config(
+        connect_timeout=5,
+        retries={"total_max_attempts": 8, "mode": "standard"},
+        max_pool_connections=max_connections,
+    )
 
-config = Config(connect_timeout=5, retries={"max_attempts": 0})
 
+def aws_errors():
+    """exceptions raised by failed aws calls."""
+    from botocore.exceptions import BotoCoreError, ClientError
 
-import boto3
-import botocore
+    return (BotoCoreError, ClientError)
 
 
+@functools.lru_cache(maxsize=None)
 def get_aws_account_id():
-    """get the aws account id."""
+    """get the aws account id (once per run)."""
+    import boto3
+
     return boto3.client("sts").get_caller_identity()["Account"]
 
 
-AWS_ID = get_aws_account_id()
 WORKERS = 35
-DATA_DIR = f"./data/{AWS_ID}"
+# org mode: role assumed in every account, and in-flight tasks per account
+ORG_ROLE_NAME = "OrganizationAccountAccessRole"
+ACCOUNT_CONCURRENCY = 10
+# caps on in-flight tasks so one slow region or service cannot hold the pool
+REGION_CONCURRENCY = 8
+SERVICE_CONCURRENCY = 12
+# per-resource calls a single task fans out (see fan_out), and the share of
+# WORKERS reserved for such calls across all tasks. the scheduler runs at most
+# TASK_WORKERS tasks, so tasks and fan-outs together stay within WORKERS
+NESTED_CONCURRENCY = 8
+NESTED_WORKERS = 8
+NESTED_BUDGET = threading.BoundedSemaphore(NESTED_WORKERS)
+TASK_WORKERS = WORKERS - NESTED_WORKERS
+# get_findings takes at most 50 finding ids
+GUARDDUTY_BATCH = 50
+# incremental ec2 snapshots/images: filter values per call, and runs it
+# takes to reconcile every indexed item once
+EC2_FILTER_VALUES = 200
+EC2_RECONCILE_SLICES = 24
+EC2_KINDS = {
+    "Snapshots": {
+        "method": "describe_snapshots",
+        "id": "SnapshotId",
+        "id_filter": "snapshot-id",
+        "state": "State",
+        "time": "StartTime",
+        "time_filter": "start-time",
+    },
+    "Images": {
+        "method": "describe_images",
+        "id": "ImageId",
+        "id_filter": "image-id",
+        "state": "State",
+        "time": "CreationDate",
+        "time_filter": "creation-date",
+    },
+}
+# global services are only collected once, from their home region
+GLOBAL_SERVICES = {
+    "cloudfront": "us-east-1",
+    "iam": "us-east-1",
+    "route53": "us-east-1",
+    "route53domains": "us-east-1",
+    "s3": "us-east-1",
+}
+# per-endpoint request rate (calls/s): start, floor and ceiling
+INITIAL_RATE = 20.0
+MIN_RATE = 0.5
+MAX_RATE = 100.0
+THROTTLE_CODES = {
+    "BandwidthLimitExceeded",
+    "EC2ThrottledException",
+    "LimitExceededException",
+    "PriorRequestNotComplete",
+    "ProvisionedThroughputExceededException",
+    "RequestLimitExceeded",
+    "RequestThrottled",
+    "RequestThrottledException",
+    "SlowDown",
+    "ThrottledException",
+    "Throttling",
+    "ThrottlingException",
+    "TooManyRequestsException",
+}
+DATA_ROOT = "./data"
+# set from the command line; stream writes each page to ndjson as it arrives,
+# snapshots only rewrites changed files (see SnapshotStore),
+# tags joins tags from the tagging api onto collected resources,
+# and incremental lets collectors that keep state pull only what changed
+OUTPUT_OPTIONS = {
+    "stream": False,
+    "compression": None,
+    "snapshots": False,
+    "tags": True,
+    "incremental": False,
+}
+COMPRESSION_SUFFIXES = {None: "", "gzip": ".gz", "zstd": ".zst"}
+# task durations of earlier runs, used to start the longest tasks first
+HISTORY_FILE = ".history.json"
+# estimated seconds for tasks with no history; known giants go first
+DEFAULT_TASK_SECONDS = 1.0
+PRIOR_TASK_SECONDS = {
+    "ec2.details[snapshots]": 60.0,
+    "iam.list_policies": 30.0,
+    "backup.list_backup_jobs": 30.0,
+}
 
-if not os.path.exists(DATA_DIR):
-    os.makedirs(DATA_DIR)
 
+def data_dir(account_id=None):
+    """output directory for an account."""
+    path = f"{DATA_ROOT}/{account_id or get_aws_account_id()}"
+    os.makedirs(path, exist_ok=True)
+    return path
 
-def get_all_regions():
-    """get all regions."""
-    ec2 = boto3.client("ec2")
-    # FIXME: this is a temp hardcoded region
-    # return [region["RegionName"] for region in ec2.describe_regions()["Regions"]]
-    return ["us-east-1"]
 
+def load_state(account_id, name):
+    """state a collector kept from its last run, e.g. a high-water mark."""
+    path = f"{data_dir(account_id)}/.state/{name}.json"
+    if not os.path.exists(path):
+        return {}
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
 
-def paginate_and_collect(client, method_name, key):
-    """paginate and collect."""
-    paginator = client.get_paginator(method_name)
-    resources = []
+
+def save_state(account_id, name, state):
+    """persist a collector's state; call once its output is written."""
+    path = f"{data_dir(account_id)}/.state/{name}.json"
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(f"{path}.tmp", "w", encoding="utf-8") as f:
+        json.dump(state, f, indent=1, sort_keys=True)
+    os.replace(f"{path}.tmp", path)
+
+
+def list_org_accounts(session=None):
+    """active account ids in the organization."""
+    import boto3
+
+    session = session or boto3.Session()
+    paginator = session.client("organizations").get_paginator("list_accounts")
+    accounts = []
     for page in paginator.paginate():
-        resources.extend(page.get(key, []))
-    return resources
+        for account in page["Accounts"]:
+            if account["Status"] == "ACTIVE":
+                accounts.append(account["Id"])
+    return sorted(accounts)
 
 
-def handle_non_paginated_service(client, method_name, key, params=None):
-    """handle non paginated service."""
-    if params is None:
-        params = {}
+def assume_role_session(account_id, role_name=ORG_ROLE_NAME, session=None):
+    """session for account_id through role_name.
 
-    method = getattr(client, method_name)
+    the credentials are fetched on first use, cached, and refreshed by
+    botocore shortly before they expire, so long runs outlive the role
+    session duration.
+    """
+    import boto3
+    import botocore.credentials
+    import botocore.session
 
-    svc_name = client.meta.service_model.service_name
+    sts = (session or boto3.Session()).client("sts")
+    role_arn = f"arn:aws:iam::{account_id}:role/{role_name}"
 
-    # Special handling for services that require specific parameters
-    if svc_name == "ssm" and method_name == "get_parameters_by_path":
-        if "Path" not in params:
-            params["Path"] = "/"  # Specify the root path or another base path here
+    def refresh():
+        credentials = sts.assume_role(RoleArn=role_arn, RoleSessionName="inventory")[
+            "Credentials"
+        ]
+        return {
+            "access_key": credentials["AccessKeyId"],
+            "secret_key": credentials["SecretAccessKey"],
+            "token": credentials["SessionToken"],
+            "expiry_time": credentials["Expiration"].isoformat(),
+        }
 
-    # if svc_name == "wafv2" and method_name == "list_ip_sets":
-    #     if "Scope" not in params:
-    #         params["Scope"] = "CLOUDFRONT"  # CLOUDFRONT or REGIONAL
+    botocore_session = botocore.session.get_session()
+    # pylint: disable=protected-access
+    botocore_session._credentials = botocore.credentials.DeferredRefreshableCredentials(
+        refresh_using=refresh, method="sts-assume-role"
+    )
+    return boto3.Session(botocore_session=botocore_session)
+
+
+def account_pools(accounts=None, role_name=ORG_ROLE_NAME):
+    """one ClientPool per account; the caller's own account needs no role."""
+    if not accounts:
+        return [ClientPool()]
+    import boto3
+
+    base = boto3.Session()
+    pools = []
+    for account_id in accounts:
+        if account_id == get_aws_account_id():
+            pools.append(ClientPool(base, account_id))
+        else:
+            session = assume_role_session(account_id, role_name, base)
+            pools.append(ClientPool(session, account_id))
+    return pools
+
+
+def get_all_regions(session=None):
+    """get all regions enabled for the account.
+
+    opt-in regions are only returned once opted in; INVENTORY_REGIONS
+    (comma separated) overrides discovery.
+    """
+    override = os.environ.get("INVENTORY_REGIONS")
+    if override:
+        return [region.strip() for region in override.split(",") if region.strip()]
+
+    import boto3
+
+    session = session or boto3.Session()
+    ec2 = session.client("ec2", region_name=session.region_name or "us-east-1")
+    response = ec2.describe_regions(
+        Filters=[
+            {
+                "Name": "opt-in-status",
+                "Values": ["opt-in-not-required", "opted-in"],
+            },
+        ]
+    )
+    return sorted(region["RegionName"] for region in response["Regions"])
+
+
+class RateLimiter:
+    """adaptive token bucket shared by every call to one endpoint.
+
+    the rate is halved on each throttle and creeps back up by one call/s
+    per successful call (AIMD), so threads sharing an endpoint back off
+    together instead of retrying into the same limit.
+    """
+
+    def __init__(self, rate=INITIAL_RATE, min_rate=MIN_RATE, max_rate=MAX_RATE):
+        self.rate = rate
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.tokens = rate
+        self.throttles = 0
+        self.calls = 0
+        self.waited = 0.0
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """take a token, sleeping until one is available."""
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(
+                self.rate, self.tokens + (now - self._updated) * self.rate
+            )
+            self._updated = now
+            # reserve the token now and sleep off the debt outside the lock
+            self.tokens -= 1
+            delay = -self.tokens / self.rate if self.tokens < 0 else 0.0
+            self.calls += 1
+            self.waited += delay
+        if delay:
+            time.sleep(delay)
+
+    def throttled(self):
+        """slow down after a throttling error."""
+        with self._lock:
+            self.throttles += 1
+            self.rate = max(self.min_rate, self.rate / 2)
+            self.tokens = min(self.tokens, 0.0)
+
+    def succeeded(self):
+        """speed back up after a successful call."""
+        with self._lock:
+            self.rate = min(self.max_rate, self.rate + 1)
+
+
+def attach_rate_limiter(client, limiter):
+    """pace every attempt made by client through limiter."""
+
+    def before_send(**_):
+        limiter.acquire()
+
+    def needs_retry(response=None, **_):
+        if response is None:
+            return
+        http_response, parsed = response
+        if parsed.get("Error", {}).get("Code") in THROTTLE_CODES:
+            limiter.throttled()
+        elif http_response.status_code < 400:
+            limiter.succeeded()
+
+    # first, so stubs and mocks registered later are paced too
+    client.meta.events.register_first("before-send", before_send)
+    # first, so it sees every attempt before the retry handler answers
+    client.meta.events.register_first("needs-retry", needs_retry)
+
+
+# callables run on every client the pools build, e.g. to attach event
+# handlers for benchmarks; each is called with the new client
+CLIENT_HOOKS = []
+
+
+class ClientPool:
+    """thread-safe cache of boto3 clients for the whole run.
+
+    clients are keyed by (account, service, region) and built once, with a
+    connection pool sized for the worker count, so service model loading
+    and TLS handshakes are paid once per endpoint rather than once per task.
+    """
+
+    def __init__(self, session=None, account_id=None, max_connections=WORKERS):
+        if session is None:
+            import boto3
+
+            session = boto3.Session()
+        self.session = session
+        self.account_id = account_id or get_aws_account_id()
+        self.config = client_config(max_connections)
+        self.hits = 0
+        self.misses = 0
+        self._clients = {}
+        self._limiters = {}
+        self._lock = threading.Lock()
+        self.tags = TagIndex(self)
+        # the run's CheckpointJournal, set by collect_and_save_resources
+        self.checkpoint = None
+
+    def client(self, service, region):
+        """get the cached client for service in region."""
+        key = (self.account_id, service, region)
+        with self._lock:
+            client = self._clients.get(key)
+            if client is not None:
+                self.hits += 1
+                return client
+            self.misses += 1
+            # boto3 sessions are not thread-safe, so build under the lock
+            client = self.session.client(
+                service, region_name=region, config=self.config
+            )
+            # one limiter per endpoint, shared by every client and task using it
+            limiter = self._limiters.setdefault(key, RateLimiter())
+            attach_rate_limiter(client, limiter)
+            for hook in CLIENT_HOOKS:
+                hook(client)
+            self._clients[key] = client
+            return client
+
+    def stats(self):
+        """client cache counters."""
+        return {"clients": len(self._clients), "hits": self.hits, "misses": self.misses}
+
+    def throttle_report(self):
+        """per-endpoint throttle counts and time spent waiting for tokens."""
+        return {
+            key: {
+                "calls": limiter.calls,
+                "throttles": limiter.throttles,
+                "waited": round(limiter.waited, 3),
+                "rate": round(limiter.rate, 2),
+            }
+            for key, limiter in self._limiters.items()
+        }
+
+
+def regions_for_service(service, regions):
+    """regions a service should be collected in."""
+    if service in GLOBAL_SERVICES:
+        return [GLOBAL_SERVICES[service]]
+    return regions
+
+
+def run_scheduled(
+    executor,
+    tasks,
+    max_running=TASK_WORKERS,
+    region_limit=REGION_CONCURRENCY,
+    service_limit=SERVICE_CONCURRENCY,
+    account_limit=None,
+    finished=(),
+    timeline=None,
+):
+    """run planned tasks on the executor.
+
+    a task is only handed to the pool once its dependencies have finished and
+    while its account, its region and its service are under their caps, so no
+    worker ever blocks waiting for a slot and a slow region holds at most
+    region_limit workers. accounts and regions are served round-robin so every
+    one of them starts early. yields (task, result) as tasks finish; failed
+    tasks are reported, and everything depending on them is skipped.
+    finished names tasks that already ran, e.g. in a resumed run, so their
+    dependents can start.
+
+    tasks are taken in the order given within each account and region, so
+    pass them longest first. with a timeline list, (task, start, end, pages)
+    is appended for every task that ran.
+    """
+    account_limit = account_limit or max_running
+    queues = {}
+    for task in tasks:
+        queues.setdefault(task.account, {}).setdefault(task.region, []).append(task)
+    running = {}
+    finished = set(finished)
+    failed = set()
+    load = Counter()
+
+    def skip_dependents():
+        # drop tasks needing a failed one, and in turn their dependents
+        dropped = True
+        while dropped:
+            dropped = False
+            for account in list(queues):
+                regions = queues[account]
+                for region in list(regions):
+                    for task in list(regions[region]):
+                        missing = failed.intersection(task.depends_on)
+                        if missing:
+                            print(
+                                f"Skipping {task.name}: {', '.join(sorted(missing))} failed"
+                            )
+                            regions[region].remove(task)
+                            failed.add(task.name)
+                            dropped = True
+                    if not regions[region]:
+                        del regions[region]
+                if not regions:
+                    del queues[account]
+
+    def take_next():
+        for account, regions in queues.items():
+            if load[account] >= account_limit:
+                continue
+            for region, pending in regions.items():
+                if load[(account, region)] >= region_limit:
+                    continue
+                for i, task in enumerate(pending):
+                    if load[(account, task.service)] < service_limit and (
+                        finished.issuperset(task.depends_on)
+                    ):
+                        pending.pop(i)
+                        # rotate so the next pick starts with someone else
+                        del regions[region]
+                        if pending:
+                            regions[region] = pending
+                        del queues[account]
+                        if regions:
+                            queues[account] = regions
+                        return task
+        return None
+
+    while queues or running:
+        while len(running) < max_running:
+            task = take_next()
+            if task is None:
+                break
+            for key in (task.account, (task.account, task.region)):
+                load[key] += 1
+            load[(task.account, task.service)] += 1
+            running[executor.submit(measure_task, task)] = task
+
+        if not running:
+            # only tasks with unsatisfiable dependencies are left
+            for regions in queues.values():
+                for pending in regions.values():
+                    for task in pending:
+                        print(f"Skipping {task.name}: unmet {task.depends_on}")
+            return
+
+        done, _ = wait(running, return_when=FIRST_COMPLETED)
+        for future in done:
+            task = running.pop(future)
+            for key in (task.account, (task.account, task.region)):
+                load[key] -= 1
+            load[(task.account, task.service)] -= 1
+            try:
+                result, start, end, pages = future.result()
+            except Exception as err:  # pylint: disable=broad-except
+                print(f"Error running {task.name}: {err}")
+                failed.add(task.name)
+                skip_dependents()
+                continue
+            finished.add(task.name)
+            if timeline is not None:
+                timeline.append((task, start, end, pages))
+            yield task, result
+
+
+# pages written by the task running on this thread, see ResourceWriter.write
+_task_pages = threading.local()
+
+
+def measure_task(task):
+    """run a task; returns (result, start, end, pages written)."""
+    _task_pages.count = 0
+    start = time.monotonic()
+    result = task.func(*task.args)
+    return result, start, time.monotonic(), _task_pages.count
+
+
+class TaskHistory:
+    """duration and page count of every task in earlier runs.
+
+    kept in {DATA_ROOT}/.history.json as {task_name: {"seconds", "pages"}},
+    smoothed over runs. tasks never seen before are estimated from the same
+    collector elsewhere, then PRIOR_TASK_SECONDS, then DEFAULT_TASK_SECONDS.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.tasks = {}
+        if os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                self.tasks = json.load(f)
+        per_collector = {}
+        for name, entry in self.tasks.items():
+            per_collector.setdefault(task_collector(name), []).append(entry["seconds"])
+        self.collectors = {
+            name: sum(seconds) / len(seconds) for name, seconds in per_collector.items()
+        }
+
+    def estimate(self, task):
+        """expected seconds for a task."""
+        if task.name in self.tasks:
+            return self.tasks[task.name]["seconds"]
+        collector = task_collector(task.name)
+        if collector in self.collectors:
+            return self.collectors[collector]
+        return PRIOR_TASK_SECONDS.get(collector, DEFAULT_TASK_SECONDS)
+
+    def record(self, task, seconds, pages):
+        """remember how long a task took and how many pages it read."""
+        previous = self.tasks.get(task.name)
+        if previous is not None:
+            # smooth, so one slow run does not reorder everything
+            seconds = (previous["seconds"] + seconds) / 2
+        self.tasks[task.name] = {"seconds": round(seconds, 3), "pages": pages}
+
+    def save(self):
+        """write the history back to its file."""
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        with open(f"{self.path}.tmp", "w", encoding="utf-8") as f:
+            json.dump(self.tasks, f, indent=1, sort_keys=True)
+        os.replace(f"{self.path}.tmp", self.path)
+
+
+CHECKPOINT_FILE = ".checkpoint.jsonl"
+
+
+class CheckpointJournal:
+    """append-only journal of finished tasks and in-flight page tokens.
+
+    every line is {"task": name, "done": true, "count": n} or
+    {"task": name, "token": next_token, "offset": bytes, "count": n}; lines
+    are flushed as they are written, so the journal survives the process
+    being killed. without resume an existing journal is started over.
+    """
+
+    def __init__(self, path, resume=False):
+        self.path = path
+        self.done = set()
+        self.cursors = {}
+        if resume and os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        # a line cut short by the crash
+                        continue
+                    if entry.get("done"):
+                        self.done.add(entry["task"])
+                        self.cursors.pop(entry["task"], None)
+                    else:
+                        self.cursors[entry["task"]] = entry
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        # pylint: disable-next=consider-using-with
+        self._file = open(path, "a" if resume else "w", encoding="utf-8")
+        self._lock = threading.Lock()
+
+    def cursor(self, task):
+        """a copy of the task's last journaled page, or {}."""
+        return dict(self.cursors.get(task, {}))
+
+    def _append(self, entry):
+        with self._lock:
+            self._file.write(json.dumps(entry) + "\n")
+            self._file.flush()
+
+    def progress(self, task, token, offset, count):
+        """journal a page: the token of the next page and the output offset."""
+        self._append({"task": task, "token": token, "offset": offset, "count": count})
+
+    def finish(self, task, count):
+        """journal a finished task."""
+        self._append({"task": task, "done": True, "count": count})
+
+    def close(self, remove=False):
+        """close the journal, removing it once the run is complete."""
+        self._file.close()
+        if remove:
+            os.remove(self.path)
+
+
+def print_utilisation(timeline, workers, slots=20):
+    """print how busy the pool was over the run and the makespan lower bound.
+
+    the bound is the larger of total work spread over every worker and the
+    longest single task; a makespan close to it cannot be improved much by
+    reordering.
+    """
+    if not timeline:
+        return
+    begin = min(start for _, start, _, _ in timeline)
+    makespan = max(end for _, _, end, _ in timeline) - begin
+    work = sum(end - start for _, start, end, _ in timeline)
+    longest = max(timeline, key=lambda row: row[2] - row[1])
+    bound = max(work / workers, longest[2] - longest[1])
+    width = makespan / slots or 1
+    busy = [0.0] * slots
+    for _, start, end, _ in timeline:
+        for i in range(slots):
+            lo, hi = begin + i * width, begin + (i + 1) * width
+            busy[i] += max(0.0, min(end, hi) - max(start, lo))
+    print(
+        f"pool: {makespan:.1f}s makespan, {bound:.1f}s lower bound, "
+        f"{work / (makespan * workers or 1):.0%} utilised; "
+        f"longest task {longest[0].name} {longest[2] - longest[1]:.1f}s"
+    )
+    levels = " .:-=+*#%@"
+    columns = "".join(levels[min(9, int(10 * b / (width * workers)))] for b in busy)
+    print(f"  busy over time |{columns}| (each column {width:.1f}s)")
+
+
+def iter_paginated(client, method_name, key, params=None, cursor=None):
+    """yield the resources of each page.
+
+    cursor is an optional dict; its "token" is where the listing starts and
+    is updated to the next page's token before each page is yielded.
+    """
+    paginator = client.get_paginator(method_name)
+    config = {}
+    if cursor and cursor.get("token"):
+        config["StartingToken"] = cursor["token"]
+    pages = paginator.paginate(**(params or {}), PaginationConfig=config)
+    for page in pages:
+        if cursor is not None:
+            # resume_token is only filled in by MaxItems, so build it per page
+            next_token = pages._get_next_token(page)  # pylint: disable=W0212
+            cursor["token"] = None
+            if any(next_token.values()):
+                pages.resume_token = next_token
+                cursor["token"] = pages.resume_token
+        yield page.get(key, [])
+
+
+def iter_non_paginated(client, method_name, key, params=None, cursor=None):
+    """yield the resources of each response, following NextToken."""
+    if params is None:
+        params = {}
+    if cursor and cursor.get("token"):
+        params["NextToken"] = cursor["token"]
+
+    method = getattr(client, method_name)
 
-    resources = []
     while True:
         response = method(**params)
-        resources.extend(response.get(key, []))
+        if cursor is not None:
+            cursor["token"] = response.get("NextToken")
+        yield response.get(key, [])
         if "NextToken" in response:
             params["NextToken"] = response["NextToken"]
         else:
             break
+
+
+def paginate_and_collect(client, method_name, key, params=None):
+    """paginate and collect."""
+    resources = []
+    for page in iter_paginated(client, method_name, key, params):
+        resources.extend(page)
     return resources
 
 
-def get_resource_tags(client, resource_arn):
-    """get tags for a resource."""
-    try:
-        response = client.list_tags_for_resource(ResourceArn=resource_arn)
-        return response.get("Tags", [])
-    except botocore.exceptions.BotoCoreError as e:
-        print(f"Error retrieving tags for {resource_arn}: {e}")
-        return []
-
-
-def enrich_with_metadata(client, resource, resource_type):
-    """enrich a resource with metadata."""
-    if resource_type == "sns-topic":
-        resource["Tags"] = get_resource_tags(client, resource["TopicArn"])
-        print(resource["Tags"])
-    elif resource_type == "ec2-instance":
-        resource["Tags"] = resource.get("Tags", [])
-        print(resource["Tags"])
+def handle_non_paginated_service(client, method_name, key, params=None):
+    """handle non paginated service."""
+    resources = []
+    for page in iter_non_paginated(client, method_name, key, params):
+        resources.extend(page)
+    return resources
+
+
+class TagIndex:
+    """ARN -> tags index per region, built from the resource groups tagging api.
+
+    a few paginated GetResources calls cover every taggable resource in a
+    region, instead of one tag call per resource. each region is built once,
+    on first use, and shared by every task in that region.
+    """
+
+    def __init__(self, pool):
+        self.pool = pool
+        self.calls = 0
+        self._indexes = {}
+        self._locks = {}
+        self._lock = threading.Lock()
+
+    def region(self, region):
+        """the ARN -> tags index for region."""
+        with self._lock:
+            lock = self._locks.setdefault(region, threading.Lock())
+        with lock:
+            if region not in self._indexes:
+                self._indexes[region] = self._build(region)
+            return self._indexes[region]
+
+    def _build(self, region):
+        client = self.pool.client("resourcegroupstaggingapi", region)
+        index = {}
+        try:
+            paginator = client.get_paginator("get_resources")
+            for page in paginator.paginate(ResourcesPerPage=100):
+                self.calls += 1
+                for mapping in page.get("ResourceTagMappingList", []):
+                    index[mapping["ResourceARN"]] = mapping.get("Tags", [])
+        except aws_errors() as e:
+            print(f"Error building tag index for {region}: {e}")
+        return index
+
+
+# resource types the tagging api does not cover:
+# (service, response key) -> (tag method, parameter, resource field)
+TAG_FALLBACKS = {
+    ("iam", "Users"): ("list_user_tags", "UserName", "UserName"),
+    ("iam", "Roles"): ("list_role_tags", "RoleName", "RoleName"),
+}
+
+
+def resource_arn(resource):
+    """the resource's own ARN, if it has one."""
+    for name, value in resource.items():
+        if name.lower().endswith("arn") and isinstance(value, str):
+            if value.startswith("arn:"):
+                return value
+    return None
+
+
+def enrich_with_metadata(client, resource, service, key=None, tags=None):
+    """enrich a resource with metadata.
+
+    tags is the region's ARN -> tags index; resources that already carry
+    their tags are left alone.
+    """
+    if not isinstance(resource, dict) or "Tags" in resource or "TagList" in resource:
+        return resource
+    fallback = TAG_FALLBACKS.get((service, key))
+    if fallback is not None:
+        method, param, field = fallback
+        try:
+            response = getattr(client, method)(**{param: resource[field]})
+            resource["Tags"] = response.get("Tags", [])
+        except aws_errors() as e:
+            print(f"Error retrieving tags for {resource[field]}: {e}")
+    elif tags is not None:
+        arn = resource_arn(resource)
+        if arn is not None:
+            resource["Tags"] = tags.get(arn, [])
     # Add more conditions here for other resource types as needed
     return resource
 
 
-def list_targets_for_target_groups(client, region):
+def fan_out(func, items, limit=NESTED_CONCURRENCY):
+    """yield (item, func(item)) in item order, running up to limit at once.
+
+    for per-resource calls inside one task. every call also holds a slot of
+    NESTED_BUDGET, so all tasks' fan-outs together make at most NESTED_WORKERS
+    calls at once, on top of at most TASK_WORKERS running tasks: WORKERS in
+    all. the endpoint's rate limiter still paces each of them.
+    items is consumed lazily, so it can be a generator over pages.
+    """
+
+    def call(item):
+        with NESTED_BUDGET:
+            return func(item)
+
+    with ThreadPoolExecutor(max_workers=limit) as executor:
+        pending = deque()
+        for item in items:
+            pending.append((item, executor.submit(call, item)))
+            # keep a bounded window ahead of the consumer
+            if len(pending) >= 2 * limit:
+                item, future = pending.popleft()
+                yield item, future.result()
+        while pending:
+            item, future = pending.popleft()
+            yield item, future.result()
+
+
+def list_targets_for_target_groups(client, region, account_id=None):
+    """target health of every target group, one record per target group arn."""
     print(f"Getting elbv2 info for {region}")
-    all_target_groups = paginate_and_collect(
-        client, "describe_target_groups", "TargetGroups"
-    )
-    all_resources = []
-    for target_group in all_target_groups:
-        target_group_arn = target_group["TargetGroupArn"]
-        targets = client.describe_target_health(TargetGroupArn=target_group_arn).get(
-            "TargetHealthDescriptions", []
+    account_id = account_id or get_aws_account_id()
+
+    def target_health(target_group_arn):
+        try:
+            return client.describe_target_health(TargetGroupArn=target_group_arn).get(
+                "TargetHealthDescriptions", []
+            )
+        except aws_errors() as e:
+            # e.g. deleted since it was listed
+            print(f"Error describing target health for {target_group_arn}: {e}")
+            return None
+
+    target_group_arns = (
+        target_group["TargetGroupArn"]
+        for target_groups in iter_paginated(
+            client, "describe_target_groups", "TargetGroups"
         )
-        all_resources.extend(targets)
-        # print(f"Collected targets for {target_group_arn}")
+        for target_group in target_groups
+    )
+    file_name = f"{account_id}-elbv2-{region}-details.json"
+    with ResourceWriter(file_name, "TargetGroups", account_id) as out:
+        for target_group_arn, targets in fan_out(target_health, target_group_arns):
+            if targets is not None:
+                out.write(
+                    [
+                        {
+                            "TargetGroupArn": target_group_arn,
+                            "TargetHealthDescriptions": targets,
+                        }
+                    ]
+                )
+    return out.count
+
+
+def updated_at_ms(finding):
+    """a finding's UpdatedAt as epoch milliseconds, or 0."""
+    try:
+        updated = datetime.fromisoformat(finding["UpdatedAt"].replace("Z", "+00:00"))
+    except (KeyError, ValueError):
+        return 0
+    if updated.tzinfo is None:
+        updated = updated.replace(tzinfo=timezone.utc)
+    return int(updated.timestamp() * 1000)
 
-    file_name = f"{AWS_ID}-elbv2-{region}-details.json"
-    write_to_file(all_resources, file_name)
-    return all_resources
 
+def get_guardduty_info(client, region, account_id=None):
+    """get guardduty info.
 
-def get_guardduty_info(client, region):
-    """get guardduty info."""
+    details has one record per detector with its threat intel and ip set
+    ids; findings has every finding hydrated with get_findings, one call per
+    GUARDDUTY_BATCH ids, fanned out per detector. each finding carries its
+    DetectorId. with OUTPUT_OPTIONS["incremental"], only findings updated
+    since the last run's high-water mark are pulled, into findings-updates.
+    """
+    account_id = account_id or get_aws_account_id()
+    incremental = OUTPUT_OPTIONS["incremental"]
+    state_name = f"guardduty-{region}"
+    marks = load_state(account_id, state_name) if incremental else {}
     all_detectors = paginate_and_collect(client, "list_detectors", "DetectorIds")
-    all_resources = []
-    for detector in all_detectors:
-        # print(detector)
-        detector_id = detector
-        list_findings = client.get_paginator("list_findings")
-        for page in list_findings.paginate(DetectorId=detector_id):
-            all_resources.extend(page.get("FindingIds", []))
 
-        list_threat_intel_sets = client.list_threat_intel_sets(DetectorId=detector_id)
-        all_resources.extend(list_threat_intel_sets.get("ThreatIntelSetIds", []))
+    detectors = []
+    output = "findings-updates" if incremental else "findings"
+    file_name = f"{account_id}-guardduty-{region}-{output}.json"
+    with ResourceWriter(file_name, "Findings", account_id) as out:
+        for detector_id in all_detectors:
 
-        list_ip_sets = client.list_ip_sets(DetectorId=detector_id)
-        all_resources.extend(list_ip_sets.get("IpSetIds", []))
+            def hydrate(finding_ids, detector_id=detector_id):
+                return client.get_findings(
+                    DetectorId=detector_id, FindingIds=finding_ids
+                ).get("Findings", [])
 
-        # print(f"Collected findings for {detector_id}")
+            params = {"DetectorId": detector_id, "MaxResults": GUARDDUTY_BATCH}
+            mark = marks.get(detector_id, 0)
+            if mark:
+                # at-least-once: findings updated in the mark's millisecond repeat
+                params["FindingCriteria"] = {
+                    "Criterion": {"updatedAt": {"GreaterThanOrEqual": mark}}
+                }
+            batches = (
+                finding_ids
+                for finding_ids in iter_paginated(
+                    client, "list_findings", "FindingIds", params
+                )
+                if finding_ids
+            )
+            count = out.count
+            for _, findings in fan_out(hydrate, batches):
+                for finding in findings:
+                    finding["DetectorId"] = detector_id
+                    mark = max(mark, updated_at_ms(finding))
+                out.write(findings)
+            marks[detector_id] = mark
 
-    file_name = f"{AWS_ID}-guardduty-{region}-details.json"
-    write_to_file(all_resources, file_name)
-    return all_resources
+            detectors.append(
+                {
+                    "DetectorId": detector_id,
+                    "ThreatIntelSetIds": paginate_and_collect(
+                        client,
+                        "list_threat_intel_sets",
+                        "ThreatIntelSetIds",
+                        {"DetectorId": detector_id},
+                    ),
+                    "IpSetIds": paginate_and_collect(
+                        client, "list_ip_sets", "IpSetIds", {"DetectorId": detector_id}
+                    ),
+                    "Findings": out.count - count,
+                }
+            )
 
+    file_name = f"{account_id}-guardduty-{region}-details.json"
+    with ResourceWriter(file_name, "Detectors", account_id) as details:
+        details.write(detectors)
+    if incremental:
+        save_state(account_id, state_name, marks)
+    return out.count
 
-def get_ec2_info(client, region):
-    """get ec2 info."""
-    print(f"Getting ec2 info for {region}")
-    # ("describe_images", "Images"),  # lots of requests....
-    # all_snaps = paginate_and_collect(client, "describe_snapshots", "Snapshots")
-    all_resources = []
 
-    snaps = client.get_paginator("describe_snapshots")
-    for page in snaps.paginate(
-        Filters=[
-            {
-                "Name": "owner-id",
-                "Values": [AWS_ID],
-            },
-        ]
-    ):
-        all_resources.extend(page.get("Snapshots", []))
-    # gets public images
-    images = client.get_paginator("describe_images")
-    for page in images.paginate(
-        Filters=[
-            {
-                "Name": "owner-id",
-                "Values": [AWS_ID],
-            },
-            # this is how we grab all aws amis available to us...
-            # {
-            #     "Name": "owner-alias",
-            #     "Values": ["amazon"],
-            # },
-        ]
-    ):
-        all_resources.extend(page.get("Images", []))
+def day_values(first, last):
+    """wildcard filter values matching every day from first to last."""
+    return [
+        f"{first + timedelta(days=n):%Y-%m-%d}*" for n in range((last - first).days + 1)
+    ]
 
-        # print(f"Collected findings for {detector_id}")
 
-    file_name = f"{AWS_ID}-ec2-{region}-details.json"
-    write_to_file(all_resources, file_name)
-    return all_resources
+def list_owned_ec2(client, kind, owner_filter, extra_filter=None):
+    """yield pages of owned snapshots or images, optionally filtered further."""
+    spec = EC2_KINDS[kind]
+    filters = list(owner_filter)
+    if extra_filter is not None:
+        filters.append(extra_filter)
+    params = {"Filters": filters}
+    return iter_paginated(client, spec["method"], kind, params)
 
 
-def collect_and_save_resources():
-    """collect and save resources."""
-    session = boto3.Session()
-    regions = get_all_regions()
+def refresh_ec2_index(client, kind, owner_filter, state):
+    """bring the index of owned snapshots or images in state up to date.
 
-    services = {
-        "acm": [("list_certificates", "CertificateSummaryList")],
-        "autoscaling": [
-            ("describe_auto_scaling_groups", "AutoScalingGroups"),
-            ("describe_launch_configurations", "LaunchConfigurations"),
-            ("describe_auto_scaling_instances", "AutoScalingInstances"),
-        ],
-        "athena": [("list_data_catalogs", "DataCatalogsSummary")],
-        "appstream": [
-            ("describe_fleets", "Fleets"),
-            ("describe_images", "Images"),
-            ("describe_stacks", "Stacks"),
-            # ("describe_users", "Users"), # AuthenticationType='API'|'SAML'|'USERPOOL'|'AWS_AD'
-        ],
-        "config": [
-            ("describe_config_rules", "ConfigRules"),
-            ("describe_configuration_aggregators", "ConfigurationAggregators"),
-            ("list_resource_evaluations", "ResourceEvaluations"),
-            # ("list_discovered_resources", "resourceIdentifiers") # https://boto3.amazonaws.com/v1/documentation/api/latest/reference/services/config/paginator/ListDiscoveredResources.html
-        ],
-        "backup": [
-            ("list_backup_plans", "BackupPlansList"),
-            ("list_backup_vaults", "BackupVaultList"),
-            ("list_backup_jobs", "BackupJobs"),
-        ],
-        "cloudfront": [
-            ("list_distributions", "DistributionList"),
-            (
-                "list_cloud_front_origin_access_identities",
-                "CloudFrontOriginAccessIdentityList",
-            ),
-        ],
-        "codedeploy": [
-            ("list_applications", "Applications"),  # applications
-            ("list_deployments", "Deployments"),  # deployments
-        ],
-        "ec2": [
-            ("describe_instances", "Reservations"),
-            ("describe_security_groups", "SecurityGroups"),
-            ("describe_vpcs", "Vpcs"),
-            ("describe_volumes", "Volumes"),
-            ("describe_subnets", "Subnets"),
-            ("describe_network_interfaces", "NetworkInterfaces"),
-        ],
-        "ecr": [
-            ("describe_repositories", "Repositories"),  # repos
-            # ("describe_images", "Images"),   # FIXME params needed
-        ],
-        "efs": [
-            ("describe_file_systems", "FileSystems"),
-        ],
-        "eks": [
-            ("list_clusters", "Clusters"),
-        ],
-        "elasticache": [
-            ("describe_cache_clusters", "CacheClusters"),
-        ],
-        "elasticbeanstalk": [("describe_environments", "Environments")],
-        "elb": [
-            ("describe_load_balancers", "LoadBalancerDescriptions"),
-        ],
-        "es": [
-            (
-                "describe_reserved_elasticsearch_instances",
-                "ReservedElasticsearchInstances",
-            ),
-        ],
-        "lambda": [("list_functions", "Functions")],
-        "rds": [
-            ("describe_db_instances", "DBInstances"),
-            ("describe_db_snapshots", "DBSnapshots"),
-            ("describe_db_subnet_groups", "DBSubnetGroups"),
-            ("describe_db_clusters", "DBClusters"),
-        ],
-        "s3": [
-            ("list_buckets", "Buckets"),
-        ],
-        "secretsmanager": [("list_secrets", "SecretList")],
-        "sagemaker": [
-            ("list_clusters", "ClusterSummaries"),
-            ("list_endpoints", "Endpoints"),
-            ("list_notebook_instances", "NotebookInstances"),
-        ],
-        "sns": [("list_topics", "Topics")],
-        "sqs": [("list_queues", "QueueUrls")],
-        "cloudformation": [("describe_stacks", "Stacks")],
-        "cloudwatch": [("describe_alarms", "MetricAlarms")],
-        "iam": [
-            ("list_users", "Users"),
-            ("list_roles", "Roles"),
-            ("list_policies", "Policies"),  # lots
-            # ("list_groups", "Groups"),
-        ],
-        "route53": [("list_hosted_zones", "HostedZones")],
-        "route53domains": [("list_domains", "Domains")],
-        "dynamodb": [
-            ("list_tables", "TableNames"),
-            ("list_backups", "BackupSummaries"),
-        ],
-        "ecs": [
-            ("list_clusters", "ClusterArns"),
-            # ("list_services", "ServiceArns"), # more inputs needed
-            # ("list_tasks", "TaskArns"), # more inputs needed
-        ],
-        "workspaces": [("describe_workspaces", "Workspaces")],
-        "fsx": [("describe_file_systems", "FileSystems")],
-        "glacier": [("list_vaults", "VaultList")],
-        "guardduty": [
-            ("list_detectors", "DetectorIds"),
-        ],
-        "redshift": [
-            ("describe_clusters", "Clusters"),
-        ],
-        "network-firewall": [("list_firewalls", "Firewalls")],
-    }
+    the first run lists everything. later runs list only what started since
+    the newest indexed item (by day, via the start-time/creation-date
+    filter), re-describe items still pending, and reconcile one of
+    EC2_RECONCILE_SLICES month slices of older items, dropping the ones that
+    are gone; every item is reconciled once per EC2_RECONCILE_SLICES runs.
+    returns the number of describe calls made.
+    """
+    spec = EC2_KINDS[kind]
+    index = state.setdefault("resources", {})
+    today = datetime.now(timezone.utc).date()
+    newest = max((str(r[spec["time"]])[:10] for r in index.values()), default=None)
+    try:
+        newest = datetime.strptime(newest, "%Y-%m-%d").date()
+    except (TypeError, ValueError):
+        newest = None
 
-    non_paginated_services = {
-        "apigatewayv2": ("get_apis", "Items"),
-        "config": ("describe_configuration_recorders", "ConfigurationRecorders"),
-        "ec2": ("describe_addresses", "Addresses"),
-        "secretsmanager": ("list_secrets", "SecretList"),
-        "ssm": ("get_parameters_by_path", "Parameters"),
-        "kms": ("list_keys", "Keys"),
-        "cloudtrail": ("describe_trails", "trailList"),
-        "codebuild": ("list_projects", "Projects"),
-        "waf": ("list_web_acls", "WebACLs"),
-        # "wafv2": ("list_ip_sets", "IPSets"), # Needs more data
-    }
+    def merge(pages):
+        calls = 0
+        seen = set()
+        for resources in pages:
+            calls += 1
+            for resource in resources:
+                index[resource[spec["id"]]] = resource
+                seen.add(resource[spec["id"]])
+        return calls, seen
 
-    def process_service_region(service, method, key, region):
-        all_resources = []
-        try:
-            client = session.client(service, region_name=region, config=config)
+    if newest is None or (today - newest).days >= EC2_FILTER_VALUES:
+        index.clear()
+        calls, _ = merge(list_owned_ec2(client, kind, owner_filter))
+        state["slice"] = 0
+        return calls
 
-            if service in non_paginated_services:
-                resources = handle_non_paginated_service(client, method, key)
-            else:
-                resources = paginate_and_collect(client, method, key)
+    # new since the newest known item; a day back for clock skew
+    days = day_values(newest - timedelta(days=1), today)
+    calls, _ = merge(
+        list_owned_ec2(
+            client, kind, owner_filter, {"Name": spec["time_filter"], "Values": days}
+        )
+    )
 
-            for resource in resources:
-                resource = enrich_with_metadata(client, resource, service)
-            all_resources.extend(resources)
-            # print(
-            #     f"Collected {len(resources)} {service} resources in {region} using {method}"
-            # )
-            file_name = f"{AWS_ID}-{service}-{region}-{method}-{key}.json"
-            write_to_file(all_resources, file_name)
-        except botocore.exceptions.BotoCoreError as e:
-            print(f"Error collecting {service} resources in {region}: {e}")
-        return (service, all_resources)
-
-    futures = []
-    with ThreadPoolExecutor(max_workers=WORKERS) as executor:
+    pending = [k for k, r in index.items() if r.get(spec["state"]) == "pending"]
+    for i in range(0, len(pending), EC2_FILTER_VALUES):
+        chunk = pending[i : i + EC2_FILTER_VALUES]
+        extra = {"Name": spec["id_filter"], "Values": chunk}
+        chunk_calls, seen = merge(list_owned_ec2(client, kind, owner_filter, extra))
+        calls += chunk_calls
+        for gone in set(chunk) - seen:
+            index.pop(gone, None)
 
-        # paginated services
-        for service, methods in services.items():
-            for region in regions:
-                for method, key in methods:
-                    futures.append(
-                        executor.submit(
-                            process_service_region, service, method, key, region
-                        )
-                    )
+    # reconcile this run's slice of months
+    slice_number = state.get("slice", 0) % EC2_RECONCILE_SLICES
+    state["slice"] = slice_number + 1
+    months = sorted(
+        {
+            str(r[spec["time"]])[:7]
+            for r in index.values()
+            if hash_slice(str(r[spec["time"]])[:7]) == slice_number
+        }
+    )
+    for i in range(0, len(months), EC2_FILTER_VALUES):
+        chunk = months[i : i + EC2_FILTER_VALUES]
+        extra = {"Name": spec["time_filter"], "Values": [f"{m}*" for m in chunk]}
+        chunk_calls, seen = merge(list_owned_ec2(client, kind, owner_filter, extra))
+        calls += chunk_calls
+        for key in [
+            k
+            for k, r in index.items()
+            if str(r[spec["time"]])[:7] in chunk and k not in seen
+        ]:
+            del index[key]
+    return calls
 
-        # non paginated services
-        for service, (method, key) in non_paginated_services.items():
-            for region in regions:
-                futures.append(
-                    executor.submit(
-                        process_service_region, service, method, key, region
+
+def hash_slice(value):
+    """stable reconciliation slice for a value, unlike hash() across runs."""
+    return int(hashlib.sha256(value.encode()).hexdigest(), 16) % EC2_RECONCILE_SLICES
+
+
+def get_ec2_info(client, region, account_id=None, kinds=("Snapshots", "Images")):
+    """get ec2 info.
+
+    owned snapshots and images are written to their own typed outputs,
+    details-snapshots and details-images; the registered collector runs each
+    kind as a separate shard. with OUTPUT_OPTIONS["incremental"], a local
+    index per kind (see refresh_ec2_index) replaces the full listing.
+    """
+    # one line per shard, so say which kinds this one collects
+    print(f"Getting ec2 {' and '.join(kinds).lower()} for {region}")
+    account_id = account_id or get_aws_account_id()
+    # ("describe_images", "Images"),  # lots of requests....
+    # all_snaps = paginate_and_collect(client, "describe_snapshots", "Snapshots")
+    owner_filter = [
+        {
+            "Name": "owner-id",
+            "Values": [account_id],
+        },
+    ]
+    # gets public images
+    # this is how we grab all aws amis available to us...
+    # {
+    #     "Name": "owner-alias",
+    #     "Values": ["amazon"],
+    # },
+    count = 0
+    for kind in kinds:
+        file_name = f"{account_id}-ec2-{region}-details-{kind.lower()}.json"
+        state_name = f"ec2-{region}-{kind.lower()}"
+        with ResourceWriter(file_name, kind, account_id) as out:
+            if not OUTPUT_OPTIONS["incremental"]:
+                for resources in list_owned_ec2(client, kind, owner_filter):
+                    out.write(resources)
+            else:
+                state = load_state(account_id, state_name)
+                calls = refresh_ec2_index(client, kind, owner_filter, state)
+                time_key = EC2_KINDS[kind]["time"]
+                out.write(
+                    sorted(
+                        state["resources"].values(),
+                        key=lambda r, k=time_key: (str(r[k]), str(r)),
                     )
                 )
-        # resources that require inputs and custom funcs
-        for service, (method, key) in non_paginated_services.items():
-            for region in regions:
-                # Other regional checks...
-                futures.append(
-                    executor.submit(
-                        get_ec2_info,
-                        session.client("ec2", region_name=region),
-                        region,
-                    )
+                print(
+                    f"ec2 {kind.lower()} in {region}: {out.count} indexed, "
+                    f"{calls} describe calls"
                 )
-                futures.append(
-                    executor.submit(
-                        list_targets_for_target_groups,
-                        session.client("elbv2", region_name=region),
-                        region,
-                    )
+        if OUTPUT_OPTIONS["incremental"]:
+            # datetimes of freshly described items become strings, as on disk
+            state = json.loads(json.dumps(state, default=str))
+            save_state(account_id, state_name, state)
+        count += out.count
+    return count
+
+
+Collector = namedtuple(
+    "Collector",
+    [
+        "name",
+        "service",
+        "method",
+        "key",
+        "params",
+        "paginated",
+        "func",
+        "depends_on",
+        "output",
+        "shards",
+    ],
+)
+Task = namedtuple(
+    "Task", ["name", "account", "region", "service", "func", "args", "depends_on"]
+)
+
+COLLECTORS = {}
+
+
+def register_collector(
+    service,
+    method=None,
+    key=None,
+    params=None,
+    paginated=True,
+    func=None,
+    depends_on=(),
+    output=None,
+    name=None,
+    shards=(),
+):
+    """register a collector.
+
+    api collectors name a client method and the response key to gather;
+    custom collectors pass func(client, region, account_id) instead. output is the file
+    name suffix, depends_on lists collector names that must finish first in
+    the same region. registering an existing name replaces it.
+
+    shards splits a large collector into independent tasks: a list of
+    (label, params) pairs, each run as its own task writing {output}-{label}.
+    api collectors merge params into their call; custom collectors get them
+    as keyword arguments. see time_window_shards.
+    """
+    if func is None and (method is None or key is None):
+        raise ValueError(f"{service}: api collectors need a method and a key")
+    name = name or f"{service}.{method or func.__name__}"
+    if output is None:
+        output = f"{method}-{key}" if func is None else "details"
+    COLLECTORS[name] = Collector(
+        name,
+        service,
+        method,
+        key,
+        dict(params or {}),
+        paginated,
+        func,
+        tuple(depends_on),
+        output,
+        tuple(shards),
+    )
+    return COLLECTORS[name]
+
+
+def time_window_shards(filter_name="start-time", first_year=2008):
+    """one shard per year for apis with a wildcard date filter.
+
+    e.g. describe_snapshots with start-time; the shard's Filters replace the
+    collector's, so put owner restrictions in other params (OwnerIds).
+    """
+    return [
+        (str(year), {"Filters": [{"Name": filter_name, "Values": [f"{year}-*"]}]})
+        for year in range(first_year, datetime.now(timezone.utc).year + 1)
+    ]
+
+
+SERVICES = {
+    "acm": [("list_certificates", "CertificateSummaryList")],
+    "autoscaling": [
+        ("describe_auto_scaling_groups", "AutoScalingGroups"),
+        ("describe_launch_configurations", "LaunchConfigurations"),
+        ("describe_auto_scaling_instances", "AutoScalingInstances"),
+    ],
+    "athena": [("list_data_catalogs", "DataCatalogsSummary")],
+    "appstream": [
+        ("describe_fleets", "Fleets"),
+        ("describe_images", "Images"),
+        ("describe_stacks", "Stacks"),
+        # ("describe_users", "Users"), # AuthenticationType='API'|'SAML'|'USERPOOL'|'AWS_AD'
+    ],
+    "config": [
+        ("describe_config_rules", "ConfigRules"),
+        ("describe_configuration_aggregators", "ConfigurationAggregators"),
+        ("list_resource_evaluations", "ResourceEvaluations"),
+        # ("list_discovered_resources", "resourceIdentifiers") # https://boto3.amazonaws.com/v1/documentation/api/latest/reference/services/config/paginator/ListDiscoveredResources.html
+    ],
+    "backup": [
+        ("list_backup_plans", "BackupPlansList"),
+        ("list_backup_vaults", "BackupVaultList"),
+        ("list_backup_jobs", "BackupJobs"),
+    ],
+    "cloudfront": [
+        ("list_distributions", "DistributionList"),
+        (
+            "list_cloud_front_origin_access_identities",
+            "CloudFrontOriginAccessIdentityList",
+        ),
+    ],
+    "codedeploy": [
+        ("list_applications", "Applications"),  # applications
+        ("list_deployments", "Deployments"),  # deployments
+    ],
+    "ec2": [
+        ("describe_instances", "Reservations"),
+        ("describe_security_groups", "SecurityGroups"),
+        ("describe_vpcs", "Vpcs"),
+        ("describe_volumes", "Volumes"),
+        ("describe_subnets", "Subnets"),
+        ("describe_network_interfaces", "NetworkInterfaces"),
+    ],
+    "ecr": [
+        ("describe_repositories", "Repositories"),  # repos
+        # ("describe_images", "Images"),   # FIXME params needed
+    ],
+    "efs": [
+        ("describe_file_systems", "FileSystems"),
+    ],
+    "eks": [
+        ("list_clusters", "Clusters"),
+    ],
+    "elasticache": [
+        ("describe_cache_clusters", "CacheClusters"),
+    ],
+    "elasticbeanstalk": [("describe_environments", "Environments")],
+    "elb": [
+        ("describe_load_balancers", "LoadBalancerDescriptions"),
+    ],
+    "es": [
+        (
+            "describe_reserved_elasticsearch_instances",
+            "ReservedElasticsearchInstances",
+        ),
+    ],
+    "lambda": [("list_functions", "Functions")],
+    "rds": [
+        ("describe_db_instances", "DBInstances"),
+        ("describe_db_snapshots", "DBSnapshots"),
+        ("describe_db_subnet_groups", "DBSubnetGroups"),
+        ("describe_db_clusters", "DBClusters"),
+    ],
+    "s3": [
+        ("list_buckets", "Buckets"),
+    ],
+    "secretsmanager": [("list_secrets", "SecretList")],
+    "sagemaker": [
+        ("list_clusters", "ClusterSummaries"),
+        ("list_endpoints", "Endpoints"),
+        ("list_notebook_instances", "NotebookInstances"),
+    ],
+    "sns": [("list_topics", "Topics")],
+    "sqs": [("list_queues", "QueueUrls")],
+    "cloudformation": [("describe_stacks", "Stacks")],
+    "cloudwatch": [("describe_alarms", "MetricAlarms")],
+    "iam": [
+        ("list_users", "Users"),
+        ("list_roles", "Roles"),
+        ("list_policies", "Policies"),  # lots
+        # ("list_groups", "Groups"),
+    ],
+    "route53": [("list_hosted_zones", "HostedZones")],
+    "route53domains": [("list_domains", "Domains")],
+    "dynamodb": [
+        ("list_tables", "TableNames"),
+        ("list_backups", "BackupSummaries"),
+    ],
+    "ecs": [
+        ("list_clusters", "ClusterArns"),
+        # ("list_services", "ServiceArns"), # more inputs needed
+        # ("list_tasks", "TaskArns"), # more inputs needed
+    ],
+    "workspaces": [("describe_workspaces", "Workspaces")],
+    "fsx": [("describe_file_systems", "FileSystems")],
+    "glacier": [("list_vaults", "VaultList")],
+    "guardduty": [
+        ("list_detectors", "DetectorIds"),
+    ],
+    "redshift": [
+        ("describe_clusters", "Clusters"),
+    ],
+    "network-firewall": [("list_firewalls", "Firewalls")],
+}
+
+
+NON_PAGINATED_SERVICES = {
+    "apigatewayv2": ("get_apis", "Items"),
+    "config": ("describe_configuration_recorders", "ConfigurationRecorders"),
+    "ec2": ("describe_addresses", "Addresses"),
+    "secretsmanager": ("list_secrets", "SecretList"),
+    "kms": ("list_keys", "Keys"),
+    "cloudtrail": ("describe_trails", "trailList"),
+    "codebuild": ("list_projects", "Projects"),
+    "waf": ("list_web_acls", "WebACLs"),
+    # "wafv2": ("list_ip_sets", "IPSets"), # Needs more data
+}
+
+# collectors an AWS Config aggregator can serve instead, by config resource
+# type. served resources keep config's item shape and go to the collector's
+# -config output, which replaces its api output for that run; plugins can add
+# their own collectors here.
+CONFIG_RESOURCE_TYPES = {
+    "acm.list_certificates": "AWS::ACM::Certificate",
+    "autoscaling.describe_auto_scaling_groups": "AWS::AutoScaling::AutoScalingGroup",
+    "autoscaling.describe_launch_configurations": (
+        "AWS::AutoScaling::LaunchConfiguration"
+    ),
+    "cloudformation.describe_stacks": "AWS::CloudFormation::Stack",
+    "cloudtrail.describe_trails": "AWS::CloudTrail::Trail",
+    "cloudwatch.describe_alarms": "AWS::CloudWatch::Alarm",
+    "ec2.describe_addresses": "AWS::EC2::EIP",
+    "ec2.describe_network_interfaces": "AWS::EC2::NetworkInterface",
+    "ec2.describe_security_groups": "AWS::EC2::SecurityGroup",
+    "ec2.describe_subnets": "AWS::EC2::Subnet",
+    "ec2.describe_volumes": "AWS::EC2::Volume",
+    "ec2.describe_vpcs": "AWS::EC2::VPC",
+    "ecr.describe_repositories": "AWS::ECR::Repository",
+    "efs.describe_file_systems": "AWS::EFS::FileSystem",
+    "elasticbeanstalk.describe_environments": "AWS::ElasticBeanstalk::Environment",
+    "elb.describe_load_balancers": "AWS::ElasticLoadBalancing::LoadBalancer",
+    "iam.list_roles": "AWS::IAM::Role",
+    "iam.list_users": "AWS::IAM::User",
+    "kms.list_keys": "AWS::KMS::Key",
+    "lambda.list_functions": "AWS::Lambda::Function",
+    "rds.describe_db_clusters": "AWS::RDS::DBCluster",
+    "rds.describe_db_instances": "AWS::RDS::DBInstance",
+    "rds.describe_db_snapshots": "AWS::RDS::DBSnapshot",
+    "rds.describe_db_subnet_groups": "AWS::RDS::DBSubnetGroup",
+    "redshift.describe_clusters": "AWS::Redshift::Cluster",
+    "secretsmanager.list_secrets": "AWS::SecretsManager::Secret",
+}
+CONFIG_QUERY_FIELDS = (
+    "accountId, awsRegion, resourceType, resourceId, resourceName, arn, "
+    "configuration, tags"
+)
+# config items keep config's own shape, so they get their own output label
+CONFIG_OUTPUT_LABEL = "config"
+CONFIG_REPORT_FILE = "config-report.json"
+
+
+def register_builtin_collectors():
+    """register the built-in collectors."""
+    for service, methods in SERVICES.items():
+        for method, key in methods:
+            register_collector(service, method, key)
+    for service, (method, key) in NON_PAGINATED_SERVICES.items():
+        register_collector(service, method, key, paginated=False)
+    # Specify the root path or another base path here
+    register_collector(
+        "ssm", "get_parameters_by_path", "Parameters", params={"Path": "/"}
+    )
+    # "wafv2" list_ip_sets needs params={"Scope": "CLOUDFRONT"} or "REGIONAL"
+    # resources that require inputs and custom funcs
+    # snapshots and images are listed in parallel; snapshots are the giant
+    register_collector(
+        "ec2",
+        func=get_ec2_info,
+        name="ec2.details",
+        shards=[
+            ("snapshots", {"kinds": ["Snapshots"]}),
+            ("images", {"kinds": ["Images"]}),
+        ],
+    )
+    register_collector(
+        "elbv2", func=list_targets_for_target_groups, name="elbv2.details"
+    )
+    register_collector("guardduty", func=get_guardduty_info, name="guardduty.details")
+
+
+def load_plugins(modules=None):
+    """load pluggable collectors.
+
+    each module (default: INVENTORY_PLUGINS, comma separated) must define
+    register(register_collector) and call it for every collector it adds.
+    """
+    if modules is None:
+        modules = os.environ.get("INVENTORY_PLUGINS", "").split(",")
+    for module_name in filter(None, (m.strip() for m in modules)):
+        importlib.import_module(module_name).register(register_collector)
+
+
+def task_name(account_id, collector_name, region, shard=None):
+    """name of the task running a collector (shard) in one account and region."""
+    if shard is not None:
+        collector_name = f"{collector_name}[{shard}]"
+    return f"{account_id}:{collector_name}@{region}"
+
+
+def task_collector(name):
+    """the collector (and shard) part of a task name."""
+    return name.split(":", 1)[1].rsplit("@", 1)[0]
+
+
+def output_file_name(account_id, collector, region, label=None):
+    """the file a collector (shard) writes in one account and region."""
+    output = collector.output if label is None else f"{collector.output}-{label}"
+    return f"{account_id}-{collector.service}-{region}-{output}.json"
+
+
+def run_collector(pool, collector, region, shard=None):
+    """run one collector (or one of its shards) in one region and write its output.
+
+    with a checkpoint and plain streamed output, the page token and file
+    offset are journaled after every page, so a resumed run truncates the
+    file to the last complete page and continues the listing from there.
+    """
+    label, shard_params = shard or (None, {})
+    client = pool.client(collector.service, region)
+    if collector.func is not None:
+        return collector.func(client, region, pool.account_id, **shard_params)
+
+    name = task_name(pool.account_id, collector.name, region, label)
+    checkpoint = pool.checkpoint
+    resumable = (
+        OUTPUT_OPTIONS["stream"]
+        and not OUTPUT_OPTIONS["compression"]
+        and not OUTPUT_OPTIONS["snapshots"]
+    )
+    cursor = checkpoint.cursor(name) if checkpoint and resumable else {}
+    if cursor:
+        print(f"Resuming {name} after {cursor['count']} resources")
+
+    params = {**collector.params, **shard_params}
+    if collector.paginated and client.can_paginate(collector.method):
+        pages = iter_paginated(client, collector.method, collector.key, params, cursor)
+    else:
+        pages = iter_non_paginated(
+            client, collector.method, collector.key, params, cursor
+        )
+
+    tags = pool.tags.region(region) if OUTPUT_OPTIONS["tags"] else None
+    with ResourceWriter(
+        output_file_name(pool.account_id, collector, region, label),
+        collector.key,
+        pool.account_id,
+        offset=cursor.get("offset"),
+    ) as out:
+        out.count = cursor.get("count", 0)
+        for page in pages:
+            for resource in page:
+                enrich_with_metadata(
+                    client, resource, collector.service, collector.key, tags
                 )
-                futures.append(
-                    executor.submit(
-                        get_guardduty_info,
-                        session.client("guardduty", region_name=region),
-                        region,
-                    )
+            out.write(page)
+            if checkpoint and resumable and cursor.get("token"):
+                checkpoint.progress(name, cursor["token"], out.tell(), out.count)
+    return out.count
+
+
+def plan_tasks(pool, regions, collectors=None):
+    """plan the de-duplicated task graph.
+
+    one task per (collector, region), or per shard of a sharded collector;
+    global services collapse onto their home region and collectors sharing
+    an output file are only run once.
+    """
+    if collectors is None:
+        collectors = list(COLLECTORS)
+    planned = {}
+    outputs = set()
+    for name in collectors:
+        collector = COLLECTORS[name]
+        for region in regions_for_service(collector.service, regions):
+            output = (collector.service, region, collector.output)
+            if output in outputs:
+                continue
+            outputs.add(output)
+            planned[task_name(pool.account_id, name, region)] = (collector, region)
+
+    def shard_names(collector, region):
+        labels = [label for label, _ in collector.shards] or [None]
+        return [
+            task_name(pool.account_id, collector.name, region, label)
+            for label in labels
+        ]
+
+    tasks = []
+    for name, (collector, region) in planned.items():
+        depends_on = []
+        for dep in collector.depends_on:
+            dep_collector = COLLECTORS[dep]
+            dep_region = regions_for_service(dep_collector.service, [region])[0]
+            if task_name(pool.account_id, dep, dep_region) in planned:
+                depends_on += shard_names(dep_collector, dep_region)
+        for shard, shard_name in zip(
+            collector.shards or [None], shard_names(collector, region)
+        ):
+            tasks.append(
+                Task(
+                    shard_name,
+                    pool.account_id,
+                    region,
+                    collector.service,
+                    run_collector,
+                    (pool, collector, region, shard),
+                    tuple(depends_on),
                 )
+            )
+    return tasks
 
-    all_results = {}
-    for future in as_completed(futures):
-        result = future.result()
-        if result:
 
-            try:
-                # service_name = result[0].get("Service", "unknown")
-                service_name = result[0]
-            except Exception as err:
-                print(err)
-                service_name = "unknown"
+def print_plan(tasks):
+    """print a summary of the planned tasks."""
+    per_service = Counter(task.service for task in tasks)
+    regions = {task.region for task in tasks}
+    accounts = {task.account for task in tasks}
+    for service, count in sorted(per_service.items()):
+        print(f"{service:20} {count}")
+    print(
+        f"{len(tasks)} tasks across {len(regions)} regions "
+        f"in {len(accounts)} accounts"
+    )
+
+
+def print_throttle_report(report):
+    """print throttle events and token wait time per endpoint."""
+    throttles = sum(row["throttles"] for row in report.values())
+    waited = sum(row["waited"] for row in report.values())
+    print(f"rate limiting: {throttles} throttles, {waited:.1f}s waiting for tokens")
+    for (account, service, region), row in sorted(report.items()):
+        if row["throttles"] or row["waited"]:
+            print(
+                f"  {account} {service:20} {region:15} {row['calls']} calls, "
+                f"{row['throttles']} throttles, {row['waited']}s waited, "
+                f"{row['rate']}/s final rate"
+            )
+
+
+def plan_accounts(executor, pools, regions=None, collectors=None):
+    """plan every account's tasks, discovering each account's regions."""
+
+    def plan(pool):
+        return plan_tasks(pool, regions or get_all_regions(pool.session), collectors)
+
+    tasks = []
+    for pool, future in [(pool, executor.submit(plan, pool)) for pool in pools]:
+        try:
+            tasks.extend(future.result())
+        except aws_errors() as e:
+            print(f"Error planning account {pool.account_id}: {e}")
+    return tasks
+
+
+def config_resource(item):
+    """one advanced query result row, its configuration parsed.
 
-            if service_name not in all_results:
-                all_results[service_name] = []
-            all_results[service_name].extend(result[1])
+    the item keeps config's shape (camelCase configuration, lowercase
+    key/value tags), which differs from the api's for many types, e.g.
+    kms keys or iam role policies, so it is never mixed into api outputs.
+    """
+    configuration = item.get("configuration")
+    if isinstance(configuration, str):
+        item = {**item, "configuration": json.loads(configuration)}
+    return item
 
 
-def write_to_file(data, file_name):
+def query_config_aggregator(pool, aggregator, region, resource_types):
+    """every resource of resource_types an aggregator holds.
+
+    returns ({(account, region, resource type): [resource, ...]}, api calls).
+    global resources are recorded in region "global".
+    """
+    client = pool.client("config", region)
+    types = ", ".join(f"'{t}'" for t in sorted(resource_types))
+    expression = f"SELECT {CONFIG_QUERY_FIELDS} WHERE resourceType IN ({types})"
+    paginator = client.get_paginator("select_aggregate_resource_config")
+    cells = {}
+    calls = 0
+    for page in paginator.paginate(
+        Expression=expression, ConfigurationAggregatorName=aggregator
+    ):
+        calls += 1
+        for row in page.get("Results", []):
+            item = json.loads(row)
+            cell = (item["accountId"], item["awsRegion"], item["resourceType"])
+            cells.setdefault(cell, []).append(config_resource(item))
+    return cells, calls
+
+
+def collect_from_config(pool, aggregator, tasks, history):
+    """serve tasks from an AWS Config aggregator; returns the rest and a report.
+
+    aggregator is NAME or NAME@REGION and is queried with pool. a task is
+    served when its collector is in CONFIG_RESOURCE_TYPES and the aggregator
+    holds at least one resource of that type in the task's account and
+    region, so types a recorder does not record, or a source that is not
+    aggregated, fall back to the service's own api. served resources are
+    written as config items to the task's output labelled
+    CONFIG_OUTPUT_LABEL, e.g. {account}-ec2-{region}-describe_vpcs-Vpcs-config,
+    never to the api-shaped output, and any api output an earlier run left
+    for the task is removed so the two never both count. the report has, per collector, the
+    source, tasks and resources, and estimates the api calls saved from
+    each served task's pages in the task history.
+    """
+    name, _, region = aggregator.partition("@")
+    region = region or pool.session.region_name or "us-east-1"
+    candidates = {}
+    for task in tasks:
+        if task.func is not run_collector or task.args[3] is not None:
+            continue
+        collector = task.args[1]
+        resource_type = CONFIG_RESOURCE_TYPES.get(collector.name)
+        if resource_type is not None:
+            candidates[(task.account, task.region, resource_type)] = task
+    if not candidates:
+        return tasks, {}
+
+    resource_types = {resource_type for _, _, resource_type in candidates}
     try:
-        with open(f"{DATA_DIR}/{file_name}", "w", encoding="utf-8") as f:
+        cells, config_calls = query_config_aggregator(
+            pool, name, region, resource_types
+        )
+    except aws_errors() as e:
+        print(f"Error querying config aggregator {name}: {e}")
+        return tasks, {}
+
+    report = {}
+    served = set()
+    estimated_calls = 0
+    for (account_id, cell_region, resource_type), resources in sorted(cells.items()):
+        task = candidates.get((account_id, cell_region, resource_type))
+        if task is None and cell_region == "global":
+            service = resource_type.split("::")[1].lower()
+            task_region = GLOBAL_SERVICES.get(service, cell_region)
+            task = candidates.get((account_id, task_region, resource_type))
+        if task is None:
+            continue
+        _, collector, task_region, _ = task.args
+        with ResourceWriter(
+            output_file_name(account_id, collector, task_region, CONFIG_OUTPUT_LABEL),
+            collector.key,
+            account_id,
+        ) as out:
+            out.write(resources)
+        # an earlier api run's output is stale now the -config one replaces it
+        remove_output(output_file_name(account_id, collector, task_region), account_id)
+        served.add(task.name)
+        estimated_calls += history.tasks.get(task.name, {}).get("pages") or 1
+        row = report.setdefault(
+            collector.name, {"source": "config", "tasks": 0, "resources": 0}
+        )
+        row["tasks"] += 1
+        row["resources"] += len(resources)
+
+    remaining = [task for task in tasks if task.name not in served]
+    for task in remaining:
+        collector_name = task_collector(task.name).split("[", 1)[0]
+        row = report.setdefault(
+            collector_name, {"source": "api", "tasks": 0, "resources": None}
+        )
+        if row["source"] == "config":
+            row["source"] = "config+api"
+        row["tasks"] += 1
+    report = {
+        "aggregator": aggregator,
+        "config_calls": config_calls,
+        "estimated_api_calls": estimated_calls,
+        "calls_saved": estimated_calls - config_calls,
+        "collectors": report,
+    }
+    return remaining, report
+
+
+def print_config_report(report):
+    """print which source served each collector and the api calls saved."""
+    print(
+        f"config aggregator {report['aggregator']}: {report['config_calls']} "
+        f"query calls replaced ~{report['estimated_api_calls']} api calls "
+        f"({report['calls_saved']} saved)"
+    )
+    for name, row in sorted(report["collectors"].items()):
+        resources = "" if row["resources"] is None else f", {row['resources']}"
+        print(f"  {name:50} {row['source']:10} {row['tasks']} tasks{resources}")
+
+
+def collect_and_save_resources(
+    regions=None,
+    collectors=None,
+    accounts=None,
+    role_name=ORG_ROLE_NAME,
+    account_limit=None,
+    pools=None,
+    resume=False,
+    config_aggregator=None,
+):
+    """collect and save resources.
+
+    with accounts, every account's task matrix runs through one scheduler,
+    capped at TASK_WORKERS overall and account_limit per account. pools can be
+    passed in instead of accounts, one ClientPool per account.
+
+    finished tasks and page tokens are journaled to CHECKPOINT_FILE; with
+    resume, tasks the journal has as finished are skipped and interrupted
+    listings continue where they stopped. the journal is removed once every
+    task has finished.
+
+    with config_aggregator (NAME or NAME@REGION, in the caller's account or
+    the only pool's), the types it covers are read from AWS Config and only
+    the rest run as tasks; see collect_from_config.
+    """
+    if pools is None:
+        pools = account_pools(accounts, role_name)
+    checkpoint = CheckpointJournal(f"{DATA_ROOT}/{CHECKPOINT_FILE}", resume)
+    for pool in pools:
+        pool.checkpoint = checkpoint
+    history = TaskHistory(f"{DATA_ROOT}/{HISTORY_FILE}")
+    timeline = []
+
+    counts = Counter()
+    with ThreadPoolExecutor(max_workers=WORKERS) as executor:
+        tasks = plan_accounts(executor, pools, regions, collectors)
+        # longest first, so the giants never start last and leave workers idle
+        tasks.sort(key=history.estimate, reverse=True)
+        if config_aggregator:
+            config_pool = pools[0] if len(pools) == 1 else ClientPool()
+            tasks, config_report = collect_from_config(
+                config_pool, config_aggregator, tasks, history
+            )
+            if config_report:
+                for name, row in config_report["collectors"].items():
+                    if row["resources"]:
+                        counts[COLLECTORS[name].service] += row["resources"]
+                print_config_report(config_report)
+                os.makedirs(DATA_ROOT, exist_ok=True)
+                write_to_file(config_report, CONFIG_REPORT_FILE, DATA_ROOT)
+        pending = [task for task in tasks if task.name not in checkpoint.done]
+        if len(pending) < len(tasks):
+            print(
+                f"resuming: {len(tasks) - len(pending)} of {len(tasks)} "
+                "tasks already finished"
+            )
+        finished = 0
+        for task, count in run_scheduled(
+            executor,
+            pending,
+            account_limit=account_limit,
+            finished=checkpoint.done,
+            timeline=timeline,
+        ):
+            counts[task.service] += count or 0
+            checkpoint.finish(task.name, count)
+            finished += 1
+    checkpoint.close(remove=finished == len(pending))
+    for task, start, end, pages in timeline:
+        history.record(task, end - start, pages)
+    history.save()
+    print_utilisation(timeline, TASK_WORKERS)
+
+    stats = Counter()
+    throttle_report = {}
+    for pool in pools:
+        stats.update(pool.stats())
+        stats["tagging calls"] += pool.tags.calls
+        throttle_report.update(pool.throttle_report())
+    print(
+        f"client cache: {stats['clients']} clients, "
+        f"{stats['hits']} hits, {stats['misses']} misses"
+    )
+    print_throttle_report(throttle_report)
+    print(f"tag index: {stats['tagging calls']} tagging api calls")
+
+    for store in SNAPSHOT_STORES.values():
+        change_set_path = store.save()
+        print(
+            f"snapshots: {len(store.changes)} files changed, "
+            f"{store.unchanged} unchanged, change set in {change_set_path}"
+        )
+    SNAPSHOT_STORES.clear()
+    return counts
+
+
+def write_to_file(data, file_name, output_dir=None):
+    output_dir = output_dir or data_dir()
+    try:
+        with open(f"{output_dir}/{file_name}", "w", encoding="utf-8") as f:
             json.dump(data, f, indent=4, sort_keys=True, default=str)
     except Exception as err:
         print(err)
         with open(
-            f"{DATA_DIR}/{file_name.replace('.json','.txt')}", "w", encoding="utf-8"
+            f"{output_dir}/{file_name.replace('.json','.txt')}", "w", encoding="utf-8"
         ) as f:
             f.write(str(data))
     # print(f"Data written to {file_name}")
 
 
+def open_output(path, mode, compression=None):
+    """open an output file as text, (de)compressing with gzip or zstd."""
+    if compression == "gzip":
+        return gzip.open(path, f"{mode}t", encoding="utf-8")
+    if compression == "zstd":
+        try:
+            import zstandard
+        except ImportError as err:
+            raise RuntimeError("zstd compression needs the zstandard package") from err
+        raw = open(path, f"{mode}b")  # pylint: disable=consider-using-with
+        if mode == "w":
+            stream = zstandard.ZstdCompressor().stream_writer(raw, closefd=True)
+        else:
+            stream = zstandard.ZstdDecompressor().stream_reader(raw, closefd=True)
+        return io.TextIOWrapper(stream, encoding="utf-8")
+    return open(path, mode, encoding="utf-8")  # pylint: disable=consider-using-with
+
+
+class ResourceWriter:
+    """write a task's resources to its output file.
+
+    in streaming mode every page is appended to {name}.ndjson (optionally
+    .gz/.zst) as it arrives, so memory is bounded by the page size; otherwise
+    pages are buffered and written as pretty-printed json on close.
+    """
+
+    def __init__(
+        self,
+        file_name,
+        key=None,
+        account_id=None,
+        stream=None,
+        compression=None,
+        snapshots=None,
+        offset=None,
+    ):
+        self.file_name = file_name
+        self.key = key
+        self.data_dir = data_dir(account_id)
+        self.stream = OUTPUT_OPTIONS["stream"] if stream is None else stream
+        self.compression = compression or OUTPUT_OPTIONS["compression"]
+        if snapshots is None and OUTPUT_OPTIONS["snapshots"]:
+            snapshots = snapshot_store(self.data_dir)
+        self.snapshots = snapshots
+        # byte offset of a resumed ndjson file to truncate to and append from
+        self.offset = offset
+        self.count = 0
+        self._buffer = []
+        self._file = None
+        self._path = None
+        self._hashes = {}
+        self._file_hash = hashlib.sha256()
+
+    def __enter__(self):
+        if self.stream:
+            self._path = ndjson_path(
+                f"{self.data_dir}/{self.file_name}", self.compression
+            )
+            # with snapshots, only replace the file if its content changed
+            path = f"{self._path}.tmp" if self.snapshots else self._path
+            if self.offset is not None and os.path.exists(path):
+                with open(path, "r+b") as f:
+                    f.truncate(self.offset)
+                self._file = open_output(path, "a", self.compression)
+            else:
+                self._file = open_output(path, "w", self.compression)
+        return self
+
+    def tell(self):
+        """flush streamed output and return its size in bytes."""
+        if self._file is None:
+            return None
+        self._file.flush()
+        return self._file.tell()
+
+    def write(self, resources, key=None):
+        """write one page of resources taken from response key."""
+        self.count += len(resources)
+        _task_pages.count = getattr(_task_pages, "count", 0) + 1
+        if self.snapshots is not None:
+            for resource in resources:
+                self._hash_resource(resource, key or self.key)
+        if self._file is None:
+            self._buffer.extend(resources)
+            return
+        for resource in resources:
+            self._file.write(json.dumps(resource, sort_keys=True, default=str))
+            self._file.write("\n")
+
+    def _hash_resource(self, resource, key):
+        digest = resource_hash(resource)
+        self._file_hash.update(digest.encode())
+        resource_id = natural_id(resource, key) or digest
+        unique_id, n = resource_id, 1
+        while unique_id in self._hashes:
+            n += 1
+            unique_id = f"{resource_id}#{n}"
+        self._hashes[unique_id] = digest
+
+    def __exit__(self, exc_type, exc, tb):
+        changed = True
+        if exc_type is None and self.snapshots is not None:
+            changed = self.snapshots.record(
+                self.file_name, self._file_hash.hexdigest(), self._hashes
+            )
+        if self._file is not None:
+            self._file.close()
+            if self.snapshots is not None:
+                if exc_type is None and changed:
+                    os.replace(f"{self._path}.tmp", self._path)
+                else:
+                    os.remove(f"{self._path}.tmp")
+        elif exc_type is None and changed:
+            write_to_file(self._buffer, self.file_name, self.data_dir)
+        self._buffer = []
+        self._hashes = {}
+
+
+# id-like fields that point at another resource rather than naming this one
+FOREIGN_ID_KEYS = {"accountid", "kmskeyid", "ownerid", "requesterid"}
+
+
+def id_hint(key):
+    """singular resource name for a response key, e.g. Policies -> policy."""
+    hint = key.lower()
+    for suffix in ("summarylist", "summaries", "list"):
+        if hint.endswith(suffix) and hint != suffix:
+            hint = hint[: -len(suffix)]
+            break
+    if hint.endswith("ies"):
+        return hint[:-3] + "y"
+    if hint.endswith("sses"):
+        return hint[:-2]
+    return hint.rstrip("s")
+
+
+def natural_id(resource, key=None):
+    """stable identifier for a resource, or None if it has none.
+
+    key is the response key the resource came from and is used to prefer
+    its own id field, e.g. VpcId for Vpcs over DhcpOptionsId.
+    """
+    if isinstance(resource, str):
+        return resource
+    if not isinstance(resource, dict):
+        return None
+    fields = {name.lower(): value for name, value in resource.items()}
+    candidates = []
+    if key:
+        hint = id_hint(key)
+        candidates += [f"{hint}arn", f"{hint}id", f"{hint}name"]
+    candidates += ["arn", "resourcearn", "id", "resourceid", "name"]
+    for candidate in candidates:
+        if isinstance(fields.get(candidate), str):
+            return fields[candidate]
+    for suffix in ("arn", "id", "name"):
+        for name in sorted(fields):
+            if (
+                name.endswith(suffix)
+                and name not in FOREIGN_ID_KEYS
+                and isinstance(fields[name], str)
+            ):
+                return fields[name]
+    return None
+
+
+def resource_hash(resource):
+    """content hash of a resource."""
+    canonical = json.dumps(resource, sort_keys=True, default=str)
+    return hashlib.sha256(canonical.encode()).hexdigest()[:16]
+
+
+class SnapshotStore:
+    """content hashes of the previous run, used to write only what changed.
+
+    state lives in {output_dir}/.snapshots/state.json as
+    {file: {"hash": file_hash, "resources": {natural_id: hash}}}; every run
+    appends an added/removed/modified change set to .snapshots/changes/.
+    """
+
+    def __init__(self, output_dir=None):
+        self.dir = f"{output_dir or data_dir()}/.snapshots"
+        self.state_path = f"{self.dir}/state.json"
+        self.state = {}
+        if os.path.exists(self.state_path):
+            with open(self.state_path, encoding="utf-8") as f:
+                self.state = json.load(f)
+        self.changes = {}
+        self.unchanged = 0
+        self._lock = threading.Lock()
+
+    def record(self, file_name, file_hash, hashes):
+        """record a file's new content; returns whether it changed."""
+        with self._lock:
+            previous = self.state.get(file_name)
+            self.state[file_name] = {"hash": file_hash, "resources": hashes}
+            if previous is not None and previous["hash"] == file_hash:
+                self.unchanged += 1
+                return False
+            old = previous["resources"] if previous else {}
+            self.changes[file_name] = {
+                "added": sorted(hashes.keys() - old.keys()),
+                "removed": sorted(old.keys() - hashes.keys()),
+                "modified": sorted(
+                    key for key in hashes.keys() & old.keys() if hashes[key] != old[key]
+                ),
+            }
+            return True
+
+    def forget(self, file_name):
+        """drop a file that is no longer written; its resources count as removed."""
+        with self._lock:
+            previous = self.state.pop(file_name, None)
+            if previous is not None:
+                self.changes[file_name] = {
+                    "added": [],
+                    "removed": sorted(previous["resources"]),
+                    "modified": [],
+                }
+
+    def save(self):
+        """persist the state and write this run's change set."""
+        os.makedirs(f"{self.dir}/changes", exist_ok=True)
+        with open(f"{self.state_path}.tmp", "w", encoding="utf-8") as f:
+            json.dump(self.state, f)
+        os.replace(f"{self.state_path}.tmp", self.state_path)
+
+        run = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%S.%fZ")
+        change_set_path = f"{self.dir}/changes/{run}.json"
+        with open(change_set_path, "w", encoding="utf-8") as f:
+            json.dump(
+                {"run": run, "unchanged": self.unchanged, "files": self.changes},
+                f,
+                indent=4,
+                sort_keys=True,
+            )
+        return change_set_path
+
+
+SNAPSHOT_STORES = {}
+_snapshot_stores_lock = threading.Lock()
+
+
+def snapshot_store(output_dir):
+    """the run's SnapshotStore for an output directory."""
+    with _snapshot_stores_lock:
+        if output_dir not in SNAPSHOT_STORES:
+            SNAPSHOT_STORES[output_dir] = SnapshotStore(output_dir)
+        return SNAPSHOT_STORES[output_dir]
+
+
+def ndjson_path(json_path, compression=None):
+    """ndjson file name for a .json output path."""
+    return json_path[: -len(".json")] + ".ndjson" + COMPRESSION_SUFFIXES[compression]
+
+
+def remove_output(file_name, account_id=None):
+    """delete an output file, rendered or streamed, that is no longer written."""
+    output_dir = data_dir(account_id)
+    json_path = f"{output_dir}/{file_name}"
+    for path in [json_path] + [ndjson_path(json_path, c) for c in COMPRESSION_SUFFIXES]:
+        if os.path.exists(path):
+            os.remove(path)
+    if OUTPUT_OPTIONS["snapshots"]:
+        snapshot_store(output_dir).forget(file_name)
+
+
+def render_json(path):
+    """render a streamed ndjson output file as the pretty-printed json file."""
+    compression = None
+    for name, suffix in COMPRESSION_SUFFIXES.items():
+        if suffix and path.endswith(suffix):
+            compression = name
+    with open_output(path, "r", compression) as f:
+        data = [json.loads(line) for line in f if line.strip()]
+    json_path = path[: -len(".ndjson" + COMPRESSION_SUFFIXES[compression])] + ".json"
+    with open(json_path, "w", encoding="utf-8") as f:
+        json.dump(data, f, indent=4, sort_keys=True, default=str)
+    return json_path
+
+
+def render_all(output_dir=None):
+    """render every streamed output file under output_dir (default: all accounts)."""
+    rendered = []
+    pattern = f"{output_dir}/*.ndjson*" if output_dir else f"{DATA_ROOT}/*/*.ndjson*"
+    for path in sorted(glob.glob(pattern)):
+        rendered.append(render_json(path))
+    return rendered
+
+
+register_builtin_collectors()
+
+
+def main(argv=None):
+    """main entrypoint."""
+    parser = argparse.ArgumentParser(description="Inventory AWS resources.")
+    parser.add_argument(
+        "--plan", action="store_true", help="print the planned tasks and exit"
+    )
+    parser.add_argument(
+        "--list-collectors",
+        action="store_true",
+        help="list the registered collectors and exit",
+    )
+    parser.add_argument(
+        "--collector",
+        action="append",
+        dest="collectors",
+        help="only run this collector (repeatable), e.g. ec2.describe_vpcs",
+    )
+    parser.add_argument(
+        "--stream",
+        action="store_true",
+        help="write each page to ndjson as it arrives (bounded memory)",
+    )
+    parser.add_argument(
+        "--compress",
+        choices=["gzip", "zstd"],
+        help="compress streamed output",
+    )
+    parser.add_argument(
+        "--snapshots",
+        action="store_true",
+        help="only rewrite changed files and write a change set for this run",
+    )
+    parser.add_argument(
+        "--no-tags",
+        action="store_true",
+        help="skip joining tags from the resource groups tagging api",
+    )
+    parser.add_argument(
+        "--incremental",
+        action="store_true",
+        help="only pull what changed since the last run where supported "
+        "(guardduty findings, ec2 snapshots and images)",
+    )
+    parser.add_argument(
+        "--org",
+        action="store_true",
+        help="inventory every active account in the organization",
+    )
+    parser.add_argument(
+        "--accounts",
+        help="comma separated account ids, or @file with one id per line",
+    )
+    parser.add_argument(
+        "--role-name",
+        default=ORG_ROLE_NAME,
+        help=f"role assumed in each account (default: {ORG_ROLE_NAME})",
+    )
+    parser.add_argument(
+        "--account-concurrency",
+        type=int,
+        default=ACCOUNT_CONCURRENCY,
+        help=f"max in-flight tasks per account (default: {ACCOUNT_CONCURRENCY})",
+    )
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        help="skip tasks an interrupted run finished and continue its listings",
+    )
+    parser.add_argument(
+        "--config-aggregator",
+        metavar="NAME[@REGION]",
+        help="read the resource types an AWS Config aggregator covers from it "
+        "and only call the service apis for the rest",
+    )
+    parser.add_argument(
+        "--render",
+        action="store_true",
+        help="render streamed ndjson output as pretty-printed json and exit",
+    )
+    args = parser.parse_args(argv)
+
+    if args.list_collectors:
+        load_plugins()
+        for name, collector in sorted(COLLECTORS.items()):
+            print(f"{name:60} {collector.output}")
+        return
+
+    if args.render:
+        for path in render_all():
+            print(f"Rendered {path}")
+        return
+
+    OUTPUT_OPTIONS["stream"] = args.stream or bool(args.compress)
+    OUTPUT_OPTIONS["compression"] = args.compress
+    OUTPUT_OPTIONS["tags"] = not args.no_tags
+    OUTPUT_OPTIONS["snapshots"] = args.snapshots
+    OUTPUT_OPTIONS["incremental"] = args.incremental
+    load_plugins()
+
+    accounts = None
+    if args.org:
+        accounts = list_org_accounts()
+    elif args.accounts and args.accounts.startswith("@"):
+        with open(args.accounts[1:], encoding="utf-8") as f:
+            accounts = [line.strip() for line in f if line.strip()]
+    elif args.accounts:
+        accounts = [a.strip() for a in args.accounts.split(",") if a.strip()]
+    account_limit = args.account_concurrency if accounts else None
+
+    if args.plan:
+        pools = account_pools(accounts, args.role_name)
+        with ThreadPoolExecutor(max_workers=WORKERS) as executor:
+            print_plan(plan_accounts(executor, pools, collectors=args.collectors))
+        return
+    collect_and_save_resources(
+        collectors=args.collectors,
+        accounts=accounts,
+        role_name=args.role_name,
+        account_limit=account_limit,
+        resume=args.resume,
+        config_aggregator=args.config_aggregator,
+    )
+
+
 if __name__ == "__main__":
-    collect_and_save_resources()
+    main()
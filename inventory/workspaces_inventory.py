@@ -1,4 +1,5 @@
-import boto3
+# pylint: disable=import-outside-toplevel
+import argparse
 import csv
 import datetime
 from datetime import timedelta
@@ -19,6 +20,8 @@ def get_all_workspaces(region: str):
     Fetch all WorkSpaces in the specified region using pagination.
     Returns a list of WorkSpaces as dictionaries.
     """
+    import boto3
+
     client = boto3.client('workspaces', region_name=region)
     workspaces = []
     next_token = None
@@ -42,6 +45,8 @@ def get_workspace_tags(region: str, workspace_id: str):
     Retrieve tags for a specific WorkSpace.
     Returns a dict of tag key->value.
     """
+    import boto3
+
     client = boto3.client('workspaces', region_name=region)
     response = client.describe_tags(ResourceId=workspace_id)
     tag_list = response.get('TagList', [])
@@ -54,6 +59,8 @@ def get_workspace_metrics(region: str, workspace_id: str, metric_name: str,
     Retrieve the specified metric from CloudWatch for a single WorkSpace.
     Returns a value (e.g., sum of the metric) across the time period, or None if data is not found.
     """
+    import boto3
+
     cw = boto3.client('cloudwatch', region_name=region)
     
     # We use get_metric_data to retrieve metric across the time window.
@@ -101,6 +108,11 @@ def get_workspace_metrics(region: str, workspace_id: str, metric_name: str,
     return sum(values)  # Summation of daily sums, or daily averages, etc.
 
 def main():
+    """main entrypoint."""
+    argparse.ArgumentParser(
+        description="Report on WorkSpaces with tags and metrics."
+    ).parse_args()
+
     # 1. Set up time window for the last 30 days
     end_time = datetime.datetime.utcnow()
     start_time = end_time - timedelta(days=LOOKBACK_DAYS)
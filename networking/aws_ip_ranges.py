@@ -1,13 +1,13 @@
 """aws pricing"""
 
+# pylint: disable=import-outside-toplevel
+
+import argparse
 import json
 import logging
 import os
 from datetime import datetime
 
-import requests
-
-logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 TODAY = datetime.now().strftime("%Y-%m-%d")
@@ -16,6 +16,8 @@ DATA_DIR = os.environ.get("DATA_DIR", f"{os.environ.get("HOME")}/data")
 
 def get_ip_ranges():
     """Get ip data."""
+    import requests
+
     resp_ip = requests.get("https://ip-ranges.amazonaws.com/ip-ranges.json", timeout=15)
     filename = f"{DATA_DIR}/{TODAY}-aws-ip-ranges.json"
     with open(filename, "w", encoding="utf-8") as f:
@@ -26,6 +28,8 @@ def get_ip_ranges():
 
 def main():
     """main."""
+    argparse.ArgumentParser(description="Grab the AWS IP ranges.").parse_args()
+    logging.basicConfig(level=logging.INFO)
     get_ip_ranges()
 
 if __name__ == "__main__":
@@ -1,7 +1,11 @@
-import boto3
+# pylint: disable=import-outside-toplevel
+
+import argparse
 
 
 def get_support_severity_levels():
+    import boto3
+
     client = boto3.client(service_name="support", region_name="us-east-1")
 
     try:
@@ -26,14 +30,22 @@ __SUPPORT_LEVELS__ = {
     "low": "DEVELOPER",
 }
 
-support_levels = get_support_severity_levels()
 
-found = False
-for level, support_level in __SUPPORT_LEVELS__.items():
-    if level in support_levels:
-        found = True
-        print(f"Your AWS support level is: {support_level}")
-        break
+def main():
+    """main entrypoint."""
+    argparse.ArgumentParser(description="Check your AWS support level.").parse_args()
+    support_levels = get_support_severity_levels()
+
+    found = False
+    for level, support_level in __SUPPORT_LEVELS__.items():
+        if level in support_levels:
+            found = True
+            print(f"Your AWS support level is: {support_level}")
+            break
+
+    if not found:
+        print("Your AWS support level is: BASIC")
+
 
-if not found:
-    print("Your AWS support level is: BASIC")
+if __name__ == "__main__":
+    main()
@@ -1,12 +1,86 @@
 #!/usr/bin/env python3
+"""Back up every object and version of S3 buckets, then delete them."""
+# pylint: disable=import-outside-toplevel
 import sys
 import argparse
-import boto3
+import contextlib
+import csv
+import gzip
 import os
 import datetime
+import fnmatch
+import glob
+import hashlib
+import json
 import logging
+import queue
+import random
+import sqlite3
+import tarfile
+import tempfile
+import threading
+import time
+import urllib.parse
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+# delete_objects takes at most 1000 keys per call
+DELETE_BATCH_SIZE = 1000
+DELETE_WORKERS = 8
+MAX_ATTEMPTS = 5
+RETRYABLE_ERRORS = {'SlowDown', 'InternalError', 'ServiceUnavailable', 'RequestTimeout',
+                    'OperationAborted'}
+DOWNLOAD_WORKERS = 16
+# objects below the multipart threshold are fetched with a single GetObject
+MULTIPART_THRESHOLD = 64 * 1024 * 1024
+MULTIPART_CHUNK_SIZE = 8 * 1024 * 1024
+MAX_CONCURRENCY = 10
+# part sizes used by common upload tools, to verify multipart ETags
+COMMON_PART_SIZES_MIB = (5, 8, 15, 16, 50, 64, 100, 128)
+MANIFEST_SCHEMA = """
+CREATE TABLE IF NOT EXISTS objects (
+    id INTEGER PRIMARY KEY,
+    key TEXT NOT NULL,
+    version_id TEXT,
+    is_latest INTEGER,
+    delete_marker INTEGER,
+    size INTEGER,
+    etag TEXT,
+    state TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS objects_state ON objects (state);
+CREATE UNIQUE INDEX IF NOT EXISTS objects_key_version ON objects (key, version_id);
+CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value TEXT);
+CREATE TABLE IF NOT EXISTS paths (path TEXT PRIMARY KEY, object INTEGER NOT NULL);
+CREATE TABLE IF NOT EXISTS shards (
+    id INTEGER PRIMARY KEY,
+    start_after TEXT,
+    until TEXT,
+    marker TEXT,
+    done INTEGER NOT NULL DEFAULT 0
+);
+"""
+LIST_WORKERS = 8
+# a shard still truncated after this many pages splits off the rest of its range
+SPLIT_PAGES = 5
+# levels of Delimiter queries used to find the first split points
+DISCOVERY_DEPTH = 2
+# archive mode: tar shards are rolled over once they reach this many MiB
+ARCHIVE_SHARD_SIZE = 1024
+ARCHIVE_SUFFIXES = {None: '.tar', 'gzip': '.tar.gz', 'zstd': '.tar.zst'}
+# batch mode: buckets processed at once, sharing the worker budgets
+PARALLEL_BUCKETS = 8
+# inventory rows committed to the manifest at a time
+INVENTORY_BATCH = 10000
+# the object is already gone, so there is nothing left to back up
+GONE_ERRORS = {'NoSuchKey', 'NoSuchVersion', '404'}
+# key segments that cannot be used as file names as they are
+PATH_SEGMENTS = {'': '%00', '.': '%2E', '..': '%2E%2E'}
+# Ends the file of a key that is also the directory of longer keys
+PREFIX_KEY_SUFFIX = '%'
 
 def configure_logging(dry_run):
+    """Logs to a new file named after the mode and time; returns its name."""
     timestamp = datetime.datetime.utcnow().strftime("%Y%m%dT%H%M%SZ")
     mode = "dry-run" if dry_run else "destroy"
     log_filename = f"bucket_{mode}_{timestamp}.log"
@@ -15,129 +89,1280 @@ def configure_logging(dry_run):
                         format='%(asctime)s - %(levelname)s - %(message)s')
     return log_filename
 
-def download_objects(s3_client, bucket, download_dir, dry_run, log):
-    # Attempt to detect versioning
-    versioning_status = s3_client.get_bucket_versioning(Bucket=bucket)
-    versioned = versioning_status.get('Status') == 'Enabled'
 
-    if not os.path.exists(download_dir):
-        if not dry_run:
-            os.makedirs(download_dir, exist_ok=True)
-
-    if versioned:
-        paginator = s3_client.get_paginator('list_object_versions')
-        iterator = paginator.paginate(Bucket=bucket)
-        for page in iterator:
-            for version in page.get('Versions', []):
-                key = version['Key']
-                version_id = version['VersionId']
-                log.info(f"Downloading object {key} version {version_id}")
-                if dry_run:
-                    print(f"Would download {key} (version: {version_id})")
-                else:
-                    download_path = os.path.join(download_dir, key)
-                    os.makedirs(os.path.dirname(download_path), exist_ok=True)
-                    s3_client.download_file(Bucket=bucket, Key=key, Filename=download_path, ExtraArgs={'VersionId': version_id})
-
-            for marker in page.get('DeleteMarkers', []):
-                key = marker['Key']
-                version_id = marker['VersionId']
-                log.info(f"Not downloading delete marker {key} version {version_id}")
-                # Delete markers are not actual files, so we skip download
-                if dry_run:
-                    print(f"Would skip download delete marker: {key} (version: {version_id})")
+class Manifest:
+    """On-disk record of every listed key/version and how far it got.
+
+    Objects move listed -> downloaded -> verified -> deleted (delete markers
+    go straight from listed to deleted, objects that vanished before they
+    were backed up from listed to gone). The listing is split into key range
+    shards whose markers are saved with each page, so a resumed run
+    continues every shard where it stopped.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.lock = threading.Lock()
+        with self.lock:
+            self.db.execute('PRAGMA journal_mode=WAL')
+            self.db.executescript(MANIFEST_SCHEMA)
+
+    def get(self, name, default=None):
+        """A run setting or progress flag from the meta table."""
+        with self.lock:
+            row = self.db.execute('SELECT value FROM meta WHERE name = ?', (name,)).fetchone()
+        return json.loads(row[0]) if row else default
+
+    def set(self, name, value):
+        """Saves a run setting or progress flag."""
+        with self.lock, self.db:
+            self.db.execute('INSERT OR REPLACE INTO meta (name, value) VALUES (?, ?)',
+                            (name, json.dumps(value)))
+
+    def add(self, entries, shard=None, marker=None, splits=()):
+        """Records a page of listed entries; returns the shards split off."""
+        # entries are (key, version_id, is_latest, delete_marker, size, etag),
+        # version_id '' for unversioned buckets. Known entries are ignored
+        # unless they were deleted or gone and have reappeared. The page, the
+        # shard's marker after it (None once done) and any ranges split off
+        # the shard are committed together.
+        with self.lock, self.db:
+            self.db.executemany(
+                'INSERT INTO objects '
+                '(key, version_id, is_latest, delete_marker, size, etag, state) '
+                "VALUES (?, ?, ?, ?, ?, ?, 'listed') "
+                'ON CONFLICT (key, version_id) DO UPDATE SET is_latest = excluded.is_latest, '
+                "size = excluded.size, etag = excluded.etag, state = 'listed' "
+                "WHERE state IN ('deleted', 'gone')",
+                entries)
+            if shard is None:
+                return []
+            self.db.execute('UPDATE shards SET until = ?, marker = ?, done = ? WHERE id = ?',
+                            (shard['until'], json.dumps(marker), int(marker is None), shard['id']))
+            return self._add_shards(splits)
+
+    def add_shards(self, ranges):
+        """Starts a sharded listing with these (start_after, until) ranges."""
+        with self.lock, self.db:
+            self.db.execute("INSERT OR REPLACE INTO meta (name, value) VALUES ('sharded', 'true')")
+            return self._add_shards(ranges)
+
+    def _add_shards(self, ranges):
+        shards = []
+        for start_after, until in ranges:
+            cursor = self.db.execute('INSERT INTO shards (start_after, until) VALUES (?, ?)',
+                                     (start_after, until))
+            shards.append({'id': cursor.lastrowid, 'start_after': start_after, 'until': until,
+                           'marker': None})
+        return shards
+
+    def pending_shards(self):
+        """Shards still to be listed, with the marker each stopped at."""
+        with self.lock:
+            rows = self.db.execute(
+                'SELECT id, start_after, until, marker FROM shards WHERE done = 0').fetchall()
+        return [{'id': i, 'start_after': start_after, 'until': until,
+                 'marker': json.loads(marker or 'null')}
+                for i, start_after, until, marker in rows]
+
+    def mark(self, ids, state):
+        """Moves the objects with these ids to state."""
+        with self.lock, self.db:
+            self.db.executemany('UPDATE objects SET state = ? WHERE id = ?',
+                                [(state, i) for i in ids])
+
+    def rows(self, where, chunk=1000):
+        """Objects matching the SQL condition where, in id order."""
+        # Read a chunk at a time so other threads can update states in between
+        last = 0
+        while True:
+            with self.lock:
+                rows = self.db.execute(
+                    'SELECT id, key, version_id, is_latest, delete_marker, size, etag, state '
+                    'FROM objects '
+                    f'WHERE id > ? AND ({where}) ORDER BY id LIMIT ?', (last, chunk)).fetchall()
+            if not rows:
+                return
+            for row in rows:
+                yield dict(zip(('id', 'Key', 'VersionId', 'IsLatest', 'DeleteMarker', 'Size',
+                                'ETag', 'State'), row))
+            last = rows[-1][0]
+
+    def is_prefix(self, key):
+        """Whether any listed key continues key with a '/'."""
+        # '0' sorts right after '/', so this is a range scan of the key index
+        with self.lock:
+            row = self.db.execute('SELECT 1 FROM objects WHERE key > ? AND key < ? LIMIT 1',
+                                  (f'{key}/', f'{key}0')).fetchone()
+        return row is not None
+
+    def claim(self, path, object_id):
+        """Records that path holds the object's backup; False if another object holds it."""
+        with self.lock, self.db:
+            self.db.execute('INSERT OR IGNORE INTO paths (path, object) VALUES (?, ?)',
+                            (path, object_id))
+            row = self.db.execute('SELECT object FROM paths WHERE path = ?', (path,)).fetchone()
+        return row[0] == object_id
+
+    def counts(self):
+        """Objects per state."""
+        with self.lock:
+            return dict(self.db.execute('SELECT state, COUNT(*) FROM objects GROUP BY state'))
+
+    def totals(self):
+        """(objects/versions, bytes) per state."""
+        with self.lock:
+            return {state: (count, size) for state, count, size in self.db.execute(
+                'SELECT state, COUNT(*), COALESCE(SUM(size), 0) FROM objects GROUP BY state')}
+
+    def close(self):
+        """Closes the database."""
+        with self.lock:
+            self.db.close()
+
+
+def bucket_versioned(s3_client, bucket, manifest):
+    """Whether the bucket has (or had) versioning, remembered in the manifest."""
+    versioned = manifest.get('versioned')
+    if versioned is None:
+        versioning_status = s3_client.get_bucket_versioning(Bucket=bucket)
+        # Suspended buckets keep their old versions, which must go too
+        versioned = versioning_status.get('Status') in ('Enabled', 'Suspended')
+        manifest.set('versioned', versioned)
+    return versioned
+
+
+def normalise(name):
+    """An inventory column name in one spelling for every format."""
+    # VersionId in CSV schemas, version_id in ORC/Parquet
+    return name.strip().lower().replace('_', '')
+
+
+def read_inventory_manifest(s3_client, source):
+    """An S3 Inventory manifest.json and a function opening its data files."""
+    # From a local path or s3://bucket/key; data files open as seekable binary files
+    if source.startswith('s3://'):
+        manifest_bucket, _, manifest_key = source[len('s3://'):].partition('/')
+        response = s3_client.get_object(Bucket=manifest_bucket, Key=manifest_key)
+        inventory = json.loads(response['Body'].read())
+        destination = inventory['destinationBucket'].split(':::')[-1]
+
+        def open_s3_file(key):
+            # ORC and Parquet readers need to seek, so spool to a temp file
+            spool = tempfile.TemporaryFile()
+            s3_client.download_fileobj(destination, key, spool)
+            spool.seek(0)
+            return spool
 
+        return inventory, open_s3_file
+
+    with open(source, encoding='utf-8') as f:
+        inventory = json.load(f)
+    base = os.path.dirname(os.path.abspath(source))
+
+    def open_local_file(key):
+        # Next to the manifest, or at its key under a local copy of the destination bucket
+        candidates = [os.path.join(base, os.path.basename(key))]
+        parent = base
+        while os.path.dirname(parent) != parent:
+            candidates.append(os.path.join(parent, key))
+            parent = os.path.dirname(parent)
+        for path in candidates:
+            if os.path.exists(path):
+                return open(path, 'rb')
+        raise FileNotFoundError(f"Inventory file {key} not found near {source}")
+
+    return inventory, open_local_file
+
+
+def read_inventory_file(raw, inventory):
+    """Records of one data file as dicts keyed by normalised column name."""
+    file_format = inventory['fileFormat'].upper()
+    if file_format == 'CSV':
+        columns = [normalise(column) for column in inventory['fileSchema'].split(',')]
+        with gzip.open(raw, 'rt', encoding='utf-8', newline='') as f:
+            for row in csv.reader(f):
+                record = dict(zip(columns, row))
+                # CSV inventories URL-encode keys
+                record['key'] = urllib.parse.unquote_plus(record['key'])
+                yield record
+        return
+
+    try:
+        import pyarrow.orc
+        import pyarrow.parquet
+    except ImportError as err:
+        raise RuntimeError("ORC and Parquet inventories need the pyarrow package") from err
+    if file_format == 'PARQUET':
+        batches = pyarrow.parquet.ParquetFile(raw).iter_batches(batch_size=INVENTORY_BATCH)
     else:
-        # Non-versioned bucket
-        paginator = s3_client.get_paginator('list_objects_v2')
-        iterator = paginator.paginate(Bucket=bucket)
-        for page in iterator:
-            for obj in page.get('Contents', []):
-                key = obj['Key']
-                log.info(f"Downloading object {key}")
-                if dry_run:
-                    print(f"Would download {key}")
-                else:
-                    download_path = os.path.join(download_dir, key)
-                    os.makedirs(os.path.dirname(download_path), exist_ok=True)
-                    s3_client.download_file(bucket, key, download_path)
-
-def delete_objects_and_bucket(s3_client, bucket, dry_run, log):
-    # Attempt to detect versioning
-    versioning_status = s3_client.get_bucket_versioning(Bucket=bucket)
-    versioned = versioning_status.get('Status') == 'Enabled'
-
-    if versioned:
-        paginator = s3_client.get_paginator('list_object_versions')
-        iterator = paginator.paginate(Bucket=bucket)
-
-        to_delete = []
-        for page in iterator:
-            for version in page.get('Versions', []):
-                to_delete.append({'Key': version['Key'], 'VersionId': version['VersionId']})
-            for marker in page.get('DeleteMarkers', []):
-                to_delete.append({'Key': marker['Key'], 'VersionId': marker['VersionId']})
-
-        # Batch delete
-        # Note: S3 delete_objects can handle up to 1000 keys at a time.
-        for i in range(0, len(to_delete), 1000):
-            batch = to_delete[i:i+1000]
-            log.info(f"Deleting {len(batch)} objects/versions in batch.")
-            if dry_run:
-                for d in batch:
-                    print(f"Would delete {d}")
-            else:
-                s3_client.delete_objects(Bucket=bucket, Delete={'Objects': batch, 'Quiet': True})
+        orc = pyarrow.orc.ORCFile(raw)
+        batches = (orc.read_stripe(i) for i in range(orc.nstripes))
+    for batch in batches:
+        for record in batch.to_pylist():
+            yield {normalise(name): value for name, value in record.items()}
+
+
+def as_bool(value):
+    """An inventory boolean, given as a bool or as text."""
+    return value is True or str(value).lower() == 'true'
+
+
+def load_inventory(s3_client, bucket, manifest, source, log):
+    """Fills the manifest from an S3 Inventory report instead of a listing."""
+    # Returns False if the report cannot stand in for one
+    if manifest.get('inventory_loaded'):
+        return True
+    inventory, open_file = read_inventory_manifest(s3_client, source)
+    if inventory.get('sourceBucket') != bucket:
+        raise ValueError(f"{source} is an inventory of {inventory.get('sourceBucket')}, "
+                         f"not {bucket}")
+    versioned = bucket_versioned(s3_client, bucket, manifest)
+    if versioned and 'versionid' not in normalise(inventory['fileSchema']):
+        log.warning(f"{source} only has current versions, listing the bucket instead")
+        print("The inventory only lists current versions; listing the bucket instead.")
+        return False
+
+    done_files = set(manifest.get('inventory_files', []))
+    progress = Progress('Loaded')
+    for data_file in inventory['files']:
+        if data_file['key'] in done_files:
+            continue
+        log.info(f"Loading inventory file {data_file['key']}")
+        batch = []
+        with open_file(data_file['key']) as raw:
+            for record in read_inventory_file(raw, inventory):
+                version_id = ''
+                if versioned:
+                    # Objects from before versioning was enabled have the null version
+                    version_id = record.get('versionid') or 'null'
+                batch.append((record['key'], version_id, as_bool(record.get('islatest', True)),
+                              as_bool(record.get('isdeletemarker')), int(record.get('size') or 0),
+                              record.get('etag')))
+                if len(batch) == INVENTORY_BATCH:
+                    manifest.add(batch)
+                    progress.add(len(batch))
+                    batch = []
+        manifest.add(batch)
+        progress.add(len(batch))
+        # Re-reading a file after a crash only finds entries already known
+        done_files.add(data_file['key'])
+        manifest.set('inventory_files', sorted(done_files))
+    manifest.set('inventory_loaded', True)
+    progress.print(end='\n')
+    log.info(f"Loaded {progress.count} objects/versions from {source}")
+    return True
+
+
+def split_point(low, high=None):
+    """A key between low and high (None: no upper bound), or None if there is none."""
+    # S3 orders keys by their UTF-8 bytes, which is code point order
+    point = []
+    for i in range(1024):
+        a = ord(low[i]) if i < len(low) else 0
+        if high is None:
+            b = 0x7f if a < 0x7e else 0x110000
+        else:
+            b = ord(high[i]) if i < len(high) else 0
+        if b - a > 1:
+            middle = (a + b) // 2
+            if 0xd800 <= middle <= 0xdfff:
+                middle = 0xe000 if b > 0xe000 else a + 1
+            if middle > a:
+                point.append(chr(middle))
+                return ''.join(point)
+        if a == 0:
+            # low is shorter than high and they are adjacent; nothing between
+            return None
+        point.append(chr(a))
+        if b > a:
+            # past this character every longer key is below high
+            high = None
+    return None
+
+
+def discover_split_points(s3_client, bucket, versioned, count, budget=None):
+    """About count keys to split the listing at."""
+    # Cut points at "directory" boundaries, from one Delimiter page per
+    # prefix for up to DISCOVERY_DEPTH levels; they are only hints, hot
+    # shards are split further while listing
+    list_call = s3_client.list_object_versions if versioned else s3_client.list_objects_v2
+    prefixes = ['']
+    for _ in range(DISCOVERY_DEPTH):
+        found = []
+        for prefix in prefixes:
+            with (budget or no_budget)('list'):
+                page = list_call(Bucket=bucket, Prefix=prefix, Delimiter='/')
+            found += [p['Prefix'] for p in page.get('CommonPrefixes', [])] or [prefix]
+        prefixes = found
+        if len(prefixes) >= count:
+            break
+    prefixes = sorted(set(prefixes) - {''})
+    step = -(-len(prefixes) // count) if prefixes else 1
+    return prefixes[step::step] if step > 1 else prefixes[1:]
+
+
+def list_shard(s3_client, bucket, versioned, manifest, shard, split_pages, progress,
+               budget=None):
+    """Lists the keys in (start_after, until]; returns shards split off it."""
+    marker = shard['marker'] or {}
+    pages = 0
+    new_shards = []
+    while True:
+        params = dict(marker)
+        if versioned:
+            if not marker and shard['start_after']:
+                params['KeyMarker'] = shard['start_after']
+            with (budget or no_budget)('list'):
+                page = s3_client.list_object_versions(Bucket=bucket, **params)
+            items = [(v['Key'], v['VersionId'], v['IsLatest'], False, v['Size'], v['ETag'])
+                     for v in page.get('Versions', [])]
+            items += [(m['Key'], m['VersionId'], m['IsLatest'], True, 0, None)
+                      for m in page.get('DeleteMarkers', [])]
+            marker = {'KeyMarker': page.get('NextKeyMarker'),
+                      'VersionIdMarker': page.get('NextVersionIdMarker')}
+        else:
+            if not marker and shard['start_after']:
+                params['StartAfter'] = shard['start_after']
+            with (budget or no_budget)('list'):
+                page = s3_client.list_objects_v2(Bucket=bucket, **params)
+            items = [(o['Key'], '', True, False, o['Size'], o['ETag'])
+                     for o in page.get('Contents', [])]
+            marker = {'ContinuationToken': page.get('NextContinuationToken')}
+        marker = {name: value for name, value in marker.items() if value}
+        pages += 1
+
+        until = shard['until']
+        entries = [item for item in items if until is None or item[0] <= until]
+        truncated = page.get('IsTruncated') and len(entries) == len(items)
+        splits = []
+        if truncated and split_pages and pages % split_pages == 0 and items:
+            # Still going: hand the upper half of what is left to another worker
+            middle = split_point(max(item[0] for item in items), until)
+            if middle is not None:
+                splits = [(middle, until)]
+                shard['until'] = middle
+        new_shards += manifest.add(entries, shard, marker if truncated else None, splits)
+        progress.add(len(entries))
+        if not truncated:
+            return new_shards
+
+
+def list_objects(s3_client, bucket, manifest, log, workers=LIST_WORKERS, budget=None):
+    """Lists the bucket into the manifest, continuing an interrupted listing."""
+    # The one listing pass; everything else is driven from the manifest.
+    # With more than one worker the key space is sharded and listed in
+    # parallel, and shards that turn out to be hot are split recursively.
+    if manifest.get('listed'):
+        return
+    versioned = bucket_versioned(s3_client, bucket, manifest)
+
+    if manifest.get('sharded'):
+        shards = manifest.pending_shards()
+        log.info(f"Resuming listing with {len(shards)} unfinished shards")
+    else:
+        cuts = []
+        if workers > 1:
+            cuts = discover_split_points(s3_client, bucket, versioned, workers * 4, budget)
+        bounds = [None] + cuts + [None]
+        shards = manifest.add_shards(list(zip(bounds[:-1], bounds[1:])))
+        log.info(f"Listing {len(shards)} shards with {workers} workers")
 
+    progress = Progress('Listed')
+    split_pages = SPLIT_PAGES if workers > 1 else 0
+    work = queue.Queue()
+    errors = []
+
+    def lister():
+        while True:
+            shard = work.get()
+            if shard is None:
+                return
+            try:
+                if not errors:
+                    for new_shard in list_shard(s3_client, bucket, versioned, manifest, shard,
+                                                split_pages, progress, budget):
+                        work.put(new_shard)
+            except Exception as e:  # pylint: disable=broad-except
+                log.error(f"Listing shard {shard} failed: {e}")
+                errors.append(e)
+            finally:
+                work.task_done()
+
+    for shard in shards:
+        work.put(shard)
+    threads = [threading.Thread(target=lister, daemon=True) for _ in range(workers)]
+    for thread in threads:
+        thread.start()
+    work.join()
+    for _ in threads:
+        work.put(None)
+    for thread in threads:
+        thread.join()
+    progress.print(end='\n')
+    if errors:
+        # Finished shards are kept; --resume lists only the rest
+        raise errors[0]
+    manifest.set('listed', True)
+    log.info(f"Listed {progress.count} objects/versions")
+
+
+def local_path(download_dir, key, version_id=None, latest=True, prefix=False):
+    """Where the backup of one key/version goes under download_dir."""
+    # Latest versions keep their key's path; older ones go under .versions/
+    # so concurrent downloads of one key never write the same file. Segments
+    # the filesystem would fold ('', '.', '..', a leading .versions) are
+    # percent-encoded, as is '%' itself, so every key gets its own path. A
+    # key that is a prefix of others (logs next to logs/a) ends in a bare
+    # '%', which no encoded segment does, so its file never takes the
+    # directory the longer keys need.
+    parts = [PATH_SEGMENTS.get(part, part) for part in key.replace('%', '%25').split('/')]
+    if parts[0] == '.versions':
+        parts[0] = '%2Eversions'
+    if prefix:
+        parts[-1] += PREFIX_KEY_SUFFIX
+    if not latest and version_id:
+        parts = ['.versions'] + parts + [version_id]
+    return os.path.join(download_dir, *parts)
+
+
+class EtagCheck:
+    """Hashes object bytes the way S3 computed the ETag, as they stream past."""
+    # Single part ETags are the MD5 of the object; multipart ones are the MD5
+    # of the part MD5s, so every usual part size giving as many parts is
+    # tried at once. SSE-KMS ETags are not MD5s and never match.
+
+    def __init__(self, size, etag):
+        self.expected = size
+        self.size = 0
+        self.digest, _, parts = (etag or '').strip('"').partition('-')
+        if not parts:
+            part_sizes = [None]
+        else:
+            mib = 1024 * 1024
+            candidates = {size * mib for size in COMMON_PART_SIZES_MIB}
+            candidates |= {MULTIPART_CHUNK_SIZE, -(-size // int(parts) // mib) * mib,
+                           -(-size // int(parts))}
+            part_sizes = sorted(c for c in candidates if c > 0 and -(-size // c) == int(parts))
+        # per candidate part size: bytes in the current part, its MD5, MD5 of the part MD5s
+        self.candidates = [{'part_size': part_size, 'filled': 0, 'md5': hashlib.md5(),
+                            'md5s': hashlib.md5()}
+                           for part_size in part_sizes]
+
+    def update(self, data):
+        """Feeds the next bytes of the object."""
+        self.size += len(data)
+        for candidate in self.candidates:
+            view = memoryview(data)
+            while view:
+                if candidate['part_size'] is None:
+                    candidate['md5'].update(view)
+                    break
+                take = min(len(view), candidate['part_size'] - candidate['filled'])
+                candidate['md5'].update(view[:take])
+                candidate['filled'] += take
+                view = view[take:]
+                if candidate['filled'] == candidate['part_size']:
+                    candidate['md5s'].update(candidate['md5'].digest())
+                    candidate['md5'] = hashlib.md5()
+                    candidate['filled'] = 0
+
+    def matches(self):
+        """Whether the bytes fed so far are the object the ETag describes."""
+        if self.size != self.expected:
+            return False
+        for candidate in self.candidates:
+            if candidate['part_size'] is None:
+                if candidate['md5'].hexdigest() == self.digest:
+                    return True
+                continue
+            md5s = candidate['md5s'].copy()
+            if candidate['filled']:
+                md5s.update(candidate['md5'].digest())
+            if md5s.hexdigest() == self.digest:
+                return True
+        return False
+
+
+def etag_matches(path, size, etag):
+    """Whether the file at path is the object with this size and ETag."""
+    if os.path.getsize(path) != size:
+        return False
+    check = EtagCheck(size, etag)
+    if not check.candidates:
+        return False
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            check.update(chunk)
+    return check.matches()
+
+
+def download_object(s3_client, bucket, obj, path, transfer_config):
+    """Downloads one object (version) to path."""
+    # Small objects take one GetObject into a temp file; large ones go through
+    # the transfer manager, which uses ranged GETs in parallel
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    extra_args = {'VersionId': obj['VersionId']} if obj.get('VersionId') else {}
+    if obj['Size'] < transfer_config.multipart_threshold:
+        tmp_path = f"{path}.part"
+        try:
+            response = s3_client.get_object(Bucket=bucket, Key=obj['Key'], **extra_args)
+            with open(tmp_path, 'wb') as f:
+                for chunk in response['Body'].iter_chunks(1024 * 1024):
+                    f.write(chunk)
+            os.replace(tmp_path, path)
+        except Exception:
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(tmp_path)
+            raise
     else:
-        # Non-versioned bucket
-        paginator = s3_client.get_paginator('list_objects_v2')
-        iterator = paginator.paginate(Bucket=bucket)
-
-        to_delete = []
-        for page in iterator:
-            for obj in page.get('Contents', []):
-                to_delete.append({'Key': obj['Key']})
-
-        for i in range(0, len(to_delete), 1000):
-            batch = to_delete[i:i+1000]
-            log.info(f"Deleting {len(batch)} current objects in batch.")
-            if dry_run:
-                for d in batch:
-                    print(f"Would delete {d}")
+        s3_client.download_file(Bucket=bucket, Key=obj['Key'], Filename=path,
+                                ExtraArgs=extra_args, Config=transfer_config)
+
+
+class PlainFrame:
+    """Stands in for a compressor or decompressor when shards are not compressed."""
+
+    def compress(self, data):
+        """The data unchanged."""
+        return data
+
+    decompress = compress
+
+    def flush(self):
+        """Nothing is buffered."""
+        return b''
+
+
+def zstandard_module():
+    """The optional zstandard package."""
+    try:
+        import zstandard
+    except ImportError as err:
+        raise RuntimeError("zstd compression needs the zstandard package") from err
+    return zstandard
+
+
+def new_frame(compression):
+    """A compressor for one archive member."""
+    # Every tar member is compressed as its own gzip member / zstd frame.
+    # Concatenated they are still a valid .tar.gz / .tar.zst, and a single
+    # member can be decompressed from its offset alone.
+    if compression == 'gzip':
+        return zlib.compressobj(wbits=31)
+    if compression == 'zstd':
+        return zstandard_module().ZstdCompressor().compressobj()
+    return PlainFrame()
+
+
+def frame_reader(compression):
+    """A decompressor for one archive member."""
+    if compression == 'gzip':
+        return zlib.decompressobj(wbits=31)
+    if compression == 'zstd':
+        return zstandard_module().ZstdDecompressor().decompressobj()
+    return PlainFrame()
+
+
+class ArchiveWriter:
+    """Streams objects into size-capped tar shards instead of loose files."""
+    # Each download worker writes its own shard, so members are never
+    # interleaved. Next to every shard, <shard>.index.jsonl records the key,
+    # version, offset and length of the member's frame, the header length,
+    # size and ETag of every object, for extract_object.
+
+    def __init__(self, directory, compression=None, shard_size=ARCHIVE_SHARD_SIZE * 1024 * 1024):
+        if compression == 'zstd':
+            zstandard_module()
+        self.directory = directory
+        self.compression = compression
+        self.shard_size = shard_size
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.shards = []
+        os.makedirs(directory, exist_ok=True)
+        # Never append to shards of an earlier run, their tails may be torn
+        numbers = [int(os.path.basename(path).split('-')[1].split('.')[0])
+                   for path in glob.glob(os.path.join(directory, 'part-*.index.jsonl'))]
+        self.next_number = max(numbers, default=0) + 1
+
+    def shard(self):
+        """The calling worker's open shard, starting a new one when it is full."""
+        shard = getattr(self.local, 'shard', None)
+        if shard and shard['file'].tell() < self.shard_size:
+            return shard
+        if shard:
+            self.finish(shard)
+        with self.lock:
+            name = f"part-{self.next_number:05d}{ARCHIVE_SUFFIXES[self.compression]}"
+            self.next_number += 1
+            shard = {'name': name,
+                     'file': open(os.path.join(self.directory, name), 'wb'),
+                     'index': open(os.path.join(self.directory, f"{name}.index.jsonl"), 'w',
+                                   encoding='utf-8')}
+            self.shards.append(shard)
+        self.local.shard = shard
+        return shard
+
+    def finish(self, shard):
+        """Ends and closes a shard."""
+        # End of archive marker, in a frame of its own
+        frame = new_frame(self.compression)
+        shard['file'].write(frame.compress(b'\0' * tarfile.BLOCKSIZE * 2) + frame.flush())
+        shard['file'].close()
+        shard['index'].close()
+
+    def add(self, s3_client, bucket, obj, name):
+        """Streams one object into the worker's shard as name; returns whether its ETag matched."""
+        extra_args = {'VersionId': obj['VersionId']} if obj.get('VersionId') else {}
+        response = s3_client.get_object(Bucket=bucket, Key=obj['Key'], **extra_args)
+        member = tarfile.TarInfo(name)
+        member.size = obj['Size']
+        member.mtime = response['LastModified'].timestamp()
+        member.mode = 0o644
+        header = member.tobuf(format=tarfile.PAX_FORMAT)
+
+        shard = self.shard()
+        out = shard['file']
+        offset = out.tell()
+        check = EtagCheck(obj['Size'], obj['ETag'])
+        frame = new_frame(self.compression)
+        try:
+            out.write(frame.compress(header))
+            for chunk in response['Body'].iter_chunks(1024 * 1024):
+                check.update(chunk)
+                out.write(frame.compress(chunk))
+            if check.size != obj['Size']:
+                raise ValueError(f"downloaded {check.size} bytes, expected {obj['Size']}")
+            padding = -obj['Size'] % tarfile.BLOCKSIZE
+            out.write(frame.compress(b'\0' * padding) + frame.flush())
+        except Exception:
+            # Cut the partial member off so the shard stays a valid archive
+            out.seek(offset)
+            out.truncate()
+            raise
+        entry = {'key': obj['Key'], 'version_id': obj['VersionId'] or None, 'member': member.name,
+                 'offset': offset, 'length': out.tell() - offset, 'header': len(header),
+                 'size': obj['Size'], 'etag': obj['ETag']}
+        out.flush()
+        shard['index'].write(json.dumps(entry) + '\n')
+        shard['index'].flush()
+        return check.matches()
+
+    def close(self):
+        """Ends every open shard."""
+        with self.lock:
+            shards, self.shards = self.shards, []
+        for shard in shards:
+            if not shard['file'].closed:
+                self.finish(shard)
+        self.local = threading.local()
+
+
+def find_archived(archive_dir, key, version_id=None):
+    """The last index entry for key (and version), with the shard it is in."""
+    found = None
+    for index_path in sorted(glob.glob(os.path.join(archive_dir, 'part-*.index.jsonl'))):
+        with open(index_path, encoding='utf-8') as f:
+            for line in f:
+                entry = json.loads(line)
+                if entry['key'] == key and version_id in (None, entry['version_id']):
+                    found = dict(entry, shard=index_path[:-len('.index.jsonl')])
+    return found
+
+
+def extract_object(entry, path):
+    """Writes an archived object to path."""
+    # Decompresses the one frame holding the entry, skipping its tar header
+    compression = next((name for name, suffix in ARCHIVE_SUFFIXES.items()
+                        if name and entry['shard'].endswith(suffix)), None)
+    reader = frame_reader(compression)
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    skip, remaining = entry['header'], entry['size']
+    with open(entry['shard'], 'rb') as shard, open(path, 'wb') as out:
+        shard.seek(entry['offset'])
+        left = entry['length']
+        while left and remaining:
+            raw = shard.read(min(left, 1024 * 1024))
+            if not raw:
+                break
+            left -= len(raw)
+            data = reader.decompress(raw)
+            dropped = min(skip, len(data))
+            skip -= dropped
+            data = data[dropped:remaining + dropped]
+            out.write(data)
+            remaining -= len(data)
+    if remaining:
+        raise ValueError(f"{entry['shard']} ended {remaining} bytes short of {entry['key']}")
+
+
+def download_objects(s3_client, bucket, manifest, download_dir, dry_run, log,
+                     workers=DOWNLOAD_WORKERS, transfer_config=None, archive=None, budget=None):
+    """Downloads every listed object; returns the number that failed."""
+    # Into archive shards if an ArchiveWriter is given
+    from boto3.s3.transfer import TransferConfig
+
+    transfer_config = transfer_config or TransferConfig(multipart_chunksize=MULTIPART_CHUNK_SIZE)
+    objects = manifest.rows("state = 'listed' AND delete_marker = 0")
+
+    if dry_run:
+        for obj in objects:
+            if obj['VersionId']:
+                print(f"Would download {obj['Key']} (version: {obj['VersionId']})")
             else:
-                s3_client.delete_objects(Bucket=bucket, Delete={'Objects': batch, 'Quiet': True})
-    
-    # Finally, delete the bucket
+                print(f"Would download {obj['Key']}")
+        return 0
+
+    if not archive and not os.path.exists(download_dir):
+        os.makedirs(download_dir, exist_ok=True)
+
+    progress = Progress('Downloaded')
+    skipped = []
+    failures = []
+    # Bounds how far the manifest is read ahead of the downloads
+    slots = threading.BoundedSemaphore(workers * 4)
+
+    def fetch(obj, path):
+        # Returns whether the ETag was verified
+        log.info(f"Downloading object {obj['Key']} version {obj['VersionId']}")
+        if archive:
+            # Members are named as the loose files would be
+            return archive.add(s3_client, bucket, obj, os.path.relpath(path, download_dir))
+        download_object(s3_client, bucket, obj, path, transfer_config)
+        if os.path.getsize(path) != obj['Size']:
+            raise ValueError(f"downloaded {os.path.getsize(path)} bytes, expected {obj['Size']}")
+        return etag_matches(path, obj['Size'], obj['ETag'])
+
+    def download(obj, path):
+        try:
+            if not archive:
+                if not manifest.claim(path, obj['id']):
+                    # Backing it up would overwrite another object's backup
+                    raise ValueError(f"{path} already holds the backup of another key")
+                if os.path.exists(path) and etag_matches(path, obj['Size'], obj['ETag']):
+                    log.info(f"Skipping {obj['Key']}, already downloaded")
+                    manifest.mark([obj['id']], 'verified')
+                    skipped.append(obj['Key'])
+                    return
+            with (budget or no_budget)('download'):
+                verified = fetch(obj, path)
+            if verified:
+                manifest.mark([obj['id']], 'verified')
+            else:
+                log.warning(f"Could not verify the ETag of {obj['Key']} version {obj['VersionId']}")
+                manifest.mark([obj['id']], 'downloaded')
+            progress.add(1)
+        except Exception as e:  # pylint: disable=broad-except
+            if getattr(e, 'response', {}).get('Error', {}).get('Code') in GONE_ERRORS:
+                # e.g. deleted since the inventory was taken
+                log.info(f"{obj['Key']} version {obj['VersionId']} no longer exists")
+                manifest.mark([obj['id']], 'gone')
+                return
+            log.error(f"Could not download {obj['Key']} version {obj['VersionId']}: {e}")
+            failures.append(obj['Key'])
+            progress.add(0, 1)
+        finally:
+            slots.release()
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for obj in objects:
+            path = local_path(download_dir, obj['Key'], obj['VersionId'], obj['IsLatest'],
+                              manifest.is_prefix(obj['Key']))
+            slots.acquire()  # pylint: disable=consider-using-with
+            executor.submit(download, obj, path)
+    if archive:
+        archive.close()
+    progress.print(end='\n')
+    if skipped:
+        print(f"Skipped {len(skipped)} objects already downloaded.")
+    return len(failures)
+
+
+def iter_delete_batches(manifest, where, batch_size=DELETE_BATCH_SIZE):
+    """(manifest ids, delete_objects entries) for every object matching where."""
+    ids, batch = [], []
+    for obj in manifest.rows(where):
+        entry = {'Key': obj['Key']}
+        if obj['VersionId']:
+            entry['VersionId'] = obj['VersionId']
+        ids.append(obj['id'])
+        batch.append(entry)
+        if len(batch) == batch_size:
+            yield ids, batch
+            ids, batch = [], []
+    if batch:
+        yield ids, batch
+
+
+def no_budget(_stage):
+    """No limit beyond the caller's own workers, outside batch mode."""
+    return contextlib.nullcontext()
+
+
+class Budget:
+    """List, download and delete calls in flight across every bucket of a batch."""
+    # Each bucket runs as many workers as the whole budget, but a worker only
+    # calls S3 while holding one of its stage's slots, so a small bucket
+    # finishes at full speed and a huge one only gets the slots left over.
+
+    def __init__(self, list_workers, download_workers, delete_workers):
+        self.slots = {'list': threading.BoundedSemaphore(list_workers),
+                      'download': threading.BoundedSemaphore(download_workers),
+                      'delete': threading.BoundedSemaphore(delete_workers)}
+
+    def __call__(self, stage):
+        return self.slots[stage]
+
+
+class Backoff:
+    """Delay shared by all deleters: doubles on SlowDown, decays on success."""
+
+    def __init__(self, initial=0.1, maximum=20.0):
+        self.initial = initial
+        self.maximum = maximum
+        self.delay = 0.0
+        self.lock = threading.Lock()
+
+    def throttled(self):
+        """Doubles the delay after a SlowDown."""
+        with self.lock:
+            self.delay = min(self.maximum, max(self.initial, self.delay * 2))
+
+    def succeeded(self):
+        """Halves the delay, down to none, after a clean batch."""
+        with self.lock:
+            self.delay = self.delay / 2 if self.delay > self.initial else 0.0
+
+    def wait(self):
+        """Sleeps for the current delay, with jitter."""
+        delay = self.delay
+        if delay:
+            time.sleep(delay * random.uniform(0.5, 1.5))
+
+
+class Progress:
+    """Thread-safe counter that prints objects/sec at most once a second."""
+
+    # batch mode prints a summary per bucket instead
+    quiet = False
+
+    def __init__(self, label):
+        self.label = label
+        self.count = 0
+        self.failed = 0
+        self.started = time.monotonic()
+        self.printed = 0.0
+        self.lock = threading.Lock()
+
+    def add(self, count, failed=0):
+        """Counts finished and failed objects, printing at most once a second."""
+        with self.lock:
+            self.count += count
+            self.failed += failed
+            now = time.monotonic()
+            if now - self.printed >= 1:
+                self.printed = now
+                self.print()
+
+    def rate(self):
+        """Objects per second since the start."""
+        return self.count / max(time.monotonic() - self.started, 1e-6)
+
+    def print(self, end=''):
+        """Prints the count over the current line."""
+        if self.quiet:
+            return
+        print(f"\r{self.label} {self.count} objects ({self.rate():.0f}/s), {self.failed} failed",
+              end=end, flush=True)
+
+
+def delete_batch(s3_client, bucket, batch, log, backoff, progress, budget=None):
+    """Deletes up to 1000 keys; returns the entries that could not be deleted."""
+    # Retryable per-key errors are retried up to MAX_ATTEMPTS
+    from botocore.exceptions import ClientError
+
+    pending = batch
+    failed = []
+    for attempt in range(1, MAX_ATTEMPTS + 1):
+        backoff.wait()
+        try:
+            with (budget or no_budget)('delete'):
+                response = s3_client.delete_objects(Bucket=bucket,
+                                                    Delete={'Objects': pending, 'Quiet': True})
+        except ClientError as e:
+            code = e.response.get('Error', {}).get('Code')
+            if code not in RETRYABLE_ERRORS or attempt == MAX_ATTEMPTS:
+                log.error(f"delete_objects failed for {len(pending)} keys: {e}")
+                progress.add(0, len(pending))
+                return failed + pending
+            if code == 'SlowDown':
+                backoff.throttled()
+            log.warning(f"delete_objects {code}, retrying {len(pending)} keys (attempt {attempt})")
+            continue
+
+        errors = response.get('Errors', [])
+        if any(error.get('Code') == 'SlowDown' for error in errors):
+            backoff.throttled()
+        else:
+            backoff.succeeded()
+        retry = []
+        for error in errors:
+            entry = {'Key': error['Key']}
+            if error.get('VersionId'):
+                entry['VersionId'] = error['VersionId']
+            if error.get('Code') in RETRYABLE_ERRORS and attempt < MAX_ATTEMPTS:
+                retry.append(entry)
+            else:
+                log.error(f"Could not delete {entry}: {error.get('Code')} {error.get('Message')}")
+                failed.append(entry)
+        progress.add(len(pending) - len(errors), len(errors) - len(retry))
+        if not retry:
+            break
+        log.warning(f"Retrying {len(retry)} keys (attempt {attempt})")
+        pending = retry
+    return failed
+
+
+def delete_batches(s3_client, bucket, manifest, batches, log, workers=DELETE_WORKERS,
+                   budget=None):
+    """Deletes every batch concurrently; returns the entries that could not be deleted."""
+    # Producer/consumer: the manifest fills a bounded queue that a pool of
+    # deleters drains, so memory stays at a few batches. Deleted entries are
+    # marked in the manifest as each batch finishes.
+    work = queue.Queue(maxsize=workers * 2)
+    backoff = Backoff()
+    progress = Progress('Deleted')
+    failures = []
+    failures_lock = threading.Lock()
+
+    def deleter():
+        while True:
+            item = work.get()
+            if item is None:
+                return
+            ids, batch = item
+            try:
+                failed = delete_batch(s3_client, bucket, batch, log, backoff, progress, budget)
+            except Exception as e:  # pylint: disable=broad-except
+                log.error(f"Deleter failed on a batch of {len(batch)} keys: {e}")
+                failed = batch
+            left = {(entry['Key'], entry.get('VersionId')) for entry in failed}
+            manifest.mark([i for i, entry in zip(ids, batch)
+                           if (entry['Key'], entry.get('VersionId')) not in left], 'deleted')
+            if failed:
+                with failures_lock:
+                    failures.extend(failed)
+
+    threads = [threading.Thread(target=deleter, daemon=True) for _ in range(workers)]
+    for thread in threads:
+        thread.start()
+    try:
+        for ids, batch in batches:
+            log.info(f"Queueing {len(batch)} objects/versions for deletion.")
+            work.put((ids, batch))
+    finally:
+        for _ in threads:
+            work.put(None)
+        for thread in threads:
+            thread.join()
+    progress.print(end='\n')
+    return failures
+
+
+def delete_objects_and_bucket(s3_client, bucket, manifest, dry_run, log, workers=DELETE_WORKERS,
+                              keep_bucket=False, budget=None):
+    """Deletes every backed up object, then the bucket; False if any delete failed."""
     if dry_run:
-        print(f"Would delete bucket {bucket}")
-    else:
-        log.info(f"Deleting bucket {bucket}")
-        s3_client.delete_bucket(Bucket=bucket)
+        for _, batch in iter_delete_batches(manifest, "state NOT IN ('deleted', 'gone')"):
+            for d in batch:
+                print(f"Would delete {d}")
+        if not keep_bucket:
+            print(f"Would delete bucket {bucket}")
+        return True
+
+    # Only what was backed up, plus delete markers, which have nothing to back up
+    batches = iter_delete_batches(
+        manifest, "state IN ('downloaded', 'verified') OR (delete_marker = 1 AND state = 'listed')")
+    failures = delete_batches(s3_client, bucket, manifest, batches, log, workers, budget)
+    if failures:
+        log.error(f"{len(failures)} objects/versions could not be deleted, keeping bucket {bucket}")
+        print(f"{len(failures)} objects/versions could not be deleted; bucket {bucket} was kept. "
+              "See the log.")
+        return False
+    if keep_bucket:
+        return True
+
+    # Finally, delete the bucket
+    log.info(f"Deleting bucket {bucket}")
+    s3_client.delete_bucket(Bucket=bucket)
+    return True
+
+
+def parse_date(value):
+    """YYYY-MM-DD or a full ISO timestamp, taken as UTC unless it has an offset."""
+    parsed = datetime.datetime.fromisoformat(value)
+    return parsed if parsed.tzinfo else parsed.replace(tzinfo=datetime.timezone.utc)
+
+
+def bucket_tags(s3_client, bucket, log):
+    """The bucket's tags as a dict."""
+    from botocore.exceptions import ClientError
+
+    try:
+        tag_set = s3_client.get_bucket_tagging(Bucket=bucket)['TagSet']
+    except ClientError as e:
+        if e.response.get('Error', {}).get('Code') != 'NoSuchTagSet':
+            log.warning(f"Could not read the tags of {bucket}: {e}")
+        return {}
+    return {tag['Key']: tag['Value'] for tag in tag_set}
+
+
+def bucket_region(s3_client, bucket):
+    """The region the bucket is in."""
+    location = s3_client.get_bucket_location(Bucket=bucket).get('LocationConstraint')
+    # Buckets in us-east-1 have no location constraint, old eu-west-1 ones say EU
+    return {None: 'us-east-1', '': 'us-east-1', 'EU': 'eu-west-1'}.get(location, location)
+
+
+def select_buckets(s3_client, log, patterns=(), tags=(), created_before=None, created_after=None,
+                   names_file=None):
+    """Buckets matching every given rule, as dicts with Name, CreationDate, Region."""
+    # Name globs, dates and the file are checked first; only what is left
+    # costs a tagging call each.
+    names = None
+    if names_file:
+        with open(names_file, encoding='utf-8') as f:
+            names = {line.strip() for line in f if line.strip() and not line.startswith('#')}
+
+    buckets, params = [], {}
+    while True:
+        page = s3_client.list_buckets(**params)
+        buckets += page['Buckets']
+        if not page.get('ContinuationToken'):
+            break
+        params = {'ContinuationToken': page['ContinuationToken']}
+    if names is not None:
+        for missing in sorted(names - {b['Name'] for b in buckets}):
+            log.warning(f"{missing} from {names_file} does not exist")
+            print(f"Skipping {missing}: no such bucket")
+
+    selected = [b for b in buckets
+                if (names is None or b['Name'] in names)
+                and (not patterns
+                     or any(fnmatch.fnmatchcase(b['Name'], pattern) for pattern in patterns))
+                and (created_before is None or b['CreationDate'] < created_before)
+                and (created_after is None or b['CreationDate'] >= created_after)]
+
+    def describe(b):
+        b = dict(b, Region=bucket_region(s3_client, b['Name']))
+        if tags:
+            bucket_tag_set = bucket_tags(s3_client, b['Name'], log)
+            for tag in tags:
+                key, has_value, value = tag.partition('=')
+                if key not in bucket_tag_set or (has_value and bucket_tag_set[key] != value):
+                    return None
+        return b
+
+    with ThreadPoolExecutor(max_workers=16) as executor:
+        return [b for b in executor.map(describe, selected) if b]
+
+
+class BucketLog(logging.LoggerAdapter):
+    """Prefixes every message with the bucket it is about."""
+
+    def process(self, msg, kwargs):
+        return f"[{self.extra['bucket']}] {msg}", kwargs
+
+
+def nuke_bucket(s3_client, bucket, args, manifest_path, log, budget=None, raise_errors=True):
+    """Backs up and destroys one bucket; returns its summary."""
+    from boto3.s3.transfer import TransferConfig
+
+    started = time.monotonic()
+    dry_run = args.dry_run
+    download_dir = bucket  # Download to a directory named after the bucket
+    summary = {'bucket': bucket, 'status': 'dry run' if dry_run else 'kept', 'gone': 0, 'failed': 0}
+    manifest = Manifest(manifest_path)
+    if args.resume:
+        log.info(f"Resuming from {manifest_path}: {manifest.counts()}")
+    transfer_config = TransferConfig(multipart_threshold=args.multipart_threshold * 1024 * 1024,
+                                     multipart_chunksize=args.chunk_size * 1024 * 1024,
+                                     max_concurrency=args.max_concurrency)
+    archive = None
+    if args.archive and not dry_run:
+        archive = ArchiveWriter(f"{bucket}.archive", args.archive_compression,
+                                args.archive_size * 1024 * 1024)
+
+    def backup_and_delete(keep_bucket):
+        failed = download_objects(s3_client, bucket, manifest, download_dir, dry_run, log,
+                                  args.download_workers, transfer_config, archive, budget)
+        if failed:
+            # Never delete what could not be backed up
+            log.error(f"{failed} objects could not be downloaded, not deleting anything.")
+            print(f"{bucket}: {failed} objects could not be downloaded; nothing more was deleted. "
+                  "Re-run with --resume to retry them.")
+            summary['status'] = 'download failed'
+            return False
+        return delete_objects_and_bucket(s3_client, bucket, manifest, dry_run, log, args.workers,
+                                         keep_bucket, budget)
+
+    try:
+        inventoried = args.inventory and load_inventory(s3_client, bucket, manifest,
+                                                        args.inventory, log)
+        if inventoried and not dry_run:
+            # Clear out everything the inventory knows about first, so the live
+            # listing below only has to page through what is newer than it. A
+            # dry run marks nothing done, so it reports everything once below.
+            backup_and_delete(keep_bucket=True)
+        if summary['status'] != 'download failed':
+            list_objects(s3_client, bucket, manifest, log, args.list_workers, budget)
+            if backup_and_delete(keep_bucket=False) and not dry_run:
+                summary['status'] = 'deleted'
+        log.info(f"Manifest states: {manifest.counts()}")
+    except Exception as e:  # pylint: disable=broad-except
+        if raise_errors:
+            raise
+        # Batch mode carries on with the other buckets
+        log.exception(f"Failed: {e}")
+        summary['status'] = 'error'
+    finally:
+        totals = manifest.totals()
+        manifest.close()
+        states = ('listed', 'downloaded', 'verified', 'deleted') if dry_run else ('deleted',)
+        done = [totals.get(state, (0, 0)) for state in states]
+        summary['objects'] = sum(count for count, _ in done)
+        summary['bytes'] = sum(size for _, size in done)
+        # Already gone when their backup was due, so neither deleted nor failed
+        summary['gone'] = totals.get('gone', (0, 0))[0]
+        if not dry_run:
+            summary['failed'] = sum(count for state, (count, _) in totals.items()
+                                    if state not in ('deleted', 'gone'))
+        if summary['status'] == 'deleted':
+            # Nothing is left to resume, and a later bucket of the same name
+            # must start from a fresh listing
+            for path in (manifest_path, f"{manifest_path}-wal", f"{manifest_path}-shm"):
+                with contextlib.suppress(FileNotFoundError):
+                    os.remove(path)
+            log.info(f"Removed {manifest_path}")
+        summary['seconds'] = time.monotonic() - started
+    return summary
+
+
+def print_summary(summaries):
+    """Prints a table of the bucket summaries with their totals."""
+    print(f"{'Bucket':<40} {'Status':<16} {'Objects':>10} {'Bytes':>16} {'Gone':>6} {'Failed':>7} "
+          f"{'Seconds':>8}")
+    for summary in sorted(summaries, key=lambda s: s['bucket']):
+        print(f"{summary['bucket']:<40} {summary['status']:<16} {summary['objects']:>10} "
+              f"{summary['bytes']:>16,} {summary['gone']:>6} {summary['failed']:>7} "
+              f"{summary['seconds']:>8.1f}")
+    print(f"{'Total':<40} {'':<16} {sum(s['objects'] for s in summaries):>10} "
+          f"{sum(s['bytes'] for s in summaries):>16,} {sum(s['gone'] for s in summaries):>6} "
+          f"{sum(s['failed'] for s in summaries):>7}")
 
 
 def main():
-    parser = argparse.ArgumentParser(description="Download and destroy an S3 bucket.")
-    parser.add_argument('bucket', help='Name of the S3 bucket to destroy')
+    """Command line entry point."""
+    parser = argparse.ArgumentParser(description="Download and destroy S3 buckets.")
+    parser.add_argument('bucket', nargs='?', help='Name of the S3 bucket to destroy')
     parser.add_argument('--region', help='AWS region of the bucket', default=None)
-    parser.add_argument('--dry-run', action='store_true', help='Simulate the actions without making changes')
-    
+    parser.add_argument('--dry-run', action='store_true',
+                        help='Simulate the actions without making changes')
+    parser.add_argument('--workers', type=int, default=DELETE_WORKERS,
+                        help='Concurrent delete_objects calls')
+    parser.add_argument('--list-workers', type=int, default=LIST_WORKERS,
+                        help='Key range shards listed at once (1 lists sequentially)')
+    parser.add_argument('--download-workers', type=int, default=DOWNLOAD_WORKERS,
+                        help='Objects downloaded at once')
+    parser.add_argument('--multipart-threshold', type=int,
+                        default=MULTIPART_THRESHOLD // 1024 // 1024,
+                        help='Size in MiB from which objects are downloaded in parts')
+    parser.add_argument('--chunk-size', type=int, default=MULTIPART_CHUNK_SIZE // 1024 // 1024,
+                        help='Multipart download part size in MiB')
+    parser.add_argument('--max-concurrency', type=int, default=MAX_CONCURRENCY,
+                        help='Parts downloaded at once per large object')
+    parser.add_argument('--manifest', help='Manifest of listed objects and their state '
+                                           '(default: <bucket>.manifest.sqlite)')
+    parser.add_argument('--resume', action='store_true',
+                        help='Continue the run recorded in the manifest')
+    parser.add_argument('--inventory', metavar='MANIFEST_JSON',
+                        help='Take keys/versions from an S3 Inventory manifest.json '
+                             '(local path or s3://...); a live listing afterwards catches '
+                             'anything newer')
+    parser.add_argument('--archive', action='store_true',
+                        help='Back up into tar shards with a sidecar index under <bucket>.archive/ '
+                             'instead of one file per object')
+    parser.add_argument('--archive-compression', choices=['gzip', 'zstd'],
+                        help='Compress archive shards (zstd needs the zstandard package)')
+    parser.add_argument('--archive-size', type=int, default=ARCHIVE_SHARD_SIZE,
+                        help='Size in MiB at which a new archive shard is started')
+    parser.add_argument('--extract', metavar='KEY',
+                        help='Extract KEY from <bucket>.archive/ into <bucket>/ and exit')
+    parser.add_argument('--version-id',
+                        help='Version to --extract (default: the last one archived)')
+    batch = parser.add_argument_group(
+        'batch mode', 'Destroy every bucket matching all of these instead of one; '
+                      'the worker counts above become budgets shared by all of them')
+    batch.add_argument('--match', action='append', default=[], metavar='GLOB',
+                       help='Bucket name pattern, e.g. "ci-*" (repeatable)')
+    batch.add_argument('--tag', action='append', default=[], metavar='KEY[=VALUE]',
+                       help='Bucket tag that must be present (repeatable)')
+    batch.add_argument('--created-before', type=parse_date, metavar='DATE',
+                       help='Only buckets created before DATE')
+    batch.add_argument('--created-after', type=parse_date, metavar='DATE',
+                       help='Only buckets created on/after DATE')
+    batch.add_argument('--bucket-list', metavar='FILE',
+                       help='Only buckets named in FILE, one per line')
+    batch.add_argument('--parallel-buckets', type=int, default=PARALLEL_BUCKETS,
+                       help='Buckets processed at once')
+
     args = parser.parse_args()
+    batch_mode = bool(args.match or args.tag or args.created_before or args.created_after
+                      or args.bucket_list)
+    if batch_mode == bool(args.bucket):
+        parser.error('give either a bucket or batch selection rules')
+    if batch_mode and (args.manifest or args.inventory or args.extract):
+        parser.error('--manifest, --inventory and --extract take a single bucket')
 
     bucket = args.bucket
     dry_run = args.dry_run
     region = args.region
 
+    if args.extract:
+        archive_dir = f"{bucket}.archive"
+        entry = find_archived(archive_dir, args.extract, args.version_id)
+        if not entry:
+            print(f"{args.extract} is not in {archive_dir}")
+            sys.exit(1)
+        path = os.path.join(bucket, entry['member'])
+        extract_object(entry, path)
+        print(f"Extracted {entry['key']} from {entry['shard']} to {path}")
+        return
+
     # Configure logging
     log_filename = configure_logging(dry_run)
     log = logging.getLogger(__name__)
-    log.info(f"Starting {'dry-run' if dry_run else 'destroy'} for bucket {bucket}")
 
     # Create S3 client
+    import boto3
+    from botocore.config import Config
+
+    # One connection per worker; SlowDown backoff is handled per batch. A
+    # single bucket runs one stage at a time, a batch all of them at once.
+    stages = (args.workers, args.list_workers, args.download_workers + args.max_concurrency)
+    config = Config(max_pool_connections=max(10, sum(stages) if batch_mode else max(stages)))
     if region:
-        s3_client = boto3.client('s3', region_name=region)
+        s3_client = boto3.client('s3', region_name=region, config=config)
     else:
-        s3_client = boto3.client('s3')
+        s3_client = boto3.client('s3', config=config)
+
+    if batch_mode:
+        nuke_buckets(s3_client, args, log, log_filename, config)
+        return
+
+    log.info(f"Starting {'dry-run' if dry_run else 'destroy'} for bucket {bucket}")
 
     # Check bucket existence
     try:
@@ -146,10 +1371,18 @@ def main():
         log.error(f"Bucket {bucket} does not seem to exist or not accessible.")
         print(f"Error: {e}")
         sys.exit(1)
-    
+
+    # A dry run keeps its manifest in memory and leaves no files behind
+    manifest_path = ':memory:' if dry_run else args.manifest or f"{bucket}.manifest.sqlite"
+    if not dry_run and os.path.exists(manifest_path) and not args.resume:
+        print(f"{manifest_path} exists from an earlier run; "
+              "pass --resume to continue it or remove it.")
+        sys.exit(1)
+
     # If not dry-run, warn user
     if not dry_run:
-        print("WARNING: You are about to PERMANENTLY delete this bucket and all of its objects and versions.")
+        print("WARNING: You are about to PERMANENTLY delete this bucket "
+              "and all of its objects and versions.")
         print(f"Bucket: {bucket}")
         confirm = input("Type 'yes' to confirm: ")
         if confirm.lower() != 'yes':
@@ -157,17 +1390,77 @@ def main():
             log.info("Operation aborted by user.")
             sys.exit(0)
 
-    download_dir = bucket  # Download to a directory named after the bucket
-    download_objects(s3_client, bucket, download_dir, dry_run, log)
-    delete_objects_and_bucket(s3_client, bucket, dry_run, log)
+    summary = nuke_bucket(s3_client, bucket, args, manifest_path, log)
+    if summary['status'] == 'download failed':
+        sys.exit(1)
 
     log.info("Operation completed.")
     if dry_run:
         print("Dry-run completed. No changes were made.")
-    else:
+    elif summary['status'] == 'deleted':
         print("Bucket and objects deleted.")
 
     print(f"Logs can be found in {log_filename}")
+    if not dry_run and summary['status'] != 'deleted':
+        # A kept bucket is a failure, as in batch mode
+        sys.exit(1)
+
+
+def nuke_buckets(s3_client, args, log, log_filename, config):
+    """Batch mode: select, confirm once, then run the buckets concurrently."""
+    # They share one budget of list/download/delete slots
+    import boto3
+
+    dry_run = args.dry_run
+    buckets = select_buckets(s3_client, log, args.match, args.tag, args.created_before,
+                             args.created_after, args.bucket_list)
+    if not buckets:
+        print("No buckets matched.")
+        return
+    for b in sorted(buckets, key=lambda b: b['Name']):
+        print(f"{b['Name']:<40} {b['Region']:<16} created {b['CreationDate']:%Y-%m-%d}")
+    log.info(f"Selected {len(buckets)} buckets: {', '.join(b['Name'] for b in buckets)}")
+
+    if not dry_run:
+        existing = [f"{b['Name']}.manifest.sqlite" for b in buckets
+                    if os.path.exists(f"{b['Name']}.manifest.sqlite")]
+        if existing and not args.resume:
+            print(f"{', '.join(existing)} exist from an earlier run; "
+                  "pass --resume to continue them or remove them.")
+            sys.exit(1)
+        print(f"WARNING: You are about to PERMANENTLY delete these {len(buckets)} buckets "
+              "and all of their objects and versions.")
+        confirm = input("Type 'yes' to confirm: ")
+        if confirm.lower() != 'yes':
+            print("Aborted by user.")
+            log.info("Operation aborted by user.")
+            sys.exit(0)
+
+    budget = Budget(args.list_workers, args.download_workers, args.workers)
+    clients = {}
+    clients_lock = threading.Lock()
+    Progress.quiet = True
+
+    def run(b):
+        with clients_lock:
+            if b['Region'] not in clients:
+                clients[b['Region']] = boto3.client('s3', region_name=b['Region'], config=config)
+        bucket_log = BucketLog(log, {'bucket': b['Name']})
+        bucket_log.info(f"Starting {'dry-run' if dry_run else 'destroy'}")
+        manifest_path = ':memory:' if dry_run else f"{b['Name']}.manifest.sqlite"
+        summary = nuke_bucket(clients[b['Region']], b['Name'], args, manifest_path, bucket_log,
+                              budget, raise_errors=False)
+        print(f"{b['Name']}: {summary['status']} ({summary['objects']} objects/versions, "
+              f"{summary['gone']} already gone, {summary['seconds']:.1f}s)")
+        return summary
+
+    with ThreadPoolExecutor(max_workers=args.parallel_buckets) as executor:
+        summaries = list(executor.map(run, buckets))
+    print_summary(summaries)
+    log.info(f"Summary: {json.dumps(summaries)}")
+    print(f"Logs can be found in {log_filename}")
+    if not dry_run and any(summary['status'] != 'deleted' for summary in summaries):
+        sys.exit(1)
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    main()
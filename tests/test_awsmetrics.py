@@ -0,0 +1,39 @@
+"""awsmetrics keys successes and errors alike."""
+
+# conftest.py puts the tool directories on sys.path
+# pylint: disable=import-error
+
+import boto3
+import pytest
+from botocore.config import Config
+from botocore.exceptions import EndpointConnectionError
+from moto import mock_aws
+
+import awsmetrics
+
+
+def test_errors_and_successes_share_a_key():
+    """a failed call is counted under the service name, not the service id."""
+    metrics = awsmetrics.ApiMetrics()
+    with mock_aws():
+        client = boto3.client("elbv2", region_name="us-east-1")
+        metrics.attach(client.meta.events)
+        client.describe_load_balancers()
+    # nothing listens on port 9, so the call raises instead of returning
+    broken = boto3.client(
+        "elbv2",
+        region_name="us-east-1",
+        endpoint_url="http://127.0.0.1:9",
+        aws_access_key_id="testing",
+        aws_secret_access_key="testing",
+        config=Config(retries={"total_max_attempts": 1}, connect_timeout=1),
+    )
+    metrics.attach(broken.meta.events)
+    with pytest.raises(EndpointConnectionError):
+        broken.describe_load_balancers()
+
+    assert list(metrics.operations) == [("elbv2", "DescribeLoadBalancers", "us-east-1")]
+    stats = metrics.operations[("elbv2", "DescribeLoadBalancers", "us-east-1")]
+    assert stats.calls == 2
+    assert stats.pages == 1
+    assert stats.errors == {"EndpointConnectionError": 1}
@@ -0,0 +1,78 @@
+"""local query index over inventory output."""
+
+# conftest.py puts the tool directories on sys.path
+# pylint: disable=import-error
+
+import json
+
+import index
+import inventory
+
+ACCOUNT = "123456789012"
+
+
+def write_output(directory, name, resources):
+    """write one output file the way a collector would."""
+    path = directory / f"{ACCOUNT}-{name}.json"
+    path.write_text(json.dumps(resources), encoding="utf-8")
+
+
+def test_types_come_from_the_collector_registry(tmp_path, monkeypatch):
+    """shard, config and custom collector outputs index under their resource type."""
+    monkeypatch.setattr(inventory, "COLLECTORS", dict(inventory.COLLECTORS))
+    inventory.register_collector(
+        "ec2",
+        "describe_snapshots",
+        "Snapshots",
+        shards=inventory.time_window_shards(first_year=2019),
+    )
+    data = tmp_path / ACCOUNT
+    data.mkdir()
+    snapshot = {"SnapshotId": "snap-1", "VolumeSize": 8}
+    write_output(data, "ec2-us-east-1-describe_snapshots-Snapshots-2019", [snapshot])
+    write_output(data, "ec2-us-east-1-describe_vpcs-Vpcs-config", [{"VpcId": "v-1"}])
+    write_output(data, "ec2-us-east-1-details-images", [{"ImageId": "ami-1"}])
+    write_output(data, "guardduty-us-east-1-findings", [{"Id": "f-1"}])
+    db_path = str(tmp_path / "index.sqlite")
+
+    assert index.build(str(tmp_path), db_path) == (4, 0, 0)
+
+    types = {row["type"] for row in index.query(db_path)}
+    assert types == {"Snapshots", "Vpcs", "Images", "Findings"}
+    assert index.query(db_path, resource_type="Snapshots")[0]["id"] == "snap-1"
+
+
+def test_numeric_fields_match_json_numbers(tmp_path):
+    """a numeric VALUE matches JSON numbers as well as strings."""
+    data = tmp_path / ACCOUNT
+    data.mkdir()
+    write_output(
+        data,
+        "ec2-us-east-1-describe_volumes-Volumes",
+        [
+            {"VolumeId": "vol-1", "Size": 8, "Iops": "100"},
+            {"VolumeId": "vol-2", "Size": 80, "Iops": "3000"},
+        ],
+    )
+    db_path = str(tmp_path / "index.sqlite")
+    index.build(str(tmp_path), db_path)
+
+    assert [r["id"] for r in index.query(db_path, fields=["Size=8"])] == ["vol-1"]
+    assert [r["id"] for r in index.query(db_path, fields=["Iops=3000"])] == ["vol-2"]
+
+
+def test_streamed_output_replaces_rendered_json(tmp_path):
+    """a .ndjson[.gz] output hides the .json of the same name."""
+    data = tmp_path / ACCOUNT
+    data.mkdir()
+    for name in (
+        "ec2-us-east-1-describe_vpcs-Vpcs",
+        "ec2-us-east-1-describe_volumes-Volumes",
+    ):
+        write_output(data, name, [])
+    (data / f"{ACCOUNT}-ec2-us-east-1-describe_vpcs-Vpcs.ndjson.gz").write_bytes(b"")
+
+    assert [p.rpartition("/")[2] for p in index.output_files(str(tmp_path))] == [
+        f"{ACCOUNT}-ec2-us-east-1-describe_volumes-Volumes.json",
+        f"{ACCOUNT}-ec2-us-east-1-describe_vpcs-Vpcs.ndjson.gz",
+    ]
@@ -0,0 +1,111 @@
+"""checkpoint journal and resumed listings."""
+
+# conftest.py puts the tool directories on sys.path
+# pylint: disable=import-error
+
+import json
+
+import boto3
+import pytest
+from moto import mock_aws
+
+import inventory
+
+ACCOUNT = "123456789012"
+GROUPS = inventory.Collector(
+    name="logs.groups",
+    service="logs",
+    method="describe_log_groups",
+    key="logGroups",
+    params={"limit": 5},
+    paginated=True,
+    func=None,
+    depends_on=(),
+    output="describe_log_groups-logGroups",
+    shards=(),
+)
+
+
+@pytest.fixture(name="streamed")
+def fixture_streamed(tmp_path, monkeypatch):
+    """plain streamed output under tmp_path, without tag enrichment."""
+    monkeypatch.setattr(inventory, "DATA_ROOT", str(tmp_path))
+    monkeypatch.setitem(inventory.OUTPUT_OPTIONS, "stream", True)
+    monkeypatch.setitem(inventory.OUTPUT_OPTIONS, "tags", False)
+    return tmp_path
+
+
+def test_journal_replays_finished_tasks_and_cursors(tmp_path):
+    """resume reads done tasks and the last cursor, ignoring a torn line."""
+    path = tmp_path / ".checkpoint.jsonl"
+    journal = inventory.CheckpointJournal(str(path))
+    journal.progress("a", "t1", 10, 5)
+    journal.progress("a", "t2", 20, 10)
+    journal.progress("b", "t1", 10, 5)
+    journal.finish("b", 7)
+    journal.close()
+    with open(path, "a", encoding="utf-8") as f:
+        f.write('{"task": "c", "tok')
+
+    resumed = inventory.CheckpointJournal(str(path), resume=True)
+    assert resumed.done == {"b"}
+    assert resumed.cursor("a") == {
+        "task": "a",
+        "token": "t2",
+        "offset": 20,
+        "count": 10,
+    }
+    assert not resumed.cursor("b")
+    resumed.close()
+
+    fresh = inventory.CheckpointJournal(str(path))
+    assert not fresh.done and not fresh.cursor("a")
+    fresh.close(remove=True)
+    assert not path.exists()
+
+
+def test_interrupted_listing_resumes_from_its_last_page(streamed):
+    """a resumed task truncates the torn page and lists only what is left."""
+    journal_path = streamed / ".checkpoint.jsonl"
+    with mock_aws():
+        logs = boto3.client("logs", region_name="us-east-1")
+        for i in range(23):
+            logs.create_log_group(logGroupName=f"group{i:02d}")
+        pool = inventory.ClientPool(
+            boto3.Session(region_name="us-east-1"), account_id=ACCOUNT
+        )
+        pool.checkpoint = inventory.CheckpointJournal(str(journal_path))
+        calls = []
+
+        def crash_on_third_page(**_):
+            calls.append(1)
+            if len(calls) == 3:
+                raise RuntimeError("killed")
+
+        client = pool.client("logs", "us-east-1")
+        client.meta.events.register(
+            "before-call.cloudwatch-logs.DescribeLogGroups", crash_on_third_page
+        )
+        with pytest.raises(RuntimeError):
+            inventory.run_collector(pool, GROUPS, "us-east-1")
+        pool.checkpoint.close()
+
+        output = (
+            streamed
+            / ACCOUNT
+            / "123456789012-logs-us-east-1-describe_log_groups-logGroups.ndjson"
+        )
+        # a page half written when the process died
+        with open(output, "a", encoding="utf-8") as f:
+            f.write('{"logGroupName": "torn')
+
+        pool.checkpoint = inventory.CheckpointJournal(str(journal_path), resume=True)
+        count = inventory.run_collector(pool, GROUPS, "us-east-1")
+        pool.checkpoint.close()
+
+    with open(output, encoding="utf-8") as f:
+        names = [json.loads(line)["logGroupName"] for line in f]
+    assert count == 23
+    assert sorted(names) == [f"group{i:02d}" for i in range(23)]
+    # two pages were journaled before the crash, so three more were fetched
+    assert len(calls) == 3 + 3
@@ -0,0 +1,97 @@
+"""config aggregator fast path."""
+
+# conftest.py puts the tool directories on sys.path
+# pylint: disable=import-error
+
+import json
+import os
+
+import boto3
+from botocore.stub import ANY, Stubber
+from moto import mock_aws
+
+import index
+import inventory
+
+ACCOUNT = "123456789012"
+
+
+ITEM = {
+    "accountId": ACCOUNT,
+    "awsRegion": "us-east-1",
+    "resourceType": "AWS::EC2::VPC",
+    "resourceId": "vpc-1",
+    "arn": f"arn:aws:ec2:us-east-1:{ACCOUNT}:vpc/vpc-1",
+    "configuration": json.dumps({"vpcId": "vpc-1", "cidrBlock": "10.0.0.0/16"}),
+    "tags": [{"key": "team", "value": "core"}],
+}
+
+
+def serve_from_config(tmp_path):
+    """plan vpcs and subnets and serve them from a stubbed aggregator holding ITEM."""
+    with mock_aws():
+        pool = inventory.ClientPool(
+            boto3.Session(region_name="us-east-1"), account_id=ACCOUNT
+        )
+        tasks = inventory.plan_tasks(
+            pool, ["us-east-1"], ["ec2.describe_vpcs", "ec2.describe_subnets"]
+        )
+        with Stubber(pool.client("config", "us-east-1")) as stub:
+            stub.add_response(
+                "select_aggregate_resource_config",
+                {"Results": [json.dumps(ITEM)]},
+                {"Expression": ANY, "ConfigurationAggregatorName": "org"},
+            )
+            return inventory.collect_from_config(
+                pool,
+                "org@us-east-1",
+                tasks,
+                inventory.TaskHistory(str(tmp_path / "history.json")),
+            )
+
+
+def test_config_items_get_their_own_output(tmp_path, monkeypatch):
+    """served types are written in config's shape next to, not into, api files."""
+    monkeypatch.setattr(inventory, "DATA_ROOT", str(tmp_path))
+    remaining, report = serve_from_config(tmp_path)
+
+    assert [task.name for task in remaining] == [
+        f"{ACCOUNT}:ec2.describe_subnets@us-east-1"
+    ]
+    assert report["collectors"]["ec2.describe_vpcs"]["source"] == "config"
+    data_dir = tmp_path / ACCOUNT
+    assert not os.path.exists(
+        data_dir / f"{ACCOUNT}-ec2-us-east-1-describe_vpcs-Vpcs.json"
+    )
+    with open(
+        data_dir / f"{ACCOUNT}-ec2-us-east-1-describe_vpcs-Vpcs-config.json",
+        encoding="utf-8",
+    ) as f:
+        written = json.load(f)
+    assert written == [
+        {**ITEM, "configuration": {"vpcId": "vpc-1", "cidrBlock": "10.0.0.0/16"}}
+    ]
+
+
+def test_config_output_replaces_an_earlier_api_output(tmp_path, monkeypatch):
+    """a served task's api output from an earlier run is removed and unindexed."""
+    monkeypatch.setattr(inventory, "DATA_ROOT", str(tmp_path))
+    data_dir = tmp_path / ACCOUNT
+    data_dir.mkdir()
+    stale = [
+        data_dir / f"{ACCOUNT}-ec2-us-east-1-describe_vpcs-Vpcs.json",
+        data_dir / f"{ACCOUNT}-ec2-us-east-1-describe_vpcs-Vpcs.ndjson.gz",
+    ]
+    stale[0].write_text(json.dumps([{"VpcId": "vpc-old"}]), encoding="utf-8")
+    db_path = str(tmp_path / "index.sqlite")
+    index.build(str(tmp_path), db_path)
+    assert index.query(db_path, resource_id="vpc-old")
+    stale[1].write_bytes(b"")
+
+    serve_from_config(tmp_path)
+
+    assert not any(os.path.exists(path) for path in stale)
+    assert index.build(str(tmp_path), db_path) == (1, 0, 1)
+    assert [row["arn"] for row in index.query(db_path, resource_type="Vpcs")] == [
+        ITEM["arn"]
+    ]
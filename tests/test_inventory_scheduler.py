@@ -0,0 +1,114 @@
+"""run_scheduled dependency handling."""
+
+# conftest.py puts the tool directories on sys.path
+# pylint: disable=import-error
+
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import inventory
+
+
+def make_task(name, func, depends_on=()):
+    """a task in one account and region, its service taken from its name."""
+    return inventory.Task(
+        name,
+        "111111111111",
+        "us-east-1",
+        name.split(".")[0],
+        func,
+        (),
+        tuple(depends_on),
+    )
+
+
+def run(tasks, **kwargs):
+    """names of the tasks that ran, in the order they finished."""
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        return [
+            task.name for task, _ in inventory.run_scheduled(executor, tasks, **kwargs)
+        ]
+
+
+def fail():
+    """a collector that always fails."""
+    raise RuntimeError("boom")
+
+
+def test_dependents_run_after_their_dependency():
+    """a dependent is only started once its dependency has finished."""
+    tasks = [
+        make_task("elbv2.health", lambda: None, ["elbv2.groups"]),
+        make_task("elbv2.groups", lambda: None),
+    ]
+    assert run(tasks) == ["elbv2.groups", "elbv2.health"]
+
+
+def test_failed_task_skips_its_dependents(capsys):
+    """dependents of a failed task, direct or not, never run."""
+    tasks = [
+        make_task("elbv2.groups", fail),
+        make_task("elbv2.health", lambda: None, ["elbv2.groups"]),
+        make_task("elbv2.report", lambda: None, ["elbv2.health"]),
+        make_task("ec2.vpcs", lambda: None),
+    ]
+    assert run(tasks) == ["ec2.vpcs"]
+    out = capsys.readouterr().out
+    assert "Error running elbv2.groups: boom" in out
+    assert "Skipping elbv2.health: elbv2.groups failed" in out
+    assert "Skipping elbv2.report: elbv2.health failed" in out
+
+
+def test_finished_tasks_release_dependents():
+    """tasks that ran in an earlier run count as finished."""
+    tasks = [make_task("elbv2.health", lambda: None, ["elbv2.groups"])]
+    assert run(tasks, finished=["elbv2.groups"]) == ["elbv2.health"]
+
+
+def test_unmet_dependency_is_skipped(capsys):
+    """a dependency nobody provides is reported instead of hanging."""
+    tasks = [make_task("elbv2.health", lambda: None, ["elbv2.groups"])]
+    assert not run(tasks)
+    assert "Skipping elbv2.health: unmet" in capsys.readouterr().out
+
+
+def test_tasks_and_fan_outs_share_the_worker_budget():
+    """running tasks plus their nested calls never exceed WORKERS."""
+    lock = threading.Lock()
+    in_flight = {"tasks": 0, "calls": 0}
+    peak = {"tasks": 0, "calls": 0, "total": 0}
+
+    def enter(kind):
+        with lock:
+            in_flight[kind] += 1
+            peak[kind] = max(peak[kind], in_flight[kind])
+            peak["total"] = max(peak["total"], in_flight["tasks"] + in_flight["calls"])
+
+    def leave(kind):
+        with lock:
+            in_flight[kind] -= 1
+
+    def nested(_):
+        enter("calls")
+        time.sleep(0.005)
+        leave("calls")
+
+    def task():
+        enter("tasks")
+        try:
+            for _ in inventory.fan_out(nested, range(10)):
+                pass
+        finally:
+            leave("tasks")
+
+    tasks = [make_task(f"svc{i}.list", task) for i in range(60)]
+    with ThreadPoolExecutor(max_workers=inventory.WORKERS) as executor:
+        list(
+            inventory.run_scheduled(
+                executor, tasks, region_limit=100, service_limit=100
+            )
+        )
+    assert peak["tasks"] <= inventory.TASK_WORKERS
+    assert peak["calls"] <= inventory.NESTED_WORKERS
+    assert peak["total"] <= inventory.WORKERS
@@ -0,0 +1,660 @@
+"""s3_bucket_nuke backups, manifests and listings."""
+
+# conftest.py puts the tool directories on sys.path
+# pylint: disable=import-error
+
+import glob
+import gzip
+import hashlib
+import io
+import json
+import logging
+import os
+import sys
+import tarfile
+import threading
+from types import SimpleNamespace
+
+import boto3
+import botocore.client
+import pytest
+from boto3.s3.transfer import TransferConfig
+from botocore.stub import Stubber
+from moto import mock_aws
+
+import s3_bucket_nuke
+
+BUCKET = "nuke-test"
+MIB = 1024 * 1024
+LOG = logging.getLogger(__name__)
+
+
+@pytest.fixture(name="s3")
+def fixture_s3(monkeypatch):
+    """a moto s3 client whose calls are serialized across worker threads."""
+    # the one method every client call goes through
+    # pylint: disable-next=protected-access
+    make_api_call = botocore.client.BaseClient._make_api_call
+    lock = threading.Lock()
+
+    def serialized(self, operation_name, api_params):
+        with lock:
+            return make_api_call(self, operation_name, api_params)
+
+    # moto's s3 backend is not safe to call from many threads at once
+    monkeypatch.setattr(botocore.client.BaseClient, "_make_api_call", serialized)
+    with mock_aws():
+        client = boto3.client("s3", region_name="us-east-1")
+        client.create_bucket(Bucket=BUCKET)
+        yield client
+
+
+def listed_manifest(s3, tmp_path):
+    """a manifest holding a sequential listing of the test bucket."""
+    manifest = s3_bucket_nuke.Manifest(str(tmp_path / "manifest.sqlite"))
+    s3_bucket_nuke.list_objects(s3, BUCKET, manifest, LOG, workers=1)
+    return manifest
+
+
+def test_local_paths_are_unique_per_key():
+    """keys the filesystem would fold together each get their own path."""
+    keys = ["a/b", "a//b", "a/./b", "a/../b", "./a/b", "/a/b", "a/b/", "a/", "a"]
+    keys += ["%00", "a/%2E/b", ".versions/a/v1", "%2Eversions/a/v1", "a%", "a/b%"]
+    prefixes = {key for key in keys if any(k.startswith(f"{key}/") for k in keys)}
+    paths = {
+        s3_bucket_nuke.local_path("backup", key, prefix=key in prefixes) for key in keys
+    }
+    paths.add(s3_bucket_nuke.local_path("backup", "a", "v1", latest=False, prefix=True))
+    assert len(paths) == len(keys) + 1
+    assert all(os.path.normpath(path) == path for path in paths)
+    # no key's file is a directory another key's file needs
+    directories = set()
+    for path in paths:
+        while path != "backup":
+            path = os.path.dirname(path)
+            directories.add(path)
+    assert not paths & directories
+
+
+def test_etag_check_single_and_multipart():
+    """single part ETags are the MD5; multipart ones the MD5 of part MD5s."""
+    data = os.urandom(12 * MIB)
+    single = s3_bucket_nuke.EtagCheck(len(data), f'"{hashlib.md5(data).hexdigest()}"')
+    parts = [data[: 5 * MIB], data[5 * MIB : 10 * MIB], data[10 * MIB :]]
+    md5s = b"".join(hashlib.md5(part).digest() for part in parts)
+    multipart = s3_bucket_nuke.EtagCheck(
+        len(data), f'"{hashlib.md5(md5s).hexdigest()}-3"'
+    )
+    for check in (single, multipart):
+        for offset in range(0, len(data), 3 * MIB):
+            check.update(data[offset : offset + 3 * MIB])
+        assert check.matches()
+
+    corrupt = s3_bucket_nuke.EtagCheck(
+        len(data), f'"{hashlib.md5(md5s).hexdigest()}-3"'
+    )
+    corrupt.update(data[:-1] + bytes([data[-1] ^ 1]))
+    assert not corrupt.matches()
+
+
+def test_downloads_verify_etags_and_skip_finished_files(s3, tmp_path):
+    """small and multipart objects are verified; a rerun skips them."""
+    s3.put_object(Bucket=BUCKET, Key="small", Body=b"small object")
+    upload = s3.create_multipart_upload(Bucket=BUCKET, Key="dir/large")
+    data = os.urandom(11 * MIB)
+    parts = []
+    for number, offset in enumerate(range(0, len(data), 5 * MIB), 1):
+        part = s3.upload_part(
+            Bucket=BUCKET,
+            Key="dir/large",
+            UploadId=upload["UploadId"],
+            PartNumber=number,
+            Body=data[offset : offset + 5 * MIB],
+        )
+        parts.append({"PartNumber": number, "ETag": part["ETag"]})
+    s3.complete_multipart_upload(
+        Bucket=BUCKET,
+        Key="dir/large",
+        UploadId=upload["UploadId"],
+        MultipartUpload={"Parts": parts},
+    )
+    manifest = listed_manifest(s3, tmp_path)
+    backup = str(tmp_path / "backup")
+
+    failed = s3_bucket_nuke.download_objects(s3, BUCKET, manifest, backup, False, LOG)
+
+    assert failed == 0
+    assert manifest.counts() == {"verified": 2}
+    with open(os.path.join(backup, "dir", "large"), "rb") as f:
+        assert f.read() == data
+    assert not os.path.exists(os.path.join(backup, "small.part"))
+
+    manifest.db.execute("UPDATE objects SET state = 'listed'")
+    s3.delete_objects(
+        Bucket=BUCKET, Delete={"Objects": [{"Key": "small"}, {"Key": "dir/large"}]}
+    )
+    # both are found on disk, so nothing is fetched from the emptied bucket
+    assert (
+        s3_bucket_nuke.download_objects(s3, BUCKET, manifest, backup, False, LOG) == 0
+    )
+    assert manifest.counts() == {"verified": 2}
+
+
+def test_shared_local_path_blocks_the_second_key(s3, tmp_path, monkeypatch):
+    """an object whose path another key holds is neither backed up nor deleted."""
+    s3.put_object(Bucket=BUCKET, Key="a", Body=b"first")
+    s3.put_object(Bucket=BUCKET, Key="b", Body=b"second")
+    manifest = listed_manifest(s3, tmp_path)
+    monkeypatch.setattr(
+        s3_bucket_nuke,
+        "local_path",
+        lambda directory, *_: os.path.join(directory, "same"),
+    )
+
+    failed = s3_bucket_nuke.download_objects(
+        s3, BUCKET, manifest, str(tmp_path / "backup"), False, LOG
+    )
+
+    assert failed == 1
+    assert manifest.counts() == {"verified": 1, "listed": 1}
+
+
+def test_failed_small_download_leaves_no_part_file(s3, tmp_path):
+    """the temp file of a small object is removed when its download fails."""
+    s3.put_object(Bucket=BUCKET, Key="small", Body=b"small object")
+    manifest = listed_manifest(s3, tmp_path)
+    obj = next(manifest.rows("1"))
+    path = str(tmp_path / "small")
+
+    def broken_chunks(_size):
+        """one chunk, then a dropped connection."""
+        yield b"small"
+        raise ConnectionError("connection reset")
+
+    s3.get_object = lambda **_: {"Body": SimpleNamespace(iter_chunks=broken_chunks)}
+    with pytest.raises(ConnectionError):
+        s3_bucket_nuke.download_object(s3, BUCKET, obj, path, TransferConfig())
+    assert not os.path.exists(f"{path}.part")
+
+
+def nuke_args(**overrides):
+    """the parsed command line of a plain single bucket run."""
+    args = {
+        "dry_run": False,
+        "resume": False,
+        "inventory": None,
+        "archive": False,
+        "archive_compression": None,
+        "archive_size": s3_bucket_nuke.ARCHIVE_SHARD_SIZE,
+        "list_workers": 1,
+        "download_workers": 4,
+        "workers": 2,
+        "multipart_threshold": s3_bucket_nuke.MULTIPART_THRESHOLD // MIB,
+        "chunk_size": s3_bucket_nuke.MULTIPART_CHUNK_SIZE // MIB,
+        "max_concurrency": 2,
+    }
+    args.update(overrides)
+    return SimpleNamespace(**args)
+
+
+def test_resumed_listing_continues_from_the_manifest(s3, tmp_path, monkeypatch):
+    """a crashed listing resumes at its saved marker and the run then finishes."""
+    monkeypatch.chdir(tmp_path)
+    for i in range(23):
+        s3.put_object(Bucket=BUCKET, Key=f"key-{i:02d}", Body=b"x")
+    list_objects_v2 = s3.list_objects_v2
+    calls = []
+
+    def crashing_list(**params):
+        """five keys a page; the third call fails."""
+        calls.append(params)
+        if len(calls) == 3:
+            raise ConnectionError("connection reset")
+        return list_objects_v2(MaxKeys=5, **params)
+
+    s3.list_objects_v2 = crashing_list
+    with pytest.raises(ConnectionError):
+        s3_bucket_nuke.nuke_bucket(s3, BUCKET, nuke_args(), "nuke.sqlite", LOG)
+    manifest = s3_bucket_nuke.Manifest("nuke.sqlite")
+    assert manifest.counts() == {"listed": 10}
+    manifest.close()
+
+    summary = s3_bucket_nuke.nuke_bucket(
+        s3, BUCKET, nuke_args(resume=True), "nuke.sqlite", LOG
+    )
+
+    assert summary["status"] == "deleted"
+    assert summary["objects"] == 23
+    # the two pages before the crash are not listed again
+    assert len(calls) == 3 + 3
+    assert "ContinuationToken" in calls[3]
+    assert BUCKET not in [b["Name"] for b in s3.list_buckets()["Buckets"]]
+    assert sorted(os.listdir(BUCKET)) == [f"key-{i:02d}" for i in range(23)]
+
+
+def test_deleted_bucket_leaves_no_manifest(s3, tmp_path, monkeypatch):
+    """a later bucket of the same name starts from a fresh listing."""
+    monkeypatch.chdir(tmp_path)
+    s3.put_object(Bucket=BUCKET, Key="first", Body=b"x")
+    summary = s3_bucket_nuke.nuke_bucket(s3, BUCKET, nuke_args(), "nuke.sqlite", LOG)
+    assert summary["status"] == "deleted"
+    assert not [name for name in os.listdir(tmp_path) if name.startswith("nuke.sqlite")]
+
+    s3.create_bucket(Bucket=BUCKET)
+    s3.put_object(Bucket=BUCKET, Key="second", Body=b"x")
+    summary = s3_bucket_nuke.nuke_bucket(
+        s3, BUCKET, nuke_args(resume=True), "nuke.sqlite", LOG
+    )
+    assert summary["status"] == "deleted"
+    assert sorted(os.listdir(BUCKET)) == ["first", "second"]
+
+
+def test_key_that_is_also_a_prefix_is_backed_up(s3, tmp_path, monkeypatch):
+    """logs and logs/2024.txt both get a file and the bucket is deleted."""
+    monkeypatch.chdir(tmp_path)
+    s3.put_object(Bucket=BUCKET, Key="logs", Body=b"a file")
+    s3.put_object(Bucket=BUCKET, Key="logs/2024.txt", Body=b"a file under it")
+
+    summary = s3_bucket_nuke.nuke_bucket(s3, BUCKET, nuke_args(), "nuke.sqlite", LOG)
+
+    assert (summary["status"], summary["objects"]) == ("deleted", 2)
+    with open(os.path.join(BUCKET, "logs%"), "rb") as f:
+        assert f.read() == b"a file"
+    with open(os.path.join(BUCKET, "logs", "2024.txt"), "rb") as f:
+        assert f.read() == b"a file under it"
+
+
+def small_pages(s3, page_size=7):
+    """list in small pages, with S3's KeyMarker semantics for versions.
+
+    given a KeyMarker alone, S3 lists the keys after it; moto also drops
+    the first version after it, so such calls are reissued from the last
+    existing key up to the marker and trimmed to what follows the marker.
+    """
+    list_objects_v2 = s3.list_objects_v2
+    list_object_versions = s3.list_object_versions
+
+    def versions(**params):
+        """one page of versions and delete markers."""
+        marker = params.get("KeyMarker")
+        if marker is None or params.get("VersionIdMarker") or params.get("Delimiter"):
+            return list_object_versions(MaxKeys=page_size, **params)
+        everything = list_object_versions(Bucket=params["Bucket"])
+        names = [
+            item["Key"]
+            for field in ("Versions", "DeleteMarkers")
+            for item in everything.get(field, [])
+        ]
+        before = max((name for name in names if name <= marker), default=None)
+        params.pop("KeyMarker")
+        if before is not None:
+            params["KeyMarker"] = before
+        page = list_object_versions(MaxKeys=page_size, **params)
+        for field in ("Versions", "DeleteMarkers"):
+            page[field] = [item for item in page.get(field, []) if item["Key"] > marker]
+        return page
+
+    s3.list_objects_v2 = lambda **params: list_objects_v2(MaxKeys=page_size, **params)
+    s3.list_object_versions = versions
+
+
+def fill_bucket(s3, versioned):
+    """keys under a few prefixes; versioned keys get versions and delete markers."""
+    if versioned:
+        s3.put_bucket_versioning(
+            Bucket=BUCKET, VersioningConfiguration={"Status": "Enabled"}
+        )
+    for prefix in ("", "a/", "b/", "b/c/", "d/", "e/"):
+        for i in range(12):
+            key = f"{prefix}key-{i:02d}"
+            s3.put_object(Bucket=BUCKET, Key=key, Body=b"x")
+            if versioned and i % 3 == 0:
+                s3.put_object(Bucket=BUCKET, Key=key, Body=b"y")
+            if versioned and i % 4 == 0:
+                s3.delete_object(Bucket=BUCKET, Key=key)
+
+
+def every_entry(s3, versioned):
+    """(key, version id, delete marker) of everything in the bucket."""
+    if not versioned:
+        pages = s3.get_paginator("list_objects_v2").paginate(Bucket=BUCKET)
+        return {(o["Key"], "", 0) for page in pages for o in page.get("Contents", [])}
+    entries = set()
+    for page in s3.get_paginator("list_object_versions").paginate(Bucket=BUCKET):
+        entries |= {(v["Key"], v["VersionId"], 0) for v in page.get("Versions", [])}
+        entries |= {
+            (m["Key"], m["VersionId"], 1) for m in page.get("DeleteMarkers", [])
+        }
+    return entries
+
+
+@pytest.mark.parametrize("versioned", [False, True])
+def test_sharded_listing_is_complete(s3, tmp_path, monkeypatch, versioned):
+    """split shards together list every key and version exactly once."""
+    monkeypatch.setattr(s3_bucket_nuke, "SPLIT_PAGES", 2)
+    fill_bucket(s3, versioned)
+    expected = every_entry(s3, versioned)
+    small_pages(s3)
+    manifest = s3_bucket_nuke.Manifest(str(tmp_path / "manifest.sqlite"))
+
+    s3_bucket_nuke.list_objects(s3, BUCKET, manifest, LOG, workers=4)
+
+    rows = list(manifest.rows("1"))
+    assert len(rows) == len(expected)
+    assert {(r["Key"], r["VersionId"], r["DeleteMarker"]) for r in rows} == expected
+    shards = manifest.db.execute("SELECT COUNT(*), SUM(done) FROM shards").fetchone()
+    assert shards[0] > 4
+    assert shards[0] == shards[1]
+
+
+def test_dry_run_with_inventory_reports_each_object_once(
+    s3, tmp_path, monkeypatch, capsys
+):
+    """objects from the inventory and the listing are each reported once."""
+    monkeypatch.chdir(tmp_path)
+    keys = ["old-1", "old-2", "new-1"]
+    for key in keys:
+        s3.put_object(Bucket=BUCKET, Key=key, Body=b"x")
+    with gzip.open(tmp_path / "data.csv.gz", "wt", encoding="utf-8") as f:
+        for key in keys[:2]:
+            f.write(f'"{BUCKET}","{key}","1","9dd4e461268c8034f5c8564e155c67a6"\n')
+    (tmp_path / "manifest.json").write_text(
+        json.dumps(
+            {
+                "sourceBucket": BUCKET,
+                "destinationBucket": "arn:aws:s3:::inventories",
+                "fileFormat": "CSV",
+                "fileSchema": "Bucket, Key, Size, ETag",
+                "files": [{"key": "inventory/data.csv.gz"}],
+            }
+        ),
+        encoding="utf-8",
+    )
+    args = nuke_args(dry_run=True, inventory=str(tmp_path / "manifest.json"))
+
+    summary = s3_bucket_nuke.nuke_bucket(s3, BUCKET, args, ":memory:", LOG)
+
+    assert summary["status"] == "dry run"
+    output = capsys.readouterr().out
+    for key in keys:
+        assert output.count(f"Would download {key}\n") == 1
+        assert output.count(f"Would delete {{'Key': '{key}'}}") == 1
+
+
+def test_vanished_objects_are_reported_as_gone(s3, tmp_path, monkeypatch):
+    """objects deleted by someone else are neither counted as deleted nor failed."""
+    monkeypatch.chdir(tmp_path)
+    for key in ("kept", "vanished"):
+        s3.put_object(Bucket=BUCKET, Key=key, Body=b"x")
+    manifest = listed_manifest(s3, tmp_path)
+    manifest.close()
+    s3.delete_object(Bucket=BUCKET, Key="vanished")
+
+    summary = s3_bucket_nuke.nuke_bucket(
+        s3, BUCKET, nuke_args(resume=True), str(tmp_path / "manifest.sqlite"), LOG
+    )
+
+    assert summary["status"] == "deleted"
+    assert (summary["objects"], summary["gone"], summary["failed"]) == (1, 1, 0)
+
+
+def stubbed_s3():
+    """an s3 client that only talks to a Stubber."""
+    return boto3.client(
+        "s3",
+        region_name="us-east-1",
+        aws_access_key_id="testing",
+        aws_secret_access_key="testing",
+    )
+
+
+def delete_params(*objects):
+    """the delete_objects call for objects."""
+    return {"Bucket": BUCKET, "Delete": {"Objects": list(objects), "Quiet": True}}
+
+
+def test_delete_batch_backs_off_on_slowdown(monkeypatch):
+    """a throttled call and throttled keys are retried after a growing delay."""
+    sleeps = []
+    monkeypatch.setattr(s3_bucket_nuke.time, "sleep", sleeps.append)
+    client = stubbed_s3()
+    backoff = s3_bucket_nuke.Backoff(initial=0.1)
+    progress = s3_bucket_nuke.Progress("Deleted")
+    with Stubber(client) as stub:
+        stub.add_client_error(
+            "delete_objects",
+            service_error_code="SlowDown",
+            http_status_code=503,
+            expected_params=delete_params({"Key": "a"}, {"Key": "b"}),
+        )
+        stub.add_response(
+            "delete_objects",
+            {"Errors": [{"Key": "b", "Code": "SlowDown", "Message": "Slow down"}]},
+            delete_params({"Key": "a"}, {"Key": "b"}),
+        )
+        stub.add_response("delete_objects", {}, delete_params({"Key": "b"}))
+        failed = s3_bucket_nuke.delete_batch(
+            client, BUCKET, [{"Key": "a"}, {"Key": "b"}], LOG, backoff, progress
+        )
+        stub.assert_no_pending_responses()
+
+    assert not failed
+    assert (progress.count, progress.failed) == (2, 0)
+    # 0.1s then 0.2s, each with +-50% jitter, and halved again after success
+    assert 0.05 <= sleeps[0] <= 0.15 and 0.1 <= sleeps[1] <= 0.3
+    assert len(sleeps) == 2 and backoff.delay == 0.1
+
+
+def test_delete_batch_gives_up_after_max_attempts():
+    """retryable keys stop after MAX_ATTEMPTS calls; others fail at once."""
+    client = stubbed_s3()
+    progress = s3_bucket_nuke.Progress("Deleted")
+    error = {"Key": "a", "Code": "InternalError", "Message": "Try again"}
+    with Stubber(client) as stub:
+        stub.add_response(
+            "delete_objects",
+            {
+                "Errors": [
+                    error,
+                    {"Key": "b", "VersionId": "v1", "Code": "AccessDenied"},
+                ]
+            },
+            delete_params({"Key": "a"}, {"Key": "b", "VersionId": "v1"}),
+        )
+        for _ in range(s3_bucket_nuke.MAX_ATTEMPTS - 1):
+            stub.add_response(
+                "delete_objects", {"Errors": [error]}, delete_params({"Key": "a"})
+            )
+        failed = s3_bucket_nuke.delete_batch(
+            client,
+            BUCKET,
+            [{"Key": "a"}, {"Key": "b", "VersionId": "v1"}],
+            LOG,
+            s3_bucket_nuke.Backoff(),
+            progress,
+        )
+        stub.assert_no_pending_responses()
+
+    assert failed == [{"Key": "b", "VersionId": "v1"}, {"Key": "a"}]
+    assert (progress.count, progress.failed) == (0, 2)
+
+
+def test_failed_deletes_keep_the_bucket_and_exit_non_zero(s3, tmp_path, monkeypatch):
+    """a key that cannot be deleted keeps the bucket, its manifest and exits 1."""
+    monkeypatch.chdir(tmp_path)
+    for key in ("free", "locked"):
+        s3.put_object(Bucket=BUCKET, Key=key, Body=b"x")
+    # pylint: disable-next=protected-access
+    make_api_call = botocore.client.BaseClient._make_api_call
+
+    def locked_key(self, operation_name, api_params):
+        """delete_objects reports AccessDenied for "locked" and deletes the rest."""
+        if operation_name != "DeleteObjects":
+            return make_api_call(self, operation_name, api_params)
+        delete = api_params["Delete"]
+        allowed = [entry for entry in delete["Objects"] if entry["Key"] != "locked"]
+        response = make_api_call(
+            self,
+            operation_name,
+            {**api_params, "Delete": {**delete, "Objects": allowed}},
+        )
+        denied = {"Key": "locked", "Code": "AccessDenied", "Message": "Access Denied"}
+        return {**response, "Errors": [denied]}
+
+    monkeypatch.setattr(botocore.client.BaseClient, "_make_api_call", locked_key)
+    monkeypatch.setenv("AWS_DEFAULT_REGION", "us-east-1")
+    monkeypatch.setattr(
+        sys, "argv", ["s3_bucket_nuke.py", BUCKET, "--list-workers", "1"]
+    )
+    monkeypatch.setattr("builtins.input", lambda prompt: "yes")
+
+    with pytest.raises(SystemExit) as exited:
+        s3_bucket_nuke.main()
+
+    assert exited.value.code == 1
+    assert [o["Key"] for o in s3.list_objects_v2(Bucket=BUCKET)["Contents"]] == [
+        "locked"
+    ]
+    manifest = s3_bucket_nuke.Manifest(f"{BUCKET}.manifest.sqlite")
+    assert manifest.counts() == {"deleted": 1, "verified": 1}
+    manifest.close()
+
+
+ARCHIVED = {
+    "small": b"small object",
+    "logs": b"a key that is also a prefix",
+    "logs/2024.txt": b"a key under it",
+    "dir/large": os.urandom(3 * MIB + 7),
+}
+
+
+def read_shard(path, compression):
+    """the members of a tar shard, by name."""
+    with open(path, "rb") as f:
+        raw = f.read()
+    if compression == "gzip":
+        raw = gzip.decompress(raw)
+    elif compression == "zstd":
+        zstandard = pytest.importorskip("zstandard")
+        reader = zstandard.ZstdDecompressor().stream_reader(
+            io.BytesIO(raw), read_across_frames=True
+        )
+        raw = reader.read()
+    with tarfile.open(fileobj=io.BytesIO(raw)) as tar:
+        return {m.name: tar.extractfile(m).read() for m in tar.getmembers()}
+
+
+def archive_index(archive_dir):
+    """every index entry, by shard."""
+    entries = {}
+    for path in sorted(glob.glob(os.path.join(archive_dir, "part-*.index.jsonl"))):
+        with open(path, encoding="utf-8") as f:
+            entries[path[: -len(".index.jsonl")]] = [json.loads(line) for line in f]
+    return entries
+
+
+@pytest.mark.parametrize("compression", [None, "gzip", "zstd"])
+def test_archive_round_trip(s3, tmp_path, monkeypatch, compression):
+    """every object is a tar member in its own frame and extracts from its offset."""
+    if compression == "zstd":
+        pytest.importorskip("zstandard")
+    monkeypatch.chdir(tmp_path)
+    for key, body in ARCHIVED.items():
+        s3.put_object(Bucket=BUCKET, Key=key, Body=body)
+
+    summary = s3_bucket_nuke.nuke_bucket(
+        s3,
+        BUCKET,
+        nuke_args(archive=True, archive_compression=compression),
+        "nuke.sqlite",
+        LOG,
+    )
+
+    assert (summary["status"], summary["objects"]) == ("deleted", len(ARCHIVED))
+    archive_dir = f"{BUCKET}.archive"
+    members = {}
+    for shard, entries in archive_index(archive_dir).items():
+        assert shard.endswith(s3_bucket_nuke.ARCHIVE_SUFFIXES[compression])
+        members.update(read_shard(shard, compression))
+        with open(shard, "rb") as f:
+            raw = f.read()
+        # members are whole frames, back to back from the start of the shard
+        assert entries[0]["offset"] == 0
+        for entry, following in zip(entries, entries[1:]):
+            assert following["offset"] == entry["offset"] + entry["length"]
+        for entry in entries:
+            frame = raw[entry["offset"] : entry["offset"] + entry["length"]]
+            data = s3_bucket_nuke.frame_reader(compression).decompress(frame)
+            body = data[entry["header"] : entry["header"] + entry["size"]]
+            assert body == ARCHIVED[entry["key"]]
+    assert members == {
+        s3_bucket_nuke.local_path("", key, prefix=key == "logs"): body
+        for key, body in ARCHIVED.items()
+    }
+
+    for key, body in ARCHIVED.items():
+        entry = s3_bucket_nuke.find_archived(archive_dir, key)
+        path = str(tmp_path / "restored" / entry["member"])
+        s3_bucket_nuke.extract_object(entry, path)
+        with open(path, "rb") as f:
+            assert f.read() == body
+    monkeypatch.setattr(sys, "argv", ["s3_bucket_nuke.py", BUCKET, "--extract", "logs"])
+    s3_bucket_nuke.main()
+    with open(os.path.join(BUCKET, "logs%"), "rb") as f:
+        assert f.read() == ARCHIVED["logs"]
+
+
+def test_archive_shards_roll_over(s3, tmp_path):
+    """a worker starts a new shard once its current one reaches the size cap."""
+    for key in ("a", "b", "c"):
+        s3.put_object(Bucket=BUCKET, Key=key, Body=key.encode() * 1000)
+    manifest = listed_manifest(s3, tmp_path)
+    archive = s3_bucket_nuke.ArchiveWriter(str(tmp_path / "archive"), shard_size=1)
+
+    failed = s3_bucket_nuke.download_objects(
+        s3, BUCKET, manifest, BUCKET, False, LOG, workers=1, archive=archive
+    )
+
+    assert failed == 0
+    shards = archive_index(str(tmp_path / "archive"))
+    assert [os.path.basename(shard) for shard in shards] == [
+        "part-00001.tar",
+        "part-00002.tar",
+        "part-00003.tar",
+    ]
+    assert [[entry["key"] for entry in entries] for entries in shards.values()] == [
+        ["a"],
+        ["b"],
+        ["c"],
+    ]
+    assert [read_shard(shard, None) for shard in shards] == [
+        {key: key.encode() * 1000} for key in ("a", "b", "c")
+    ]
+
+
+def test_failed_member_is_cut_from_the_shard(s3, tmp_path):
+    """a member whose download fails leaves no bytes or index entry behind."""
+    for key in ("before", "short", "after"):
+        s3.put_object(Bucket=BUCKET, Key=key, Body=key.encode() * 100)
+    manifest = listed_manifest(s3, tmp_path)
+    objects = {obj["Key"]: obj for obj in manifest.rows("1")}
+    archive = s3_bucket_nuke.ArchiveWriter(str(tmp_path / "archive"), "gzip")
+
+    archive.add(s3, BUCKET, objects["before"], "before")
+    shard = archive.shard()
+    size = shard["file"].tell()
+    with pytest.raises(ValueError):
+        # more bytes are expected than the object has
+        archive.add(s3, BUCKET, dict(objects["short"], Size=1000), "short")
+    assert shard["file"].tell() == size
+    archive.add(s3, BUCKET, objects["after"], "after")
+    archive.close()
+
+    shards = archive_index(str(tmp_path / "archive"))
+    assert len(shards) == 1
+    path, entries = next(iter(shards.items()))
+    assert [entry["key"] for entry in entries] == ["before", "after"]
+    assert read_shard(path, "gzip") == {
+        "before": b"before" * 100,
+        "after": b"after" * 100,
+    }